@@ -44,11 +44,15 @@ def _load_config(path: str) -> dict:
 
 
 def _iter_node_modules(nodes_root: str) -> Iterable[str]:
-    """扫描 `py/nodes`，返回可导入模块路径。"""
+    """扫描 `py/nodes`，返回可导入的节点模块路径。
+
+    只导入 `*_nodes.py`；runtime/backend 等辅助模块由节点按需导入，
+    避免启动时加载 torch/transformers 全家桶。
+    """
     if not os.path.isdir(nodes_root):
         raise FileNotFoundError(nodes_root)
     for file in sorted(os.listdir(nodes_root)):
-        if file.endswith(".py") and file != "__init__.py":
+        if file.endswith("_nodes.py"):
             yield f".py.nodes.{file[:-3]}"
 
 
@@ -6,15 +6,28 @@ The repository deliberately keeps image files outside the index.  The index stor
 captions, relative paths, metadata, and optional normalized embeddings only.
 """
 
+import collections.abc
 import hashlib
 import json
 import math
+import os
 import random
 import re
+import tarfile
+import tempfile
+import time
+from array import array
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
+import numpy as np
+
+try:
+    import fcntl
+except Exception:  # pragma: no cover - Windows fallback
+    fcntl = None
 
 _IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
 _TOKEN_RE = re.compile(r"[a-z0-9]+", re.IGNORECASE)
@@ -27,7 +40,28 @@ _EXPLORATION_PROFILES = {
     "Medium": {"candidate_k": 16, "relevance": 0.65, "diversity": 0.35, "sampling_temperature": 0.20},
     "Strong": {"candidate_k": 16, "relevance": 0.50, "diversity": 0.50, "sampling_temperature": 0.32},
 }
-_EMBEDDING_MODELS: Dict[Tuple[str, str], Tuple[Any, Any]] = {}
+_EMBEDDING_STORAGES = ("float32", "float16", "int8")
+_INDEX_LOCK_TIMEOUT_SECONDS = 3600
+_EMBEDDING_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+_EMBEDDING_BLOB_MAGIC = b"IATEMB01"
+_EMBEDDING_BLOB_ALIGN = 64
+_CACHE_MANIFEST_NAME = "manifest.json"
+_CACHE_TOUCH_INTERVAL_SECONDS = 60.0
+_CACHE_TEMP_MAX_AGE_SECONDS = 3600.0
+_THUMBNAIL_DIR_NAME = "thumbnails"
+# v4: entry images are EXIF-transposed before embedding, so v3 vectors are stale.
+_INDEX_SCHEMA_VERSION = 4
+_SHARD_DIR_NAME = "shards"
+_SHARD_INDEX_NAME = "index.json"
+_SHARD_FORMAT = "iat-shards"
+_DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+_DEFAULT_ENCODER_EDGE = 224
+_EMBEDDING_PRECISIONS = ("float32", "auto", "bf16", "fp16")
+_EMBEDDING_RUNTIMES = ("torch", "onnx")
+_EMBEDDING_ACCELERATION: Dict[str, Any] = {"precision": "float32", "compile": False, "num_threads": 0, "runtime": "torch"}
+_EMBEDDING_MODELS: Dict[Tuple[Any, ...], Tuple[Any, Any]] = {}
+_EMBEDDING_RUNTIME_NOTES: Dict[str, str] = {}
+_ONNX_OPSET = 17
 
 
 class DatasetError(RuntimeError):
@@ -62,6 +96,103 @@ class DatasetEntry:
         return {}
 
 
+class DatasetEntryTable(collections.abc.Sequence):
+    """Columnar storage for the entries of one dataset.
+
+    Captions live in one shared string buffer addressed by offsets, image role
+    layouts and directories are interned, and relative paths are kept as file names
+    only.  ``DatasetEntry`` objects are materialized on item access, so large
+    datasets only pay for the entries that are actually returned.
+    """
+
+    def __init__(self, dataset_dir: Path, reader: Any = None):
+        self.dataset_dir = Path(dataset_dir)
+        # File access for packed datasets; None reads the directory layout directly.
+        self.reader = reader
+        self._record_ids: List[str] = []
+        self._caption_buffer = ""
+        self._pending_captions: List[str] = []
+        self._caption_offsets = array("q", [0])
+        self._layouts: List[Tuple[str, ...]] = []
+        self._layout_ids: Dict[Tuple[str, ...], int] = {}
+        self._entry_layouts = array("I")
+        self._directories: List[str] = []
+        self._directory_ids: Dict[str, int] = {}
+        self._path_directories = array("I")
+        self._path_names: List[str] = []
+        self._path_offsets = array("q", [0])
+
+    def append(self, record_id: str, caption: str, image_paths: Dict[str, Path]) -> None:
+        relative_paths = {
+            role: path.relative_to(self.dataset_dir).as_posix()
+            for role, path in sorted(image_paths.items())
+        }
+        layout = tuple(relative_paths)
+        layout_id = self._layout_ids.get(layout)
+        if layout_id is None:
+            layout_id = self._layout_ids[layout] = len(self._layouts)
+            self._layouts.append(layout)
+        for relative in relative_paths.values():
+            directory, _, name = relative.rpartition("/")
+            directory_id = self._directory_ids.get(directory)
+            if directory_id is None:
+                directory_id = self._directory_ids[directory] = len(self._directories)
+                self._directories.append(directory)
+            self._path_directories.append(directory_id)
+            self._path_names.append(name)
+        self._path_offsets.append(len(self._path_names))
+        self._entry_layouts.append(layout_id)
+        self._record_ids.append(record_id)
+        self._pending_captions.append(caption)
+        self._caption_offsets.append(self._caption_offsets[-1] + len(caption))
+
+    def __len__(self) -> int:
+        return len(self._record_ids)
+
+    def _position(self, index: int) -> int:
+        return range(len(self._record_ids))[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        position = self._position(index)
+        relative_paths = self.relative_image_paths_at(position)
+        image_paths = {role: self.dataset_dir / relative for role, relative in relative_paths.items()}
+        primary_role = "result" if "result" in relative_paths else next(iter(relative_paths), "")
+        return DatasetEntry(
+            record_id=self._record_ids[position],
+            caption=self.caption_at(position),
+            image_path=image_paths.get(primary_role),
+            relative_image_path=relative_paths.get(primary_role, ""),
+            image_paths=image_paths,
+            relative_image_paths=relative_paths,
+        )
+
+    def record_id_at(self, index: int) -> str:
+        return self._record_ids[index]
+
+    def caption_at(self, index: int) -> str:
+        if self._pending_captions:
+            self._caption_buffer += "".join(self._pending_captions)
+            self._pending_captions = []
+        position = self._position(index)
+        return self._caption_buffer[self._caption_offsets[position] : self._caption_offsets[position + 1]]
+
+    def relative_image_paths_at(self, index: int) -> Dict[str, str]:
+        position = self._position(index)
+        layout = self._layouts[self._entry_layouts[position]]
+        start = self._path_offsets[position]
+        result: Dict[str, str] = {}
+        for offset, role in enumerate(layout, start=start):
+            directory = self._directories[self._path_directories[offset]]
+            name = self._path_names[offset]
+            result[role] = f"{directory}/{name}" if directory else name
+        return result
+
+    def image_paths_at(self, index: int) -> Dict[str, Path]:
+        return {role: self.dataset_dir / relative for role, relative in self.relative_image_paths_at(index).items()}
+
+
 @dataclass
 class DatasetRecord:
     dataset_name: str
@@ -70,14 +201,44 @@ class DatasetRecord:
     lora_name: str
     language: str
     trigger_words: List[str]
-    entries: List[DatasetEntry]
+    entries: Sequence[DatasetEntry]
     source_path: Path
     warnings: List[str] = field(default_factory=list)
     metadata: Dict[str, Any] = field(default_factory=dict)
 
     @property
     def captions(self) -> List[str]:
-        return [entry.caption for entry in self.entries]
+        return [self.caption_at(index) for index in range(len(self.entries))]
+
+    # Column accessors avoid materializing ``DatasetEntry`` objects for
+    # columnar records while still accepting plain entry lists.
+    def record_id_at(self, index: int) -> str:
+        if isinstance(self.entries, DatasetEntryTable):
+            return self.entries.record_id_at(index)
+        return self.entries[index].record_id
+
+    def caption_at(self, index: int) -> str:
+        if isinstance(self.entries, DatasetEntryTable):
+            return self.entries.caption_at(index)
+        return self.entries[index].caption
+
+    def relative_image_paths_at(self, index: int) -> Dict[str, str]:
+        if isinstance(self.entries, DatasetEntryTable):
+            return self.entries.relative_image_paths_at(index)
+        return self.entries[index].grouped_relative_image_paths()
+
+    def image_paths_at(self, index: int) -> Dict[str, Path]:
+        if isinstance(self.entries, DatasetEntryTable):
+            return self.entries.image_paths_at(index)
+        return self.entries[index].grouped_image_paths()
+
+    @property
+    def packed(self) -> bool:
+        return isinstance(getattr(self.entries, "reader", None), _PackedDatasetReader)
+
+    def read_file(self, path: Path) -> bytes:
+        """Bytes of a dataset file, from the directory layout or the packed shards."""
+        return _record_reader(self).read_bytes(Path(path))
 
 
 def _normalize_whitespace(text: str) -> str:
@@ -128,24 +289,182 @@ def _required_string(raw: Dict[str, Any], field_name: str, path: Path) -> str:
     return _normalize_whitespace(value)
 
 
-def _caption_path_for_image(image_path: Path) -> Optional[Path]:
+class _DirectoryReader:
+    """File access for the plain directory layout."""
+
+    def __init__(self, dataset_dir: Path):
+        self.dataset_dir = Path(dataset_dir)
+
+    def directories(self) -> List[Path]:
+        return [path for path in self.dataset_dir.rglob("*") if path.is_dir()]
+
+    def files_under(self, directory: Path, recursive: bool) -> List[Path]:
+        candidates = directory.rglob("*") if recursive else directory.iterdir()
+        return [path for path in candidates if path.is_file()]
+
+    def is_dir(self, path: Path) -> bool:
+        return path.is_dir()
+
+    def is_file(self, path: Path) -> bool:
+        return path.is_file()
+
+    def read_bytes(self, path: Path) -> bytes:
+        return path.read_bytes()
+
+    def stat_key(self, path: Path) -> str:
+        """Identity of a file's current bytes that is cheap to compute: path, size and mtime."""
+        stat = path.stat()
+        return f"{path}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def iter_chunks(self, path: Path, chunk_size: int = 1024 * 1024) -> Iterable[bytes]:
+        with path.open("rb") as stream:
+            while chunk := stream.read(chunk_size):
+                yield chunk
+
+
+class _PackedDatasetReader:
+    """File access for a packed dataset: ``shards/*.tar`` plus an offset index.
+
+    Members keep their original relative paths, so entries, fingerprints and
+    index caches are identical to the directory layout.  Reads go straight to
+    the recorded byte offsets; members are stored in path order, so walking
+    files in order reads each shard sequentially.
+    """
+
+    def __init__(self, dataset_dir: Path):
+        self.dataset_dir = Path(dataset_dir)
+        self.shard_dir = self.dataset_dir / _SHARD_DIR_NAME
+        index_path = self.shard_dir / _SHARD_INDEX_NAME
+        raw = _load_json(index_path)
+        shards = raw.get("shards")
+        members = raw.get("members")
+        if raw.get("format") != _SHARD_FORMAT or not isinstance(shards, list) or not isinstance(members, list):
+            raise DatasetError(f"[IAT] `{index_path}` is not a packed dataset index.")
+        self.shards: List[Path] = []
+        shard_sizes: List[int] = []
+        for shard in shards:
+            shard_path = self.shard_dir / str((shard or {}).get("name") or "")
+            if not shard_path.is_file():
+                raise DatasetError(f"[IAT] Packed dataset shard is missing: `{shard_path}`")
+            self.shards.append(shard_path)
+            shard_sizes.append(shard_path.stat().st_size)
+        self.members: Dict[str, Tuple[int, int, int]] = {}
+        for member in members:
+            try:
+                relative, shard_id, offset, size = str(member[0]), int(member[1]), int(member[2]), int(member[3])
+            except (TypeError, ValueError, IndexError) as exc:
+                raise DatasetError(f"[IAT] `{index_path}` contains an invalid member entry: {member!r}") from exc
+            if not 0 <= shard_id < len(self.shards) or offset < 0 or size < 0 or offset + size > shard_sizes[shard_id]:
+                raise DatasetError(f"[IAT] `{index_path}` points outside its shards for `{relative}`.")
+            self.members[relative] = (shard_id, offset, size)
+        self._handles: Dict[int, Any] = {}
+
+    def close(self) -> None:
+        handles, self._handles = self._handles, {}
+        for handle in handles.values():
+            handle.close()
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _relative(self, path: Path) -> str:
+        return Path(path).relative_to(self.dataset_dir).as_posix()
+
+    def directories(self) -> List[Path]:
+        found = set()
+        for relative in self.members:
+            for parent in Path(relative).parents:
+                if parent.as_posix() != ".":
+                    found.add(parent.as_posix())
+        return [self.dataset_dir / relative for relative in found]
+
+    def files_under(self, directory: Path, recursive: bool) -> List[Path]:
+        prefix = self._relative(directory)
+        prefix = "" if prefix == "." else f"{prefix}/"
+        return [
+            self.dataset_dir / relative
+            for relative in self.members
+            if relative.startswith(prefix) and (recursive or "/" not in relative[len(prefix) :])
+        ]
+
+    def is_dir(self, path: Path) -> bool:
+        prefix = f"{self._relative(path)}/"
+        return any(relative.startswith(prefix) for relative in self.members)
+
+    def is_file(self, path: Path) -> bool:
+        try:
+            return self._relative(path) in self.members
+        except ValueError:
+            return False
+
+    def read_bytes(self, path: Path) -> bytes:
+        return b"".join(self.iter_chunks(path))
+
+    def stat_key(self, path: Path) -> str:
+        """Identity of a member's bytes: its shard's size and mtime plus the member's extent."""
+        try:
+            shard_id, offset, size = self.members[self._relative(path)]
+        except (KeyError, ValueError) as exc:
+            raise DatasetError(f"[IAT] `{path}` is not stored in packed dataset `{self.dataset_dir}`.") from exc
+        stat = self.shards[shard_id].stat()
+        return f"{self.shards[shard_id]}|{stat.st_size}|{stat.st_mtime_ns}|{offset}|{size}"
+
+    def iter_chunks(self, path: Path, chunk_size: int = 1024 * 1024) -> Iterable[bytes]:
+        try:
+            shard_id, offset, size = self.members[self._relative(path)]
+        except (KeyError, ValueError) as exc:
+            raise DatasetError(f"[IAT] `{path}` is not stored in packed dataset `{self.dataset_dir}`.") from exc
+        handle = self._handles.get(shard_id)
+        if handle is None:
+            handle = self._handles[shard_id] = self.shards[shard_id].open("rb")
+        end = offset + size
+        while offset < end:
+            length = min(chunk_size, end - offset)
+            if hasattr(os, "pread"):
+                chunk = os.pread(handle.fileno(), length, offset)
+            else:  # pragma: no cover - Windows has no pread
+                with self.shards[shard_id].open("rb") as stream:
+                    stream.seek(offset)
+                    chunk = stream.read(length)
+            if not chunk:
+                raise DatasetError(f"[IAT] Packed dataset shard `{self.shards[shard_id]}` is truncated.")
+            offset += len(chunk)
+            yield chunk
+
+
+def _dataset_reader(dataset_dir: Path) -> Any:
+    if (Path(dataset_dir) / _SHARD_DIR_NAME / _SHARD_INDEX_NAME).is_file():
+        return _PackedDatasetReader(dataset_dir)
+    return _DirectoryReader(dataset_dir)
+
+
+def _record_reader(record: "DatasetRecord") -> Any:
+    return getattr(record.entries, "reader", None) or _DirectoryReader(record.source_path.parent)
+
+
+def _caption_path_for_image(image_path: Path, reader: Any = None) -> Optional[Path]:
+    reader = reader or _DirectoryReader(image_path.parent)
     caption_path = image_path.with_suffix(".txt")
-    if not caption_path.is_file():
+    if not reader.is_file(caption_path):
         # Windows datasets sometimes use an upper-case extension.
-        for candidate in image_path.parent.glob(f"{image_path.stem}.*"):
-            if candidate.suffix.lower() == ".txt":
+        for candidate in reader.files_under(image_path.parent, recursive=False):
+            if candidate.stem == image_path.stem and candidate.suffix.lower() == ".txt":
                 caption_path = candidate
                 break
-    if not caption_path.is_file():
+    if not reader.is_file(caption_path):
         return None
     return caption_path
 
 
-def _caption_for_image(image_path: Path) -> Optional[str]:
-    caption_path = _caption_path_for_image(image_path)
+def _caption_for_image(image_path: Path, reader: Any = None) -> Optional[str]:
+    reader = reader or _DirectoryReader(image_path.parent)
+    caption_path = _caption_path_for_image(image_path, reader)
     if caption_path is None:
         return None
-    return _normalize_whitespace(caption_path.read_text(encoding="utf-8-sig"))
+    return _normalize_whitespace(reader.read_bytes(caption_path).decode("utf-8-sig"))
 
 
 def _load_json(path: Path) -> Dict[str, Any]:
@@ -173,48 +492,33 @@ def _role_from_directory(directory: Path, dataset_dir: Path) -> Optional[str]:
     return None
 
 
-def _role_directories(dataset_dir: Path, allowed_roles: Optional[Sequence[str]] = None) -> Dict[str, Path]:
+def _role_directories(
+    dataset_dir: Path,
+    allowed_roles: Optional[Sequence[str]] = None,
+    reader: Any = None,
+) -> Dict[str, Path]:
+    reader = reader or _DirectoryReader(dataset_dir)
     allowed = set(allowed_roles or _IMAGE_ROLES)
     role_dirs: Dict[str, Path] = {}
-    for directory in sorted((path for path in dataset_dir.rglob("*") if path.is_dir()), key=lambda path: path.as_posix().lower()):
+    for directory in sorted(reader.directories(), key=lambda path: path.as_posix().lower()):
         role = _role_from_directory(directory, dataset_dir)
         if role in allowed and role not in role_dirs:
             role_dirs[role] = directory
     return role_dirs
 
 
-def _make_entry(
-    dataset_dir: Path,
-    record_id: str,
-    caption: str,
-    image_paths: Dict[str, Path],
-) -> DatasetEntry:
-    relative_paths = {
-        role: path.relative_to(dataset_dir).as_posix()
-        for role, path in sorted(image_paths.items())
-    }
-    primary_role = "result" if "result" in image_paths else next(iter(relative_paths), "")
-    primary_path = image_paths.get(primary_role)
-    return DatasetEntry(
-        record_id=record_id,
-        caption=caption,
-        image_path=primary_path,
-        relative_image_path=relative_paths.get(primary_role, ""),
-        image_paths=dict(sorted(image_paths.items())),
-        relative_image_paths=relative_paths,
-    )
-
-
 def _build_entries_from_multiview(
     dataset_dir: Path,
     role_dirs: Dict[str, Path],
     warnings: List[str],
     caption_role: str,
-) -> List[DatasetEntry]:
+    reader: Any = None,
+) -> DatasetEntryTable:
+    reader = reader or _DirectoryReader(dataset_dir)
     groups: Dict[str, Dict[str, Path]] = {}
     for role, role_dir in role_dirs.items():
         for image_path in sorted(
-            (path for path in role_dir.rglob("*") if path.is_file() and path.suffix.lower() in _IMAGE_SUFFIXES),
+            (path for path in reader.files_under(role_dir, recursive=True) if path.suffix.lower() in _IMAGE_SUFFIXES),
             key=lambda path: path.as_posix().lower(),
         ):
             group = groups.setdefault(image_path.stem.casefold(), {})
@@ -223,7 +527,7 @@ def _build_entries_from_multiview(
                 continue
             group[role] = image_path
 
-    entries: List[DatasetEntry] = []
+    entries = DatasetEntryTable(dataset_dir, reader if isinstance(reader, _PackedDatasetReader) else None)
     for group_key in sorted(groups, key=str.casefold):
         image_paths = groups[group_key]
         record_id = image_paths.get(caption_role, next(iter(image_paths.values()))).stem
@@ -231,7 +535,7 @@ def _build_entries_from_multiview(
         if caption_image is None:
             warnings.append(f"Missing `{caption_role}` image for sample `{record_id}`; skipped.")
             continue
-        caption = _caption_for_image(caption_image)
+        caption = _caption_for_image(caption_image, reader)
         if not caption:
             warnings.append(
                 f"Missing `{caption_role}` caption for sample `{caption_image.relative_to(dataset_dir).as_posix()}`; skipped."
@@ -240,7 +544,7 @@ def _build_entries_from_multiview(
         for role in ("control1", "control2", "control3"):
             if role not in image_paths:
                 warnings.append(f"Missing `{role}` image for sample `{record_id}`; kept result sample.")
-        entries.append(_make_entry(dataset_dir, record_id, caption, image_paths))
+        entries.append(record_id, caption, image_paths)
     return entries
 
 
@@ -249,33 +553,39 @@ def _build_entries_from_directory(
     warnings: List[str],
     configured_roles: Optional[Sequence[str]] = None,
     caption_role: str = "result",
-) -> List[DatasetEntry]:
-    role_dirs = _role_directories(dataset_dir, configured_roles)
+    reader: Any = None,
+) -> DatasetEntryTable:
+    reader = reader or _DirectoryReader(dataset_dir)
+    role_dirs = _role_directories(dataset_dir, configured_roles, reader)
     if role_dirs:
-        return _build_entries_from_multiview(dataset_dir, role_dirs, warnings, caption_role)
+        return _build_entries_from_multiview(dataset_dir, role_dirs, warnings, caption_role, reader)
 
     image_dir = dataset_dir / "images"
-    if not image_dir.is_dir():
+    if not reader.is_dir(image_dir):
         raise DatasetError(
             f"[IAT] Dataset `{dataset_dir}` is missing `images` or a recognized result directory."
         )
     root = image_dir
-    entries: List[DatasetEntry] = []
+    entries = DatasetEntryTable(dataset_dir, reader if isinstance(reader, _PackedDatasetReader) else None)
     for image_path in sorted(
-        (path for path in root.iterdir() if path.is_file() and path.suffix.lower() in _IMAGE_SUFFIXES),
+        (path for path in reader.files_under(root, recursive=False) if path.suffix.lower() in _IMAGE_SUFFIXES),
         key=lambda path: path.as_posix().lower(),
     ):
-        caption = _caption_for_image(image_path)
+        caption = _caption_for_image(image_path, reader)
         if not caption:
             warnings.append(f"Missing caption for image `{image_path.relative_to(dataset_dir).as_posix()}`; skipped.")
             continue
         relative = image_path.relative_to(dataset_dir).as_posix()
-        entries.append(_make_entry(dataset_dir, Path(relative).with_suffix("").as_posix(), caption, {"image": image_path}))
+        entries.append(Path(relative).with_suffix("").as_posix(), caption, {"image": image_path})
     return entries
 
 
 def load_dataset_record(path: Path) -> DatasetRecord:
-    """Load one strict directory dataset with paired image/caption files."""
+    """Load one strict directory dataset with paired image/caption files.
+
+    A directory holding ``shards/index.json`` is read as a packed dataset
+    (see ``pack_dataset``) and yields the same entries as its source layout.
+    """
     path = Path(path)
     if not path.is_dir():
         raise DatasetError(f"[IAT] Dataset path must be a directory: `{path}`")
@@ -309,7 +619,8 @@ def load_dataset_record(path: Path) -> DatasetRecord:
         raise DatasetError(f"[IAT] {source_path.name}: `caption_role` must be one of {', '.join(_IMAGE_ROLES)}.")
 
     warnings: List[str] = []
-    entries = _build_entries_from_directory(path, warnings, configured_roles or None, caption_role)
+    reader = _dataset_reader(path)
+    entries = _build_entries_from_directory(path, warnings, configured_roles or None, caption_role, reader)
     if not entries:
         raise DatasetError(f"[IAT] Dataset `{dataset_name}` has no valid image/caption entries.")
 
@@ -323,6 +634,7 @@ def load_dataset_record(path: Path) -> DatasetRecord:
         "image_roles": configured_roles,
         "caption_role": caption_role,
         "entry_count": len(entries),
+        "packed": isinstance(reader, _PackedDatasetReader),
         "source_path": str(source_path),
         "warnings": warnings,
     }
@@ -340,6 +652,66 @@ def load_dataset_record(path: Path) -> DatasetRecord:
     )
 
 
+def pack_dataset(source: Path, target: Path, shard_bytes: int = _DEFAULT_SHARD_BYTES) -> DatasetRecord:
+    """Convert a directory dataset into tar shards plus an offset index.
+
+    ``target`` receives ``dataset.json`` and ``shards/shard-NNNNN.tar`` with every
+    image and caption file under its original relative path, in the same order
+    ``dataset_fingerprint`` reads them.  The packed record has the same entries
+    and fingerprint as the source, so existing index caches stay valid.
+    """
+    source = Path(source)
+    target = Path(target)
+    record = load_dataset_record(source)
+    if record.packed:
+        raise DatasetError(f"[IAT] Dataset `{source}` is already packed.")
+    if target.exists() and any(target.iterdir()):
+        raise DatasetError(f"[IAT] Pack target `{target}` must be empty or missing.")
+    tracked_suffixes = _IMAGE_SUFFIXES | {".txt"}
+    files = sorted(
+        (
+            path
+            for path in source.rglob("*")
+            if path.is_file() and path.suffix.lower() in tracked_suffixes and path != record.source_path
+        ),
+        key=lambda path: path.as_posix().lower(),
+    )
+    shard_dir = target / _SHARD_DIR_NAME
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    (target / "dataset.json").write_bytes(record.source_path.read_bytes())
+    shards: List[Dict[str, Any]] = []
+    members: List[List[Any]] = []
+    archive: Optional[tarfile.TarFile] = None
+    try:
+        for path in files:
+            if archive is None or archive.offset >= max(1, int(shard_bytes)):
+                if archive is not None:
+                    archive.close()
+                name = f"shard-{len(shards):05d}.tar"
+                shards.append({"name": name})
+                archive = tarfile.open(shard_dir / name, "w", format=tarfile.PAX_FORMAT)
+            info = tarfile.TarInfo(path.relative_to(source).as_posix())
+            stat = path.stat()
+            info.size = stat.st_size
+            info.mtime = int(stat.st_mtime)
+            # ``addfile`` does not record offsets when writing; the data follows the header blocks.
+            data_offset = archive.offset + len(info.tobuf(archive.format, archive.encoding, archive.errors))
+            with path.open("rb") as stream:
+                archive.addfile(info, stream)
+            members.append([info.name, len(shards) - 1, data_offset, info.size])
+    finally:
+        if archive is not None:
+            archive.close()
+    for shard in shards:
+        shard["bytes"] = (shard_dir / shard["name"]).stat().st_size
+    # The index is written last, so an interrupted pack never looks like a packed dataset.
+    _atomic_write_text(
+        shard_dir / _SHARD_INDEX_NAME,
+        json.dumps({"format": _SHARD_FORMAT, "version": 1, "shards": shards, "members": members}, ensure_ascii=False),
+    )
+    return load_dataset_record(target)
+
+
 def discover_datasets(root: Path) -> Tuple[Dict[str, DatasetRecord], List[str]]:
     """Discover only directories containing a canonical ``dataset.json``."""
     root = Path(root)
@@ -349,12 +721,7 @@ def discover_datasets(root: Path) -> Tuple[Dict[str, DatasetRecord], List[str]]:
     if not root.is_dir():
         return records, [f"[IAT] Dataset root does not exist: `{root}`"]
 
-    candidates = sorted(
-        (directory for directory in root.rglob("*") if directory.is_dir() and (directory / "dataset.json").is_file()),
-        key=lambda path: path.as_posix().lower(),
-    )
-
-    for candidate in candidates:
+    for candidate in _dataset_directories(root):
         try:
             record = load_dataset_record(candidate)
         except Exception as exc:
@@ -377,6 +744,69 @@ def discover_datasets(root: Path) -> Tuple[Dict[str, DatasetRecord], List[str]]:
     return records, errors
 
 
+def _dataset_directories(root: Path) -> List[Path]:
+    """Directories under ``root`` holding a ``dataset.json``, in case-insensitive path order.
+
+    Symlinked directories are followed, but each real directory is visited once,
+    so links back to an ancestor cannot loop forever.
+    """
+    found: List[Path] = []
+    visited = set()
+    for directory, subdirectories, filenames in os.walk(root, followlinks=True):
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            subdirectories[:] = []
+            continue
+        if (stat.st_dev, stat.st_ino) in visited:
+            subdirectories[:] = []
+            continue
+        visited.add((stat.st_dev, stat.st_ino))
+        if Path(directory) != root and "dataset.json" in filenames:
+            found.append(Path(directory))
+    return sorted(found, key=lambda path: path.as_posix().lower())
+
+
+def list_dataset_headers(root: Path) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """List datasets by reading only their ``dataset.json`` name and version.
+
+    Unlike ``discover_datasets`` this never scans images or captions, so it stays
+    cheap enough for UI dropdowns.  Entries are validated when a dataset is loaded.
+    """
+    root = Path(root)
+    headers: Dict[str, Dict[str, Any]] = {}
+    duplicate_names = set()
+    errors: List[str] = []
+    if not root.is_dir():
+        return headers, [f"[IAT] Dataset root does not exist: `{root}`"]
+    for candidate in _dataset_directories(root):
+        source_path = candidate / "dataset.json"
+        try:
+            raw = _load_json(source_path)
+            dataset_name = _required_string(raw, "dataset_name", source_path)
+            version = _required_string(raw, "version", source_path)
+        except Exception as exc:
+            errors.append(str(exc))
+            continue
+        if dataset_name in duplicate_names:
+            errors.append(f"[IAT] Duplicate dataset_name `{dataset_name}` in `{source_path}`.")
+            continue
+        if dataset_name in headers:
+            errors.append(
+                f"[IAT] Duplicate dataset_name `{dataset_name}` in `{headers[dataset_name]['source_path']}` and `{source_path}`."
+            )
+            headers.pop(dataset_name, None)
+            duplicate_names.add(dataset_name)
+            continue
+        headers[dataset_name] = {
+            "dataset_name": dataset_name,
+            "version": version,
+            "path": candidate,
+            "source_path": source_path,
+        }
+    return headers, errors
+
+
 def choose_caption(record: DatasetRecord, mode: str, seed: int, index: int = 0) -> Tuple[DatasetEntry, int]:
     if not record.entries:
         raise DatasetError(f"[IAT] Dataset `{record.dataset_name}` has no captions.")
@@ -390,30 +820,53 @@ def choose_caption(record: DatasetRecord, mode: str, seed: int, index: int = 0)
 
 
 def dataset_fingerprint(record: DatasetRecord) -> str:
+    return dataset_fingerprints(record)["dataset"]
+
+
+def dataset_fingerprints(record: DatasetRecord) -> Dict[str, str]:
+    """Content fingerprints for the whole dataset, its captions, and its images.
+
+    ``dataset`` changes on any edit.  ``captions`` covers metadata and caption
+    files, ``images`` covers image files only, so a caption-only edit leaves the
+    image fingerprint (and the expensive image embeddings) reusable.
+    """
     # Hash content rather than mtimes so the same dataset version remains stable
     # after a touch/copy operation while still invalidating changed image bytes.
     digest = hashlib.sha256()
+    captions = hashlib.sha256()
+    images = hashlib.sha256()
     dataset_dir = record.source_path.parent
-    digest.update(record.source_path.name.encode("utf-8"))
-    digest.update(record.source_path.read_bytes())
+    metadata = record.source_path.read_bytes()
+    for target in (digest, captions):
+        target.update(record.source_path.name.encode("utf-8"))
+        target.update(metadata)
     tracked_suffixes = _IMAGE_SUFFIXES | {".txt"}
+    reader = _record_reader(record)
     for path in sorted(
         (
             item
-            for item in dataset_dir.rglob("*")
-            if item.is_file() and item.suffix.lower() in tracked_suffixes and item != record.source_path
+            for item in reader.files_under(dataset_dir, recursive=True)
+            if item.suffix.lower() in tracked_suffixes and item != record.source_path
         ),
         key=lambda item: item.as_posix().lower(),
     ):
-        relative = path.relative_to(dataset_dir).as_posix()
-        digest.update(relative.encode("utf-8"))
+        relative = path.relative_to(dataset_dir).as_posix().encode("utf-8")
+        partial = images if path.suffix.lower() in _IMAGE_SUFFIXES else captions
+        digest.update(relative)
+        partial.update(relative)
         try:
-            with path.open("rb") as stream:
-                while chunk := stream.read(1024 * 1024):
-                    digest.update(chunk)
+            for chunk in reader.iter_chunks(path):
+                digest.update(chunk)
+                partial.update(chunk)
         except OSError as exc:
             raise DatasetError(f"[IAT] Could not read dataset file `{path}` while computing its fingerprint: {exc}") from exc
-    return digest.hexdigest()
+    return {"dataset": digest.hexdigest(), "captions": captions.hexdigest(), "images": images.hexdigest()}
+
+
+def _primary_relative_path(relative_paths: Dict[str, str]) -> str:
+    if "result" in relative_paths:
+        return relative_paths["result"]
+    return next(iter(relative_paths.values()), "")
 
 
 def _safe_name(value: str) -> str:
@@ -479,6 +932,148 @@ def _seeded_weighted_choice(
     return candidates[-1]
 
 
+class _EmbeddingMatrix:
+    """Row-major embedding storage with optional float16 or per-row int8 quantization.
+
+    Rows that are missing or have a different dimension are kept as absent and
+    score ``0.0``, matching ``_cosine``.  Item access returns plain float lists so
+    the cache payload and existing callers see the same shape as before.
+    """
+
+    _SCORE_CHUNK_ROWS = 65536
+
+    def __init__(self, vectors: Sequence[Optional[Sequence[float]]] = (), storage: str = "float32"):
+        if storage not in _EMBEDDING_STORAGES:
+            raise DatasetError(f"[IAT] Unsupported embedding storage: `{storage}`")
+        self.storage = storage
+        vectors = list(vectors)
+        self.dimension = next((len(vector) for vector in vectors if vector), 0)
+        self.present = np.asarray(
+            [bool(vector) and len(vector) == self.dimension for vector in vectors],
+            dtype=bool,
+        )
+        values = np.zeros((len(vectors), self.dimension), dtype=np.float32)
+        for row in np.flatnonzero(self.present).tolist():
+            values[row] = vectors[row]
+        self.scales: Optional[np.ndarray] = None
+        if storage == "int8":
+            scales = np.abs(values).max(axis=1) / 127.0 if self.dimension else np.zeros(len(vectors), dtype=np.float32)
+            scales[scales == 0.0] = 1.0
+            self.scales = scales.astype(np.float32)
+            self.data = np.rint(values / self.scales[:, None]).astype(np.int8)
+        elif storage == "float16":
+            self.data = values.astype(np.float16)
+        else:
+            self.data = values
+
+    @classmethod
+    def from_arrays(
+        cls,
+        storage: str,
+        data: np.ndarray,
+        present: np.ndarray,
+        scales: Optional[np.ndarray] = None,
+    ) -> "_EmbeddingMatrix":
+        """Wrap already-stored arrays, e.g. read-only views of a shared embedding file."""
+        matrix = cls.__new__(cls)
+        matrix.storage = storage
+        matrix.data = data
+        matrix.dimension = int(data.shape[1]) if data.ndim == 2 else 0
+        matrix.present = present
+        matrix.scales = scales
+        return matrix
+
+    @property
+    def shared(self) -> bool:
+        return isinstance(self.data, np.memmap)
+
+    def __len__(self) -> int:
+        return len(self.present)
+
+    def __bool__(self) -> bool:
+        return len(self.present) > 0
+
+    def __getitem__(self, index: int) -> Optional[List[float]]:
+        if not self.present[index]:
+            return None
+        return self.rows([index])[0].tolist()
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def rows(self, indices: Sequence[int]) -> np.ndarray:
+        """Dequantized float64 rows; absent rows are zero vectors."""
+        indices = np.asarray(indices, dtype=np.int64)
+        values = self.data[indices].astype(np.float64)
+        if self.scales is not None:
+            values *= self.scales[indices, None]
+        values[~self.present[indices]] = 0.0
+        return values
+
+    def scores(self, query: Optional[Sequence[float]]) -> np.ndarray:
+        """Clipped dot products against every row, scored chunk by chunk on the stored dtype."""
+        scores = np.zeros(len(self), dtype=np.float64)
+        if query is None or not self.dimension or len(query) != self.dimension:
+            return scores
+        vector = np.asarray(query, dtype=np.float32)
+        for start in range(0, len(self), self._SCORE_CHUNK_ROWS):
+            stop = start + self._SCORE_CHUNK_ROWS
+            chunk = self.data[start:stop].astype(np.float32, copy=False) @ vector
+            if self.scales is not None:
+                chunk *= self.scales[start:stop]
+            scores[start:stop] = chunk
+        scores[~self.present] = 0.0
+        return np.clip(scores, -1.0, 1.0)
+
+    def tolist(self) -> List[Optional[List[float]]]:
+        return list(self)
+
+
+def _as_embedding_matrix(value: Any, storage: str) -> _EmbeddingMatrix:
+    if isinstance(value, _EmbeddingMatrix):
+        return value
+    return _EmbeddingMatrix(value or [], storage)
+
+
+def _embedding_storage_report(
+    vectors: Sequence[Optional[Sequence[float]]],
+    matrix: _EmbeddingMatrix,
+    sample_size: int = 64,
+    top_k: int = 10,
+) -> Dict[str, Any]:
+    """Compare quantized ranking against float32 using sampled stored rows as queries."""
+    reference = matrix if matrix.storage == "float32" else _EmbeddingMatrix(vectors, "float32")
+    report: Dict[str, Any] = {
+        "storage": matrix.storage,
+        "bytes": matrix.nbytes,
+        "float32_bytes": reference.nbytes,
+        "queries": 0,
+        "top1_agreement": 1.0,
+        f"recall_at_{top_k}": 1.0,
+    }
+    rows = np.flatnonzero(reference.present)
+    if matrix is reference or not len(rows):
+        return report
+    rows = rows[np.linspace(0, len(rows) - 1, min(sample_size, len(rows))).astype(np.int64)]
+    k = min(top_k, len(reference))
+    top1 = 0
+    recall = 0.0
+    for row in rows.tolist():
+        query = reference.rows([row])[0]
+        expected = np.argsort(-reference.scores(query), kind="stable")[:k]
+        actual = np.argsort(-matrix.scores(query), kind="stable")[:k]
+        top1 += int(expected[0] == actual[0])
+        recall += len(set(expected.tolist()) & set(actual.tolist())) / k
+    report["queries"] = len(rows)
+    report["top1_agreement"] = round(top1 / len(rows), 6)
+    report[f"recall_at_{top_k}"] = round(recall / len(rows), 6)
+    return report
+
+
 class DatasetIndex:
     def __init__(
         self,
@@ -490,77 +1085,104 @@ class DatasetIndex:
         embedding_model_path: str = "",
         embedding_device: str = "cpu",
         warnings: Optional[List[str]] = None,
+        embedding_storage: str = "float32",
+        storage_report: Optional[Dict[str, Any]] = None,
+        image_dedup: Optional[Dict[str, Any]] = None,
+        image_fingerprint: str = "",
+        thumbnail_edge: int = 0,
     ):
         self.record = record
         self.fingerprint = fingerprint
-        self.text_embeddings = text_embeddings or []
-        self.image_embeddings = image_embeddings or []
-        self.gray_embeddings = gray_embeddings or []
+        self.embedding_storage = embedding_storage
+        self.text_embeddings = _as_embedding_matrix(text_embeddings, embedding_storage)
+        self.image_embeddings = _as_embedding_matrix(image_embeddings, embedding_storage)
+        self.gray_embeddings = _as_embedding_matrix(gray_embeddings, embedding_storage)
         self.embedding_model_path = embedding_model_path
         self.embedding_device = embedding_device
+        self.storage_report = dict(storage_report or {})
+        self.image_dedup = dict(image_dedup or {})
+        self.image_fingerprint = image_fingerprint
+        self.thumbnail_edge = int(thumbnail_edge or 0)
         self.warnings = list(warnings or [])
-        self.tokens = [tokenize(entry.caption) for entry in record.entries]
-        self.document_frequency: Dict[str, int] = {}
-        for tokens in self.tokens:
-            for token in set(tokens):
-                self.document_frequency[token] = self.document_frequency.get(token, 0) + 1
+        self._build_token_columns()
+
+    def _build_token_columns(self) -> None:
+        # Token ids share one int32 column with per-caption offsets, and postings
+        # are the same ids grouped by token so BM25 touches only matching captions.
+        self.vocabulary: Dict[str, int] = {}
+        token_ids = array("i")
+        offsets = array("q", [0])
+        for idx in range(len(self.record.entries)):
+            for token in tokenize(self.record.caption_at(idx)):
+                token_id = self.vocabulary.get(token)
+                if token_id is None:
+                    token_id = self.vocabulary[token] = len(self.vocabulary)
+                token_ids.append(token_id)
+            offsets.append(len(token_ids))
+        self.token_ids = np.asarray(token_ids, dtype=np.int32)
+        self.token_offsets = np.asarray(offsets, dtype=np.int64)
+        self.document_lengths = np.diff(self.token_offsets)
+        documents = np.repeat(np.arange(len(self.document_lengths), dtype=np.int32), self.document_lengths)
+        self._posting_documents = documents[np.argsort(self.token_ids, kind="stable")]
+        self._posting_offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.token_ids, minlength=len(self.vocabulary)), out=self._posting_offsets[1:])
+
+    def _token_set(self, idx: int) -> set:
+        return set(self.token_ids[self.token_offsets[idx] : self.token_offsets[idx + 1]].tolist())
 
     @property
     def version(self) -> str:
         return f"hybrid-v3:{self.fingerprint[:12]}"
 
     def _bm25_scores(self, query: str) -> List[float]:
+        document_count = len(self.document_lengths)
+        scores = np.zeros(document_count, dtype=np.float64)
         query_tokens = tokenize(query)
         if not query_tokens:
-            return [0.0] * len(self.record.entries)
+            return scores.tolist()
         query_counts: Dict[str, int] = {}
         for token in query_tokens:
             query_counts[token] = query_counts.get(token, 0) + 1
-        document_count = len(self.tokens) or 1
-        average_length = sum(len(tokens) for tokens in self.tokens) / document_count if self.tokens else 1.0
-        scores = []
-        for tokens in self.tokens:
-            counts: Dict[str, int] = {}
-            for token in tokens:
-                counts[token] = counts.get(token, 0) + 1
-            length_factor = len(tokens) / max(average_length, 1.0)
-            score = 0.0
-            for token, query_count in query_counts.items():
-                frequency = counts.get(token, 0)
-                if not frequency:
-                    continue
-                document_frequency = self.document_frequency.get(token, 0)
-                idf = math.log(1.0 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
-                numerator = frequency * 2.5
-                denominator = frequency + 1.5 * (0.75 + 0.25 * length_factor)
-                score += idf * (numerator / max(denominator, 1e-6)) * (1.0 + math.log1p(query_count))
-            scores.append(score)
-        return scores
-
-    def _similarity_to_selected(self, left: int, right: int) -> float:
-        if self.text_embeddings and left < len(self.text_embeddings) and right < len(self.text_embeddings):
-            return max(0.0, _cosine(self.text_embeddings[left], self.text_embeddings[right]))
-        left_tokens, right_tokens = set(self.tokens[left]), set(self.tokens[right])
-        return len(left_tokens & right_tokens) / max(len(left_tokens | right_tokens), 1)
-
-    def retrieve(
+        average_length = float(self.document_lengths.sum()) / document_count if document_count else 1.0
+        document_count = document_count or 1
+        for token, query_count in query_counts.items():
+            token_id = self.vocabulary.get(token)
+            if token_id is None:
+                continue
+            postings = self._posting_documents[self._posting_offsets[token_id] : self._posting_offsets[token_id + 1]]
+            documents, frequency = np.unique(postings, return_counts=True)
+            document_frequency = len(documents)
+            idf = math.log(1.0 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            length_factor = self.document_lengths[documents] / max(average_length, 1.0)
+            numerator = frequency * 2.5
+            denominator = frequency + 1.5 * (0.75 + 0.25 * length_factor)
+            scores[documents] += idf * (numerator / np.maximum(denominator, 1e-6)) * (1.0 + math.log1p(query_count))
+        return scores.tolist()
+
+    def _candidate_similarity_matrix(self, candidates: Sequence[int]) -> np.ndarray:
+        """Pairwise non-negative similarity of the candidate pool, computed once per query."""
+        count = len(candidates)
+        if self.text_embeddings and all(idx < len(self.text_embeddings) for idx in candidates):
+            matrix = self.text_embeddings.rows(candidates)
+            return np.clip(matrix @ matrix.T, 0.0, 1.0)
+        token_sets = [self._token_set(idx) for idx in candidates]
+        similarity = np.zeros((count, count), dtype=np.float64)
+        for row in range(count):
+            for column in range(row, count):
+                left, right = token_sets[row], token_sets[column]
+                value = len(left & right) / max(len(left | right), 1)
+                similarity[row, column] = similarity[column, row] = value
+        return similarity
+
+    def _rank_candidates(self, combined: Sequence[float], tie_breakers: Sequence[float], candidate_k: int) -> List[int]:
+        return _rank_candidates(combined, tie_breakers, candidate_k, self.record.record_id_at)
+
+    def _query_vectors(
         self,
         query: str,
-        reference_image: Any = None,
-        reference_images: Optional[Sequence[Any]] = None,
-        preserve_reference_color: bool = False,
-        top_k: int = 4,
-        candidate_k: int = 16,
-        seed: int = 0,
-        exploration_strength: str = "Medium",
-    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
-        top_k = max(1, min(8, int(top_k)))
-        exploration_name, profile = _exploration_profile(exploration_strength)
-        candidate_k = max(top_k, min(int(candidate_k), int(profile["candidate_k"])))
-        references = list(reference_images or [])
-        if reference_image is not None:
-            references.insert(0, reference_image)
-        bm25 = self._bm25_scores(query)
+        references: Sequence[Any],
+        preserve_reference_color: bool,
+    ) -> Tuple[Optional[List[float]], Optional[List[float]]]:
         text_query = (
             _encode_text(self.embedding_model_path, query, device=self.embedding_device)
             if self.embedding_model_path
@@ -585,56 +1207,81 @@ class DatasetIndex:
                         grayscale=not preserve_reference_color,
                     )
                 )
+        return text_query, image_query
 
-        text_scores = [_cosine(text_query, vector) for vector in self.text_embeddings] if text_query else [0.0] * len(self.record.entries)
+    def _score_components(
+        self,
+        query: str,
+        text_query: Optional[List[float]],
+        image_query: Optional[List[float]],
+        has_references: bool,
+        preserve_reference_color: bool,
+    ) -> Tuple[Dict[str, float], List[float], Dict[str, List[float]]]:
+        """Return the weight policy, combined scores, and normalized per-component scores."""
+        bm25 = self._bm25_scores(query)
+        text_scores = self.text_embeddings.scores(text_query).tolist() if text_query else [0.0] * len(self.record.entries)
         image_vectors = self.image_embeddings if preserve_reference_color else self.gray_embeddings
-        image_scores = [_cosine(image_query, vector) for vector in image_vectors] if image_query else [0.0] * len(self.record.entries)
+        image_scores = image_vectors.scores(image_query).tolist() if image_query else [0.0] * len(self.record.entries)
 
-        if references and self.embedding_model_path:
+        if has_references and self.embedding_model_path:
             weights = {"image": 0.45, "text": 0.35, "bm25": 0.20}
         elif self.embedding_model_path:
             weights = {"image": 0.0, "text": 0.65, "bm25": 0.35}
         else:
             weights = {"image": 0.0, "text": 0.0, "bm25": 1.0}
-        normalized_bm25 = _normalize_scores(bm25)
-        normalized_text = _normalize_scores(text_scores)
-        normalized_image = _normalize_scores(image_scores)
+        components = {
+            "bm25": _normalize_scores(bm25),
+            "text_embedding": _normalize_scores(text_scores),
+            "image_embedding": _normalize_scores(image_scores),
+        }
         combined = [
-            weights["image"] * normalized_image[idx]
-            + weights["text"] * normalized_text[idx]
-            + weights["bm25"] * normalized_bm25[idx]
+            weights["image"] * components["image_embedding"][idx]
+            + weights["text"] * components["text_embedding"][idx]
+            + weights["bm25"] * components["bm25"][idx]
             for idx in range(len(self.record.entries))
         ]
+        return weights, combined, components
+
+    def retrieve(
+        self,
+        query: str,
+        reference_image: Any = None,
+        reference_images: Optional[Sequence[Any]] = None,
+        preserve_reference_color: bool = False,
+        top_k: int = 4,
+        candidate_k: int = 16,
+        seed: int = 0,
+        exploration_strength: str = "Medium",
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        top_k = max(1, min(8, int(top_k)))
+        exploration_name, profile = _exploration_profile(exploration_strength)
+        candidate_k = max(top_k, min(int(candidate_k), int(profile["candidate_k"])))
+        references = list(reference_images or [])
+        if reference_image is not None:
+            references.insert(0, reference_image)
+        text_query, image_query = self._query_vectors(query, references, preserve_reference_color)
+        weights, combined, components = self._score_components(
+            query,
+            text_query,
+            image_query,
+            bool(references),
+            preserve_reference_color,
+        )
         # The seed controls only deterministic sampling within the relevant pool.
         # It never changes the semantic scores or allows candidates outside the pool.
         tie_rng = random.Random(int(seed))
-        tie_breakers = {idx: tie_rng.random() for idx in range(len(combined))}
-        ranked_candidates = sorted(
-            range(len(combined)),
-            key=lambda idx: (combined[idx], tie_breakers[idx], self.record.entries[idx].record_id),
-            reverse=True,
-        )
-        candidates = ranked_candidates[:candidate_k]
-        candidate_pool = list(candidates)
-
-        selected: List[int] = []
-        while candidates and len(selected) < top_k:
-            utilities = [
-                profile["relevance"] * combined[idx]
-                - (
-                    profile["diversity"]
-                    * max((self._similarity_to_selected(idx, other) for other in selected), default=0.0)
-                )
-                for idx in candidates
-            ]
-            best = _seeded_weighted_choice(
-                candidates,
-                utilities,
+        tie_breakers = [tie_rng.random() for _ in range(len(combined))]
+        candidate_pool = self._rank_candidates(combined, tie_breakers, candidate_k)
+        selected = [
+            candidate_pool[position]
+            for position in _select_mmr(
+                [combined[idx] for idx in candidate_pool],
+                self._candidate_similarity_matrix(candidate_pool),
+                profile,
                 tie_rng,
-                profile["sampling_temperature"],
+                top_k,
             )
-            selected.append(best)
-            candidates.remove(best)
+        ]
 
         results = []
         for rank, idx in enumerate(selected, start=1):
@@ -648,11 +1295,7 @@ class DatasetIndex:
                     "image_paths": entry.grouped_relative_image_paths(),
                     "image_roles": list(entry.grouped_relative_image_paths()),
                     "score": round(float(combined[idx]), 6),
-                    "components": {
-                        "bm25": round(float(normalized_bm25[idx]), 6),
-                        "text_embedding": round(float(normalized_text[idx]), 6),
-                        "image_embedding": round(float(normalized_image[idx]), 6),
-                    },
+                    "components": _component_summary(components, idx),
                 }
             )
         selected_ranks = {idx: rank for rank, idx in enumerate(selected, start=1)}
@@ -660,6 +1303,10 @@ class DatasetIndex:
             "index_version": self.version,
             "embedding_model_path": self.embedding_model_path,
             "embedding_device": self.embedding_device,
+            "embedding_storage": self.embedding_storage,
+            "embedding_storage_report": self.storage_report,
+            "shared_embeddings": self.text_embeddings.shared,
+            "image_dedup": self.image_dedup,
             "reference_image_used": bool(references),
             "reference_image_count": len(references),
             "reference_color_preserved": bool(preserve_reference_color),
@@ -676,15 +1323,11 @@ class DatasetIndex:
             "candidate_pool": [
                 {
                     "candidate_rank": rank,
-                    "record_id": self.record.entries[idx].record_id,
+                    "record_id": self.record.record_id_at(idx),
                     "selected_rank": selected_ranks.get(idx),
                     "score": round(float(combined[idx]), 6),
                     "tie_breaker": round(float(tie_breakers[idx]), 6),
-                    "components": {
-                        "bm25": round(float(normalized_bm25[idx]), 6),
-                        "text_embedding": round(float(normalized_text[idx]), 6),
-                        "image_embedding": round(float(normalized_image[idx]), 6),
-                    },
+                    "components": _component_summary(components, idx),
                 }
                 for rank, idx in enumerate(candidate_pool, start=1)
             ],
@@ -693,6 +1336,215 @@ class DatasetIndex:
         return results, debug
 
 
+def _rank_candidates(
+    combined: Sequence[float],
+    tie_breakers: Sequence[float],
+    candidate_k: int,
+    label: Any,
+) -> List[int]:
+    scores = np.asarray(combined, dtype=np.float64)
+    shortlist = range(len(scores))
+    if len(scores) > candidate_k:
+        # Only entries scoring at least the k-th best can enter the pool; the
+        # exact (score, tie breaker, label) ordering is applied to those.
+        threshold = np.partition(scores, len(scores) - candidate_k)[len(scores) - candidate_k]
+        shortlist = np.flatnonzero(scores >= threshold).tolist()
+    return sorted(
+        shortlist,
+        key=lambda idx: (combined[idx], tie_breakers[idx], label(idx)),
+        reverse=True,
+    )[:candidate_k]
+
+
+def _select_mmr(
+    relevance: Sequence[float],
+    similarity: np.ndarray,
+    profile: Dict[str, float],
+    rng: random.Random,
+    top_k: int,
+) -> List[int]:
+    """Seeded weighted MMR over a candidate pool; returns pool positions in selection order."""
+    # Diversity only needs the best match against the already-selected set, so
+    # keep a running maximum instead of rescoring every selected pair per round.
+    relevance = np.asarray(relevance, dtype=np.float64)
+    max_similarity = np.zeros(len(relevance), dtype=np.float64)
+    remaining = list(range(len(relevance)))
+    selected: List[int] = []
+    while remaining and len(selected) < top_k:
+        utilities = profile["relevance"] * relevance[remaining] - profile["diversity"] * max_similarity[remaining]
+        best = _seeded_weighted_choice(remaining, utilities.tolist(), rng, profile["sampling_temperature"])
+        selected.append(best)
+        remaining.remove(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def _component_summary(components: Dict[str, Sequence[float]], idx: int) -> Dict[str, float]:
+    return {name: round(float(values[idx]), 6) for name, values in components.items()}
+
+
+def _federated_similarity(members: Sequence[Tuple[DatasetIndex, int]]) -> np.ndarray:
+    """Pairwise similarity for a pool drawn from several indexes.
+
+    Text embeddings are only comparable when every index uses the same model, so
+    mixed pools fall back to Jaccard similarity over caption tokens.
+    """
+    model_paths = {index.embedding_model_path for index, _ in members}
+    dimensions = {index.text_embeddings.dimension for index, _ in members}
+    if (
+        len(model_paths) == 1
+        and len(dimensions) == 1
+        and all(index.text_embeddings and idx < len(index.text_embeddings) for index, idx in members)
+    ):
+        matrix = np.vstack([index.text_embeddings.rows([idx]) for index, idx in members])
+        return np.clip(matrix @ matrix.T, 0.0, 1.0)
+    token_sets = [set(tokenize(index.record.caption_at(idx))) for index, idx in members]
+    count = len(members)
+    similarity = np.zeros((count, count), dtype=np.float64)
+    for row in range(count):
+        for column in range(row, count):
+            left, right = token_sets[row], token_sets[column]
+            value = len(left & right) / max(len(left | right), 1)
+            similarity[row, column] = similarity[column, row] = value
+    return similarity
+
+
+def retrieve_federated(
+    indexes: Sequence[Tuple[DatasetIndex, float]],
+    query: str,
+    reference_images: Optional[Sequence[Any]] = None,
+    preserve_reference_color: bool = False,
+    top_k: int = 4,
+    candidate_k: int = 16,
+    seed: int = 0,
+    exploration_strength: str = "Medium",
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Retrieve from several dataset indexes with per-dataset weights and one global MMR.
+
+    Each index scores and normalizes its own entries exactly like ``retrieve``; the
+    weighted scores are then merged into one candidate pool so diversity is enforced
+    across datasets instead of per dataset.
+    """
+    if not indexes:
+        raise DatasetError("[IAT] Federated retrieval requires at least one dataset index.")
+    top_k = max(1, min(8, int(top_k)))
+    exploration_name, profile = _exploration_profile(exploration_strength)
+    candidate_k = max(top_k, min(int(candidate_k), int(profile["candidate_k"])))
+    references = list(reference_images or [])
+
+    query_vectors: Dict[Tuple[str, str], Tuple[Optional[List[float]], Optional[List[float]]]] = {}
+    owners: List[int] = []
+    local_ids: List[int] = []
+    weighted_scores: List[np.ndarray] = []
+    component_sets: List[Dict[str, List[float]]] = []
+    dataset_debug: List[Dict[str, Any]] = []
+    for owner, (index, dataset_weight) in enumerate(indexes):
+        dataset_weight = max(0.0, float(dataset_weight))
+        key = (index.embedding_model_path, index.embedding_device)
+        if key not in query_vectors:
+            # Indexes sharing an embedding model share one encoded query.
+            query_vectors[key] = index._query_vectors(query, references, preserve_reference_color)
+        weights, combined, components = index._score_components(
+            query,
+            *query_vectors[key],
+            bool(references),
+            preserve_reference_color,
+        )
+        weighted_scores.append(dataset_weight * np.asarray(combined, dtype=np.float64))
+        component_sets.append(components)
+        owners.extend([owner] * len(combined))
+        local_ids.extend(range(len(combined)))
+        dataset_debug.append(
+            {
+                "dataset_name": index.record.dataset_name,
+                "dataset_weight": dataset_weight,
+                "index_version": index.version,
+                "entry_count": len(combined),
+                "weights": weights,
+            }
+        )
+
+    combined_scores = np.concatenate(weighted_scores) if weighted_scores else np.zeros(0)
+    combined_list = combined_scores.tolist()
+    tie_rng = random.Random(int(seed))
+    tie_breakers = [tie_rng.random() for _ in range(len(combined_list))]
+    candidate_pool = _rank_candidates(
+        combined_list,
+        tie_breakers,
+        candidate_k,
+        lambda position: (
+            indexes[owners[position]][0].record.dataset_name,
+            indexes[owners[position]][0].record.record_id_at(local_ids[position]),
+        ),
+    )
+    members = [(indexes[owners[position]][0], local_ids[position]) for position in candidate_pool]
+    selected = [
+        candidate_pool[position]
+        for position in _select_mmr(
+            [combined_list[position] for position in candidate_pool],
+            _federated_similarity(members),
+            profile,
+            tie_rng,
+            top_k,
+        )
+    ]
+
+    results = []
+    for rank, position in enumerate(selected, start=1):
+        index = indexes[owners[position]][0]
+        entry = index.record.entries[local_ids[position]]
+        results.append(
+            {
+                "rank": rank,
+                "dataset_name": index.record.dataset_name,
+                "record_id": entry.record_id,
+                "caption": entry.caption,
+                "image_path": entry.relative_image_path,
+                "image_paths": entry.grouped_relative_image_paths(),
+                "image_roles": list(entry.grouped_relative_image_paths()),
+                "score": round(float(combined_list[position]), 6),
+                "components": _component_summary(component_sets[owners[position]], local_ids[position]),
+            }
+        )
+    selected_ranks = {position: rank for rank, position in enumerate(selected, start=1)}
+    warnings: List[str] = []
+    for index, _ in indexes:
+        warnings.extend(index.warnings + index.record.warnings)
+    debug = {
+        "index_version": "+".join(index.version for index, _ in indexes),
+        "datasets": dataset_debug,
+        "embedding_model_path": indexes[0][0].embedding_model_path,
+        "embedding_device": indexes[0][0].embedding_device,
+        "embedding_storage": indexes[0][0].embedding_storage,
+        "reference_image_used": bool(references),
+        "reference_image_count": len(references),
+        "reference_color_preserved": bool(preserve_reference_color),
+        "candidate_k": candidate_k,
+        "selected_k": len(results),
+        "retrieval_seed": int(seed),
+        "exploration_strength": exploration_name,
+        "relevance_weight": profile["relevance"],
+        "diversity_weight": profile["diversity"],
+        "sampling_temperature": profile["sampling_temperature"],
+        "selection_method": "seeded_weighted_mmr",
+        "ranking_source": "federated_weighted_hybrid_score_then_seeded_mmr",
+        "candidate_pool": [
+            {
+                "candidate_rank": rank,
+                "dataset_name": indexes[owners[position]][0].record.dataset_name,
+                "record_id": indexes[owners[position]][0].record.record_id_at(local_ids[position]),
+                "selected_rank": selected_ranks.get(position),
+                "score": round(float(combined_list[position]), 6),
+                "tie_breaker": round(float(tie_breakers[position]), 6),
+                "components": _component_summary(component_sets[owners[position]], local_ids[position]),
+            }
+            for rank, position in enumerate(candidate_pool, start=1)
+        ],
+        "warnings": warnings,
+    }
+    return results, debug
+
+
 def _resolve_embedding_device(device: str) -> str:
     try:
         import torch
@@ -711,25 +1563,149 @@ def _resolve_embedding_device(device: str) -> str:
         raise EmbeddingModelUnavailable(f"[IAT] Could not resolve embedding device: {exc}") from exc
 
 
+def configure_embedding_acceleration(
+    precision: str = "float32",
+    compile_model: bool = False,
+    num_threads: int = 0,
+    runtime: str = "torch",
+) -> None:
+    """Set Chinese CLIP precision, ``torch.compile``, CPU thread and runtime options for later loads.
+
+    ``precision`` is float32, auto (fp16 on CUDA, bf16 on CPUs that support it),
+    bf16 or fp16; unsupported choices fall back to float32 on that device.
+    ``runtime: onnx`` runs CPU embedding through ONNX Runtime when it is installed.
+    """
+    normalized = (precision or "float32").strip().lower()
+    if normalized not in _EMBEDDING_PRECISIONS:
+        raise DatasetError(
+            f"[IAT] Unsupported embedding precision `{precision}`; expected one of {', '.join(_EMBEDDING_PRECISIONS)}."
+        )
+    normalized_runtime = (runtime or "torch").strip().lower()
+    if normalized_runtime not in _EMBEDDING_RUNTIMES:
+        raise DatasetError(
+            f"[IAT] Unsupported embedding runtime `{runtime}`; expected one of {', '.join(_EMBEDDING_RUNTIMES)}."
+        )
+    _EMBEDDING_ACCELERATION.update(
+        {
+            "precision": normalized,
+            "compile": bool(compile_model),
+            "num_threads": max(0, int(num_threads or 0)),
+            "runtime": normalized_runtime,
+        }
+    )
+
+
+def _embedding_signature(embedding_model_path: str, device: str, thumbnail_edge: int = 0) -> Dict[str, str]:
+    """Precision, runtime and image-source settings that change the vectors stored in an index cache.
+
+    Image vectors encoded from pre-resized thumbnails differ slightly from ones encoded
+    from the originals, so the thumbnail edge is part of the signature when enabled.
+    """
+    if not embedding_model_path:
+        return {}
+    runtime = str(_EMBEDDING_ACCELERATION["runtime"]) if device == "cpu" else "torch"
+    signature = {"precision": str(_EMBEDDING_ACCELERATION["precision"]), "runtime": runtime}
+    if thumbnail_edge:
+        signature["thumbnail_edge"] = str(int(thumbnail_edge))
+    return signature
+
+
+def _cpu_supports_bf16() -> bool:
+    try:
+        import torch
+
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def _embedding_torch_dtype(precision: str, device: str) -> Any:
+    import torch
+
+    if device == "cuda":
+        if precision in {"auto", "fp16"}:
+            return torch.float16
+        if precision == "bf16" and torch.cuda.is_bf16_supported():
+            return torch.bfloat16
+        return torch.float32
+    # fp16 matmuls are slow or missing on most CPUs, so only bf16 is used there.
+    if precision in {"auto", "bf16"} and _cpu_supports_bf16():
+        return torch.bfloat16
+    return torch.float32
+
+
+def _compiled_features(method: Any) -> Any:
+    """``torch.compile`` a feature method, falling back to eager if compilation fails."""
+    import torch
+
+    compiled = [torch.compile(method, dynamic=True)]
+
+    def call(**inputs: Any) -> Any:
+        if compiled[0] is not None:
+            try:
+                return compiled[0](**inputs)
+            except Exception:
+                compiled[0] = None
+        return method(**inputs)
+
+    return call
+
+
+@contextmanager
+def _embedding_threads(device: str):
+    """Apply ``datasets.embedding_num_threads`` for CPU encoding without leaking it to other nodes."""
+    threads = int(_EMBEDDING_ACCELERATION["num_threads"])
+    if device != "cpu" or threads <= 0:
+        yield
+        return
+    import torch
+
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
 def _load_embedding_model(model_path: str, device: str = "cpu"):
     normalized = str(Path(model_path).expanduser())
     if not normalized:
         raise EmbeddingModelUnavailable("[IAT] Embedding model path is not configured.")
     resolved_device = _resolve_embedding_device(device)
-    cache_key = (normalized, resolved_device)
+    precision = str(_EMBEDDING_ACCELERATION["precision"])
+    compile_model = bool(_EMBEDDING_ACCELERATION["compile"])
+    # ONNX Runtime is only used for CPU embedding; CUDA keeps the torch path.
+    use_onnx = _EMBEDDING_ACCELERATION["runtime"] == "onnx" and resolved_device == "cpu"
+    cache_key = (normalized, resolved_device, "onnx" if use_onnx else precision, compile_model and not use_onnx)
     if cache_key in _EMBEDDING_MODELS:
         return _EMBEDDING_MODELS[cache_key]
     path = Path(normalized)
     if not path.is_dir():
         raise EmbeddingModelUnavailable(f"[IAT] Local embedding model does not exist: `{path}`")
+    if use_onnx:
+        onnx_model = _load_onnx_embedding_model(path)
+        if onnx_model is not None:
+            _EMBEDDING_MODELS[cache_key] = onnx_model
+            return onnx_model
     try:
         import torch
+        import transformers
         from transformers import ChineseCLIPModel, ChineseCLIPProcessor
 
+        # Transformers 5 renamed ``torch_dtype`` to ``dtype``.
+        dtype_kwarg = "dtype" if int(transformers.__version__.split(".")[0]) >= 5 else "torch_dtype"
         processor = ChineseCLIPProcessor.from_pretrained(str(path), local_files_only=True)
-        model = ChineseCLIPModel.from_pretrained(str(path), local_files_only=True)
+        model = ChineseCLIPModel.from_pretrained(
+            str(path),
+            local_files_only=True,
+            **{dtype_kwarg: _embedding_torch_dtype(precision, resolved_device)},
+        )
         model.eval()
         model.to(resolved_device)
+        if compile_model and hasattr(torch, "compile"):
+            model.get_text_features = _compiled_features(model.get_text_features)
+            model.get_image_features = _compiled_features(model.get_image_features)
     except Exception as exc:
         raise EmbeddingModelUnavailable(
             f"[IAT] Failed to load local Chinese CLIP embedding model `{path}` without downloading: {exc}"
@@ -738,6 +1714,162 @@ def _load_embedding_model(model_path: str, device: str = "cpu"):
     return processor, model
 
 
+class _OnnxEmbeddingModel:
+    """ONNX Runtime sessions exposing the ``get_*_features`` calls used by the encoders."""
+
+    dtype = None
+
+    def __init__(self, text_session: Any, vision_session: Any):
+        self.text_session = text_session
+        self.vision_session = vision_session
+
+    @staticmethod
+    def _run(session: Any, inputs: Dict[str, Any]) -> Any:
+        import torch
+
+        names = {item.name for item in session.get_inputs()}
+        feed = {key: value.cpu().numpy() for key, value in inputs.items() if key in names}
+        if "token_type_ids" in names and "token_type_ids" not in feed:
+            feed["token_type_ids"] = np.zeros_like(feed["input_ids"])
+        return torch.from_numpy(np.asarray(session.run(None, feed)[0]))
+
+    def get_text_features(self, **inputs: Any) -> Any:
+        return self._run(self.text_session, inputs)
+
+    def get_image_features(self, **inputs: Any) -> Any:
+        return self._run(self.vision_session, inputs)
+
+
+def _onnx_export_dir(model_path: Path) -> Path:
+    return model_path.parent / f"{model_path.name}.iat_onnx"
+
+
+def _onnx_source_signature(model_path: Path) -> List[List[Any]]:
+    return [
+        [item.name, item.stat().st_size, item.stat().st_mtime_ns]
+        for item in sorted(model_path.iterdir())
+        if item.is_file() and (item.suffix in {".json", ".safetensors", ".bin"})
+    ]
+
+
+def export_embedding_onnx(model_path: str, force: bool = False) -> Path:
+    """Export the Chinese CLIP text and vision towers to ONNX next to the model directory.
+
+    The export is reused until the model's config or weight files change.
+    """
+    path = Path(model_path).expanduser()
+    export_dir = _onnx_export_dir(path)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = export_dir / "export.json"
+    signature = _onnx_source_signature(path)
+    with _index_cache_lock(manifest_path):
+        if not force and _onnx_export_is_current(export_dir, signature):
+            return export_dir
+        import torch
+        from transformers import ChineseCLIPModel, ChineseCLIPProcessor
+
+        processor = ChineseCLIPProcessor.from_pretrained(str(path), local_files_only=True)
+        model = ChineseCLIPModel.from_pretrained(str(path), local_files_only=True)
+        model.eval()
+
+        class _Tower(torch.nn.Module):
+            def __init__(self, method: Any):
+                super().__init__()
+                self.model = model
+                self.method = method
+
+            def forward(self, *args: Any) -> Any:
+                features = self.method(*args)
+                return features if torch.is_tensor(features) else features.pooler_output
+
+        text_inputs = processor(text=["示例", "示例文本"], padding=True, return_tensors="pt")
+        pixel_values = processor(images=[_onnx_sample_image()], return_tensors="pt")["pixel_values"]
+        text_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in text_inputs]
+        exports = (
+            (
+                "text.onnx",
+                _Tower(lambda *args: model.get_text_features(**dict(zip(text_names, args)))),
+                tuple(text_inputs[name] for name in text_names),
+                text_names,
+                {name: {0: "batch", 1: "sequence"} for name in text_names},
+            ),
+            (
+                "vision.onnx",
+                _Tower(lambda pixels: model.get_image_features(pixel_values=pixels)),
+                (pixel_values,),
+                ["pixel_values"],
+                {"pixel_values": {0: "batch"}},
+            ),
+        )
+        for filename, tower, args, input_names, dynamic_axes in exports:
+            target = export_dir / filename
+            temp_path = export_dir / f".{filename}.tmp"
+            with torch.inference_mode():
+                torch.onnx.export(
+                    tower,
+                    args,
+                    str(temp_path),
+                    input_names=input_names,
+                    output_names=["features"],
+                    dynamic_axes={**dynamic_axes, "features": {0: "batch"}},
+                    opset_version=_ONNX_OPSET,
+                    dynamo=False,
+                )
+            os.replace(temp_path, target)
+        _atomic_write_text(
+            manifest_path,
+            json.dumps({"opset": _ONNX_OPSET, "source": signature}, ensure_ascii=False),
+        )
+    return export_dir
+
+
+def _onnx_export_is_current(export_dir: Path, signature: List[List[Any]]) -> bool:
+    try:
+        manifest = json.loads((export_dir / "export.json").read_text(encoding="utf-8"))
+    except Exception:
+        return False
+    return (
+        manifest.get("opset") == _ONNX_OPSET
+        and manifest.get("source") == signature
+        and (export_dir / "text.onnx").is_file()
+        and (export_dir / "vision.onnx").is_file()
+    )
+
+
+def _onnx_sample_image() -> Any:
+    from PIL import Image
+
+    return Image.new("RGB", (224, 224), (127, 127, 127))
+
+
+def _load_onnx_embedding_model(path: Path) -> Optional[Tuple[Any, Any]]:
+    """Processor plus ONNX sessions, or None (with a recorded note) to fall back to torch."""
+    try:
+        import onnxruntime
+    except ImportError:
+        _EMBEDDING_RUNTIME_NOTES[str(path)] = "onnxruntime is not installed; embedding with torch."
+        return None
+    try:
+        from transformers import ChineseCLIPProcessor
+
+        export_dir = export_embedding_onnx(str(path))
+        options = onnxruntime.SessionOptions()
+        threads = int(_EMBEDDING_ACCELERATION["num_threads"])
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        providers = ["CPUExecutionProvider"]
+        model = _OnnxEmbeddingModel(
+            onnxruntime.InferenceSession(str(export_dir / "text.onnx"), options, providers=providers),
+            onnxruntime.InferenceSession(str(export_dir / "vision.onnx"), options, providers=providers),
+        )
+        processor = ChineseCLIPProcessor.from_pretrained(str(path), local_files_only=True)
+    except Exception as exc:
+        _EMBEDDING_RUNTIME_NOTES[str(path)] = f"ONNX embedding runtime failed ({exc}); embedding with torch."
+        return None
+    _EMBEDDING_RUNTIME_NOTES.pop(str(path), None)
+    return processor, model
+
+
 def _as_float_list(tensor: Any) -> List[float]:
     values = tensor.detach().float().cpu()
     norm = values.norm(p=2, dim=-1, keepdim=True).clamp_min(1e-12)
@@ -750,20 +1882,38 @@ def _as_float_lists(tensor: Any) -> List[List[float]]:
     return (values / norm).tolist()
 
 
-def _move_inputs(inputs: Dict[str, Any], device: str) -> Dict[str, Any]:
-    return {key: value.to(device) if hasattr(value, "to") else value for key, value in inputs.items()}
+def _move_inputs(inputs: Dict[str, Any], device: str, dtype: Any = None) -> Dict[str, Any]:
+    moved = {}
+    for key, value in inputs.items():
+        if not hasattr(value, "to"):
+            moved[key] = value
+        elif dtype is not None and value.is_floating_point():
+            # Pixel values follow the model's reduced precision; token ids stay integer.
+            moved[key] = value.to(device=device, dtype=dtype)
+        else:
+            moved[key] = value.to(device)
+    return moved
+
+
+def _embedding_features(model: Any, kind: str, inputs: Dict[str, Any], device: str) -> Any:
+    import torch
+
+    method = model.get_text_features if kind == "text" else model.get_image_features
+    with _embedding_threads(device), torch.inference_mode():
+        features = method(**_move_inputs(inputs, device, getattr(model, "dtype", None)))
+    # Transformers 5 returns a model output whose pooler_output holds the projected features.
+    return features if torch.is_tensor(features) else features.pooler_output
 
 
 def _encode_text(model_path: str, text: str, device: str = "cpu") -> Optional[List[float]]:
     if not text:
         return None
     try:
-        import torch
         resolved_device = _resolve_embedding_device(device)
         processor, model = _load_embedding_model(model_path, resolved_device)
-        inputs = _move_inputs(processor(text=[text], padding=True, return_tensors="pt"), resolved_device)
-        with torch.inference_mode():
-            features = model.get_text_features(**inputs)
+        features = _embedding_features(
+            model, "text", processor(text=[text], padding=True, return_tensors="pt"), resolved_device
+        )
         return _as_float_list(features)
     except EmbeddingModelUnavailable:
         raise
@@ -775,7 +1925,6 @@ def _encode_image(model_path: str, image: Any, grayscale: bool = True, device: s
     if image is None:
         return None
     try:
-        import torch
         from PIL import Image
 
         if not isinstance(image, Image.Image):
@@ -783,9 +1932,7 @@ def _encode_image(model_path: str, image: Any, grayscale: bool = True, device: s
         prepared = image.convert("L").convert("RGB") if grayscale else image.convert("RGB")
         resolved_device = _resolve_embedding_device(device)
         processor, model = _load_embedding_model(model_path, resolved_device)
-        inputs = _move_inputs(processor(images=[prepared], return_tensors="pt"), resolved_device)
-        with torch.inference_mode():
-            features = model.get_image_features(**inputs)
+        features = _embedding_features(model, "image", processor(images=[prepared], return_tensors="pt"), resolved_device)
         return _as_float_list(features)
     except EmbeddingModelUnavailable:
         raise
@@ -794,15 +1941,12 @@ def _encode_image(model_path: str, image: Any, grayscale: bool = True, device: s
 
 
 def _encode_text_batch(model_path: str, texts: Sequence[str], device: str, batch_size: int) -> List[List[float]]:
-    import torch
-
     resolved_device = _resolve_embedding_device(device)
     processor, model = _load_embedding_model(model_path, resolved_device)
     vectors: List[List[float]] = []
     for start in range(0, len(texts), batch_size):
         inputs = processor(text=list(texts[start : start + batch_size]), padding=True, return_tensors="pt")
-        with torch.inference_mode():
-            features = model.get_text_features(**_move_inputs(inputs, resolved_device))
+        features = _embedding_features(model, "text", inputs, resolved_device)
         vectors.extend(_as_float_lists(features))
     return vectors
 
@@ -814,8 +1958,6 @@ def _encode_image_batch(
     batch_size: int,
     grayscale: bool,
 ) -> List[List[float]]:
-    import torch
-
     resolved_device = _resolve_embedding_device(device)
     processor, model = _load_embedding_model(model_path, resolved_device)
     vectors: List[List[float]] = []
@@ -823,30 +1965,138 @@ def _encode_image_batch(
         batch = images[start : start + batch_size]
         prepared = [image.convert("L").convert("RGB") if grayscale else image.convert("RGB") for image in batch]
         inputs = processor(images=prepared, return_tensors="pt")
-        with torch.inference_mode():
-            features = model.get_image_features(**_move_inputs(inputs, resolved_device))
+        features = _embedding_features(model, "image", inputs, resolved_device)
         vectors.extend(_as_float_lists(features))
     return vectors
 
 
-def _serialize_index(index: DatasetIndex) -> Dict[str, Any]:
-    return {
-        "schema_version": 3,
+def _serialize_index(index: DatasetIndex, embedding_blob: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # With a shared embedding file the JSON keeps only its layout, not the vectors.
+    payload = {
+        "schema_version": _INDEX_SCHEMA_VERSION,
         "fingerprint": index.fingerprint,
+        "image_fingerprint": index.image_fingerprint,
         "embedding_model_path": index.embedding_model_path,
-        "text_embeddings": index.text_embeddings,
-        "image_embeddings": index.image_embeddings,
-        "gray_embeddings": index.gray_embeddings,
+        "embedding_signature": _embedding_signature(index.embedding_model_path, index.embedding_device, index.thumbnail_edge),
+        "embedding_storage": index.embedding_storage,
+        "embedding_storage_report": index.storage_report,
+        "image_dedup": index.image_dedup,
+        "text_embeddings": [] if embedding_blob else index.text_embeddings.tolist(),
+        "image_embeddings": [] if embedding_blob else index.image_embeddings.tolist(),
+        "gray_embeddings": [] if embedding_blob else index.gray_embeddings.tolist(),
         "entries": [
             {
-                "record_id": entry.record_id,
-                "caption": entry.caption,
-                "image_path": entry.relative_image_path,
-                "image_paths": entry.grouped_relative_image_paths(),
+                "record_id": index.record.record_id_at(idx),
+                "caption": index.record.caption_at(idx),
+                "image_path": _primary_relative_path(index.record.relative_image_paths_at(idx)),
+                "image_paths": index.record.relative_image_paths_at(idx),
             }
-            for entry in index.record.entries
+            for idx in range(len(index.record.entries))
         ],
     }
+    if embedding_blob:
+        payload["embedding_blob"] = embedding_blob
+    return payload
+
+
+def _embedding_blob_path(cache_path: Path) -> Path:
+    return cache_path.with_name(cache_path.name[: -len(".index.json")] + ".embeddings.bin")
+
+
+def _thumbnail_digest_path(cache_path: Path) -> Path:
+    return cache_path.with_name(cache_path.name[: -len(".index.json")] + ".thumbnails.json")
+
+
+def _write_embedding_blob(index: DatasetIndex, blob_path: Path) -> Dict[str, Any]:
+    """Write the stored embedding matrices as raw aligned arrays; return their layout.
+
+    The file starts with a magic and a random token that is repeated in the JSON
+    layout, so a JSON/blob pair written by different builds is never mixed.
+    """
+    token = os.urandom(12).hex()
+    layout: Dict[str, Any] = {"file": blob_path.name, "token": token, "matrices": {}}
+    fd, temp_name = tempfile.mkstemp(prefix=f".{blob_path.name}.", suffix=".tmp", dir=str(blob_path.parent))
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(_EMBEDDING_BLOB_MAGIC + token.encode("ascii"))
+
+            def write_array(values: np.ndarray) -> int:
+                padding = (-handle.tell()) % _EMBEDDING_BLOB_ALIGN
+                handle.write(b"\0" * padding)
+                offset = handle.tell()
+                handle.write(memoryview(np.ascontiguousarray(values)).cast("B"))
+                return offset
+
+            for name, matrix in (
+                ("text", index.text_embeddings),
+                ("image", index.image_embeddings),
+                ("gray", index.gray_embeddings),
+            ):
+                layout["matrices"][name] = {
+                    "rows": len(matrix),
+                    "dimension": matrix.dimension,
+                    "data_offset": write_array(matrix.data),
+                    "present_offset": write_array(matrix.present.astype(np.uint8)),
+                    "scales_offset": write_array(matrix.scales) if matrix.scales is not None else None,
+                }
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_name, blob_path)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except OSError:
+            pass
+        raise
+    return layout
+
+
+def _blob_array(path: Path, offset: Any, dtype: Any, shape: Tuple[int, ...], file_size: int, shared: bool) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape, dtype=np.int64))
+    if count == 0:
+        return np.zeros(shape, dtype=dtype)
+    offset = int(offset)
+    if offset < 0 or offset + count * dtype.itemsize > file_size:
+        raise DatasetError(f"[IAT] Shared embedding file `{path}` is truncated.")
+    if shared:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    return np.fromfile(path, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def _load_embedding_blob(
+    cache_path: Path,
+    layout: Dict[str, Any],
+    storage: str,
+    expected_rows: int,
+    shared: bool,
+) -> Optional[Dict[str, _EmbeddingMatrix]]:
+    """Attach the embedding file read-only (or copy it when sharing is off)."""
+    blob_path = cache_path.parent / Path(str(layout.get("file") or "")).name
+    token = str(layout.get("token") or "")
+    if not blob_path.is_file() or not token:
+        return None
+    with open(blob_path, "rb") as handle:
+        if handle.read(len(_EMBEDDING_BLOB_MAGIC) + len(token)) != _EMBEDDING_BLOB_MAGIC + token.encode("ascii"):
+            return None
+    file_size = blob_path.stat().st_size
+    matrices: Dict[str, _EmbeddingMatrix] = {}
+    for name in ("text", "image", "gray"):
+        spec = (layout.get("matrices") or {}).get(name)
+        if not isinstance(spec, dict):
+            return None
+        rows, dimension = int(spec.get("rows") or 0), int(spec.get("dimension") or 0)
+        if rows != expected_rows:
+            return None
+        data = _blob_array(blob_path, spec.get("data_offset"), _EMBEDDING_DTYPES[storage], (rows, dimension), file_size, shared)
+        present = _blob_array(blob_path, spec.get("present_offset"), np.uint8, (rows,), file_size, shared).view(np.bool_)
+        scales = None
+        if storage == "int8":
+            if spec.get("scales_offset") is None:
+                return None
+            scales = _blob_array(blob_path, spec["scales_offset"], np.float32, (rows,), file_size, shared)
+        matrices[name] = _EmbeddingMatrix.from_arrays(storage, data, present, scales)
+    return matrices
 
 
 def _deserialize_index(
@@ -855,45 +2105,35 @@ def _deserialize_index(
     fingerprint: str,
     embedding_model_path: str,
     embedding_device: str,
+    embedding_storage: str = "float32",
+    cache_path: Optional[Path] = None,
+    shared_embeddings: bool = False,
+    thumbnail_edge: int = 0,
 ) -> Optional[DatasetIndex]:
-    if payload.get("schema_version") != 3 or payload.get("fingerprint") != fingerprint:
+    if payload.get("schema_version") != _INDEX_SCHEMA_VERSION or payload.get("fingerprint") != fingerprint:
+        return None
+    if (payload.get("embedding_storage") or "float32") != embedding_storage:
         return None
     entries = payload.get("entries")
     if not isinstance(entries, list) or len(entries) != len(record.entries):
         return None
-    for expected, cached in zip(record.entries, entries):
+    for idx, cached in enumerate(entries):
         if (
-            expected.record_id != cached.get("record_id")
-            or expected.caption != cached.get("caption")
-            or expected.grouped_relative_image_paths() != (cached.get("image_paths") or {})
+            not isinstance(cached, dict)
+            or record.record_id_at(idx) != cached.get("record_id")
+            or record.caption_at(idx) != cached.get("caption")
+            or record.relative_image_paths_at(idx) != (cached.get("image_paths") or {})
         ):
             return None
     cached_model_path = str(payload.get("embedding_model_path") or "")
     if cached_model_path != str(embedding_model_path or ""):
         return None
-    text_embeddings = payload.get("text_embeddings") or []
-    image_embeddings = payload.get("image_embeddings") or []
-    gray_embeddings = payload.get("gray_embeddings") or []
-    if cached_model_path:
-        expected_count = len(record.entries)
-        if any(
-            not isinstance(vectors, list) or len(vectors) != expected_count
-            for vectors in (text_embeddings, image_embeddings, gray_embeddings)
-        ):
-            return None
-        if any(vector is None for vector in text_embeddings):
-            return None
-        dimensions: Optional[int] = None
-        for vectors in (text_embeddings, image_embeddings, gray_embeddings):
-            for vector in vectors:
-                if vector is None:
-                    continue
-                if not isinstance(vector, list) or not vector:
-                    return None
-                if dimensions is None:
-                    dimensions = len(vector)
-                if len(vector) != dimensions or any(not isinstance(value, (int, float)) for value in vector):
-                    return None
+    if (payload.get("embedding_signature") or {}) != _embedding_signature(cached_model_path, embedding_device, thumbnail_edge):
+        return None
+    embeddings = _payload_embeddings(payload, len(record.entries), cache_path, embedding_storage, shared_embeddings)
+    if embeddings is None:
+        return None
+    text_embeddings, image_embeddings, gray_embeddings = embeddings
     return DatasetIndex(
         record,
         fingerprint,
@@ -902,9 +2142,233 @@ def _deserialize_index(
         gray_embeddings=gray_embeddings,
         embedding_model_path=cached_model_path,
         embedding_device=embedding_device,
+        embedding_storage=embedding_storage,
+        storage_report=payload.get("embedding_storage_report") if isinstance(payload.get("embedding_storage_report"), dict) else None,
+        image_dedup=payload.get("image_dedup") if isinstance(payload.get("image_dedup"), dict) else None,
+        image_fingerprint=str(payload.get("image_fingerprint") or ""),
+        thumbnail_edge=thumbnail_edge,
     )
 
 
+def _payload_embeddings(
+    payload: Dict[str, Any],
+    expected_count: int,
+    cache_path: Optional[Path],
+    embedding_storage: str,
+    shared_embeddings: bool,
+) -> Optional[Tuple[Any, Any, Any]]:
+    """Validated (text, image, gray) embeddings of a cache payload, from lists or the shared file."""
+    text_embeddings: Any = payload.get("text_embeddings") or []
+    image_embeddings: Any = payload.get("image_embeddings") or []
+    gray_embeddings: Any = payload.get("gray_embeddings") or []
+    if not payload.get("embedding_model_path"):
+        return text_embeddings, image_embeddings, gray_embeddings
+    blob_layout = payload.get("embedding_blob")
+    if isinstance(blob_layout, dict):
+        if cache_path is None:
+            return None
+        matrices = _load_embedding_blob(cache_path, blob_layout, embedding_storage, expected_count, shared_embeddings)
+        if matrices is None or not bool(np.all(matrices["text"].present)):
+            return None
+        return matrices["text"], matrices["image"], matrices["gray"]
+    if any(
+        not isinstance(vectors, list) or len(vectors) != expected_count
+        for vectors in (text_embeddings, image_embeddings, gray_embeddings)
+    ):
+        return None
+    if any(vector is None for vector in text_embeddings):
+        return None
+    dimensions: Optional[int] = None
+    for vectors in (text_embeddings, image_embeddings, gray_embeddings):
+        for vector in vectors:
+            if vector is None:
+                continue
+            if not isinstance(vector, list) or not vector:
+                return None
+            if dimensions is None:
+                dimensions = len(vector)
+            if len(vector) != dimensions or any(not isinstance(value, (int, float)) for value in vector):
+                return None
+    return text_embeddings, image_embeddings, gray_embeddings
+
+
+def _caption_only_update(
+    cache_path: Path,
+    record: DatasetRecord,
+    fingerprint: str,
+    image_fingerprint: str,
+    embedding_model_path: str,
+    resolved_device: str,
+    embedding_batch_size: int,
+    embedding_storage: str,
+    thumbnail_edge: int = 0,
+) -> Optional[DatasetIndex]:
+    """Rebuild a stale index whose images are unchanged by re-encoding only edited captions.
+
+    Applies when the cached index used the same model, precision, runtime, thumbnails and storage, has the same
+    image fingerprint, and lists the same entries with the same image paths.
+    """
+    if not embedding_model_path or not image_fingerprint or not cache_path.is_file():
+        return None
+    try:
+        payload = json.loads(cache_path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if (
+        not isinstance(payload, dict)
+        or payload.get("schema_version") != _INDEX_SCHEMA_VERSION
+        or payload.get("image_fingerprint") != image_fingerprint
+        or (payload.get("embedding_storage") or "float32") != embedding_storage
+        or str(payload.get("embedding_model_path") or "") != str(embedding_model_path)
+        or (payload.get("embedding_signature") or {}) != _embedding_signature(embedding_model_path, resolved_device, thumbnail_edge)
+    ):
+        return None
+    entries = payload.get("entries")
+    if not isinstance(entries, list) or len(entries) != len(record.entries):
+        return None
+    changed: List[int] = []
+    for idx, cached in enumerate(entries):
+        if (
+            not isinstance(cached, dict)
+            or record.record_id_at(idx) != cached.get("record_id")
+            or record.relative_image_paths_at(idx) != (cached.get("image_paths") or {})
+        ):
+            return None
+        if record.caption_at(idx) != cached.get("caption"):
+            changed.append(idx)
+    try:
+        embeddings = _payload_embeddings(payload, len(record.entries), cache_path, embedding_storage, False)
+    except Exception:
+        return None
+    if embeddings is None:
+        return None
+    text_embeddings, image_embeddings, gray_embeddings = (
+        vectors.tolist() if isinstance(vectors, _EmbeddingMatrix) else list(vectors) for vectors in embeddings
+    )
+    if changed:
+        _load_embedding_model(embedding_model_path, resolved_device)
+        vectors = _encode_text_batch(
+            embedding_model_path,
+            [record.caption_at(idx) for idx in changed],
+            resolved_device,
+            max(1, int(embedding_batch_size)),
+        )
+        for idx, vector in zip(changed, vectors):
+            text_embeddings[idx] = vector
+    index = DatasetIndex(
+        record,
+        fingerprint,
+        text_embeddings=text_embeddings,
+        image_embeddings=image_embeddings,
+        gray_embeddings=gray_embeddings,
+        embedding_model_path=str(embedding_model_path),
+        embedding_device=resolved_device,
+        warnings=[
+            f"Images unchanged; re-encoded {len(changed)} edited caption(s) and reused cached image embeddings."
+        ],
+        embedding_storage=embedding_storage,
+        # The vectors above were dequantized from the cache, so a fresh report would
+        # compare the stored matrix with itself; keep the one measured at build time.
+        storage_report=payload.get("embedding_storage_report") if isinstance(payload.get("embedding_storage_report"), dict) else None,
+        image_dedup=payload.get("image_dedup") if isinstance(payload.get("image_dedup"), dict) else None,
+        image_fingerprint=image_fingerprint,
+        thumbnail_edge=thumbnail_edge,
+    )
+    return index
+
+
+def _storage_reports(index: DatasetIndex, text_embeddings: Any, image_embeddings: Any, gray_embeddings: Any) -> Dict[str, Any]:
+    return {
+        name: _embedding_storage_report(vectors, matrix)
+        for name, vectors, matrix in (
+            ("text", text_embeddings, index.text_embeddings),
+            ("image", image_embeddings, index.image_embeddings),
+            ("gray", gray_embeddings, index.gray_embeddings),
+        )
+    }
+
+
+@contextmanager
+def _index_cache_lock(cache_path: Path, timeout: float = _INDEX_LOCK_TIMEOUT_SECONDS):
+    """Hold an exclusive ``<name>.index.lock`` while an index is checked and built."""
+    lock_path = cache_path.with_name(cache_path.name[: -len(".json")] + ".lock")
+    with open(lock_path, "a+", encoding="utf-8") as lock_fp:
+        if fcntl is None:
+            yield
+            return
+
+        start = time.time()
+        acquired = False
+        while time.time() - start < timeout:
+            try:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except BlockingIOError:
+                time.sleep(0.2)
+            except Exception as exc:
+                raise DatasetError(f"[IAT] Could not lock index cache `{lock_path}`: {exc}") from exc
+
+        if not acquired:
+            raise DatasetError(f"[IAT] Timed out after {timeout}s waiting for index cache lock `{lock_path}`.")
+        try:
+            yield
+        finally:
+            try:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_UN)
+            except Exception:
+                pass
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """Write to a temp file in the same directory and rename it over ``path``."""
+    fd, temp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            handle.write(text)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except OSError:
+            pass
+        raise
+
+
+def _load_cached_index(
+    cache_path: Path,
+    record: DatasetRecord,
+    fingerprint: str,
+    embedding_model_path: str,
+    resolved_device: str,
+    embedding_storage: str,
+    require_embeddings: bool,
+    shared_embeddings: bool = False,
+    thumbnail_edge: int = 0,
+) -> Optional[DatasetIndex]:
+    if not cache_path.is_file():
+        return None
+    try:
+        cached = _deserialize_index(
+            json.loads(cache_path.read_text(encoding="utf-8")),
+            record,
+            fingerprint,
+            embedding_model_path,
+            resolved_device,
+            embedding_storage,
+            cache_path=cache_path,
+            shared_embeddings=shared_embeddings,
+            thumbnail_edge=thumbnail_edge,
+        )
+    except Exception:
+        return None
+    if cached is not None and require_embeddings and not cached.text_embeddings:
+        raise EmbeddingModelUnavailable("[IAT] Dataset index has no embeddings; configure a local Chinese CLIP model.")
+    return cached
+
+
 def get_dataset_index(
     record: DatasetRecord,
     cache_dir: Path,
@@ -912,69 +2376,320 @@ def get_dataset_index(
     require_embeddings: bool = False,
     embedding_device: str = "cpu",
     embedding_batch_size: int = 16,
+    embedding_storage: str = "float32",
+    lock_timeout: float = _INDEX_LOCK_TIMEOUT_SECONDS,
+    shared_embeddings: bool = False,
+    thumbnail_cache: bool = False,
+    fingerprints: Optional[Dict[str, str]] = None,
 ) -> DatasetIndex:
-    fingerprint = dataset_fingerprint(record)
+    """Load or build the index of ``record``.
+
+    ``fingerprints`` may carry a ``dataset_fingerprints(record)`` result the
+    caller already computed, so the dataset is hashed only once per request.
+    """
+    embedding_storage = (embedding_storage or "float32").strip().lower()
+    if embedding_storage not in _EMBEDDING_STORAGES:
+        raise DatasetError(
+            f"[IAT] Unsupported embedding storage `{embedding_storage}`; expected one of {', '.join(_EMBEDDING_STORAGES)}."
+        )
+    fingerprints = fingerprints or dataset_fingerprints(record)
+    fingerprint = fingerprints["dataset"]
     resolved_device = _resolve_embedding_device(embedding_device) if embedding_model_path else "cpu"
     cache_dir = Path(cache_dir)
     cache_dir.mkdir(parents=True, exist_ok=True)
     cache_path = cache_dir / f"{_safe_name(record.dataset_name)}.index.json"
-    if cache_path.is_file():
-        try:
-            cached = _deserialize_index(
-                json.loads(cache_path.read_text(encoding="utf-8")),
+    thumbnail_edge = _encoder_image_edge(embedding_model_path) if thumbnail_cache and embedding_model_path else 0
+    load_args = (
+        record,
+        fingerprint,
+        embedding_model_path,
+        resolved_device,
+        embedding_storage,
+        require_embeddings,
+        shared_embeddings,
+        thumbnail_edge,
+    )
+    cached = _load_cached_index(cache_path, *load_args)
+    if cached is None or _needs_shared_rewrite(cached, shared_embeddings):
+        cached = _locked_dataset_index(
+            cache_path, load_args, lock_timeout, embedding_batch_size, fingerprints["images"]
+        )
+    _touch_index_cache(cache_path, record, fingerprint)
+    return cached
+
+
+def _locked_dataset_index(
+    cache_path: Path,
+    load_args: Tuple[Any, ...],
+    lock_timeout: float,
+    embedding_batch_size: int,
+    image_fingerprint: str = "",
+) -> DatasetIndex:
+    (
+        record,
+        fingerprint,
+        embedding_model_path,
+        resolved_device,
+        embedding_storage,
+        require_embeddings,
+        shared_embeddings,
+        thumbnail_edge,
+    ) = load_args
+    # Only one process builds a given index; the others wait on the lock and then
+    # pick up the freshly written cache instead of repeating the embedding pass.
+    with _index_cache_lock(cache_path, lock_timeout):
+        cached = _load_cached_index(cache_path, *load_args)
+        if cached is None:
+            image_fingerprint = image_fingerprint or dataset_fingerprints(record)["images"]
+            built = _caption_only_update(
+                cache_path,
                 record,
                 fingerprint,
+                image_fingerprint,
                 embedding_model_path,
                 resolved_device,
+                embedding_batch_size,
+                embedding_storage,
+                thumbnail_edge,
             )
-            if cached is not None:
-                if require_embeddings and not cached.text_embeddings:
-                    raise EmbeddingModelUnavailable("[IAT] Dataset index has no embeddings; configure a local Chinese CLIP model.")
-                return cached
-        except EmbeddingModelUnavailable:
+            if built is not None:
+                try:
+                    _write_index_cache(built, cache_path, shared_embeddings)
+                except Exception as exc:
+                    built.warnings.append(f"Could not write index cache `{cache_path}`: {exc}")
+            else:
+                built = _build_dataset_index(
+                    record,
+                    fingerprint,
+                    cache_path,
+                    embedding_model_path,
+                    require_embeddings,
+                    resolved_device,
+                    embedding_batch_size,
+                    embedding_storage,
+                    shared_embeddings,
+                    image_fingerprint,
+                    thumbnail_edge,
+                )
+            if not _needs_shared_rewrite(built, shared_embeddings):
+                return built
+            # Attach to the file just written so this worker shares it too.
+            return _load_cached_index(cache_path, *load_args) or built
+        if not _needs_shared_rewrite(cached, shared_embeddings):
+            return cached
+        # A list-format cache from before sharing was enabled: convert it without re-embedding.
+        try:
+            _write_index_cache(cached, cache_path, shared_embeddings=True)
+        except Exception as exc:
+            cached.warnings.append(f"Could not write shared embedding file for `{cache_path}`: {exc}")
+            return cached
+        return _load_cached_index(cache_path, *load_args) or cached
+
+
+def _needs_shared_rewrite(index: DatasetIndex, shared_embeddings: bool) -> bool:
+    return bool(shared_embeddings and index.text_embeddings and not index.text_embeddings.shared)
+
+
+def _write_index_cache(index: DatasetIndex, cache_path: Path, shared_embeddings: bool = False) -> None:
+    embedding_blob = None
+    if shared_embeddings and index.text_embeddings:
+        embedding_blob = _write_embedding_blob(index, _embedding_blob_path(cache_path))
+    _atomic_write_text(cache_path, json.dumps(_serialize_index(index, embedding_blob), ensure_ascii=False))
+
+
+def _encoder_image_edge(model_path: str) -> int:
+    """Shortest edge the embedding processor resizes to, read from its preprocessor config."""
+    try:
+        config = json.loads((Path(model_path).expanduser() / "preprocessor_config.json").read_text(encoding="utf-8"))
+    except Exception:
+        return _DEFAULT_ENCODER_EDGE
+    edges: List[int] = []
+    for key in ("size", "crop_size"):
+        value = config.get(key)
+        if isinstance(value, dict):
+            edges.extend(int(item) for name, item in value.items() if name in {"shortest_edge", "height", "width"})
+        elif isinstance(value, (int, float)):
+            edges.append(int(value))
+    return max(edges) if edges else _DEFAULT_ENCODER_EDGE
+
+
+def _thumbnail_dir(cache_dir: Path, edge: int) -> Path:
+    return Path(cache_dir) / _THUMBNAIL_DIR_NAME / str(int(edge))
+
+
+def _decode_entry_image(source: Any, edge: int = 0) -> Any:
+    """EXIF-normalized RGB copy of a path or encoded bytes, downscaled so its shortest edge is ``edge`` when given."""
+    from io import BytesIO
+
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as image:
+        rgb = ImageOps.exif_transpose(image).convert("RGB")
+    shortest = min(rgb.size)
+    if edge > 0 and shortest > edge:
+        scale = edge / shortest
+        rgb = rgb.resize(
+            (max(1, round(rgb.width * scale)), max(1, round(rgb.height * scale))),
+            Image.Resampling.BICUBIC,
+        )
+    return rgb
+
+
+def _image_digest(record: DatasetRecord, path: Path, digests: Dict[str, str], known: Dict[str, str]) -> str:
+    """sha256 of an image file, reusing ``known`` digests whose stat key is unchanged.
+
+    The digest is recorded in ``digests`` under the file's current stat key.
+    """
+    reader = _record_reader(record)
+    stat_key = reader.stat_key(Path(path))
+    key = known.get(stat_key)
+    if not key:
+        digest = hashlib.sha256()
+        for chunk in reader.iter_chunks(Path(path)):
+            digest.update(chunk)
+        key = digest.hexdigest()
+    digests[stat_key] = key
+    return key
+
+
+def _cached_thumbnail(record: DatasetRecord, path: Path, key: str, thumbnail_dir: Path, edge: int) -> Any:
+    """Load the encoder-resolution thumbnail of image ``path``, creating it on first use.
+
+    Thumbnails are keyed by the sha256 ``key`` of the file content, so renamed or
+    copied images and later rebuilds read a few KB instead of decoding the
+    full-resolution file.
+    """
+    from PIL import Image
+
+    target = thumbnail_dir / key[:2] / f"{key}.png"
+    try:
+        with Image.open(target) as cached:
+            return cached.convert("RGB")
+    except Exception:
+        pass
+    data = record.read_file(path)
+    thumbnail = _decode_entry_image(data, edge)
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(prefix=f".{target.name}.", suffix=".tmp", dir=str(target.parent))
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                thumbnail.save(handle, format="PNG")
+            os.replace(temp_name, target)
+        except BaseException:
+            try:
+                os.unlink(temp_name)
+            except OSError:
+                pass
             raise
+    except OSError:
+        # The cache is an optimization; an unwritable cache dir only costs speed.
+        pass
+    return thumbnail
+
+
+def _unique_entry_images(
+    record: DatasetRecord,
+    thumbnail_dir: Optional[Path] = None,
+    edge: int = 0,
+    digest_path: Optional[Path] = None,
+) -> Tuple[List[Any], List[List[int]], Dict[str, Any]]:
+    """Decode every entry image once and keep one copy per distinct pixel content.
+
+    Returns the unique images, per-entry references into them, and dedup stats.
+    Multiview datasets often reuse one control image across many samples, so
+    hashing decoded pixels lets each distinct image be embedded only once.
+    With ``thumbnail_dir`` images come from the encoder-resolution thumbnail cache;
+    file digests are kept in ``digest_path`` keyed by stat, so unchanged files are
+    neither read nor hashed again.
+    """
+    images: List[Any] = []
+    image_refs: List[List[int]] = []
+    positions: Dict[str, int] = {}
+    references = 0
+    known: Dict[str, str] = {}
+    digests: Dict[str, str] = {}
+    if thumbnail_dir is not None and digest_path is not None:
+        try:
+            loaded = json.loads(digest_path.read_text(encoding="utf-8"))
+            known = {str(name): str(value) for name, value in (loaded.get("digests") or {}).items()}
         except Exception:
+            known = {}
+    for idx in range(len(record.entries)):
+        refs: List[int] = []
+        for image_path in record.image_paths_at(idx).values():
+            if thumbnail_dir is not None:
+                key = _image_digest(record, image_path, digests, known)
+                rgb = _cached_thumbnail(record, image_path, key, thumbnail_dir, edge)
+            else:
+                rgb = _decode_entry_image(record.read_file(image_path) if record.packed else Path(image_path))
+            digest = hashlib.sha256(f"{rgb.size}".encode("ascii"))
+            digest.update(rgb.tobytes())
+            key = digest.hexdigest()
+            if key not in positions:
+                positions[key] = len(images)
+                images.append(rgb)
+            refs.append(positions[key])
+            references += 1
+        image_refs.append(refs)
+    if thumbnail_dir is not None and digest_path is not None and digests != known:
+        try:
+            _atomic_write_text(digest_path, json.dumps({"edge": int(edge), "digests": digests}))
+        except OSError:
             pass
+    stats = {
+        "image_references": references,
+        "unique_images": len(images),
+        "dedup_ratio": round(1.0 - len(images) / references, 6) if references else 0.0,
+    }
+    return images, image_refs, stats
 
+
+def _build_dataset_index(
+    record: DatasetRecord,
+    fingerprint: str,
+    cache_path: Path,
+    embedding_model_path: str,
+    require_embeddings: bool,
+    resolved_device: str,
+    embedding_batch_size: int,
+    embedding_storage: str,
+    shared_embeddings: bool = False,
+    image_fingerprint: str = "",
+    thumbnail_edge: int = 0,
+) -> DatasetIndex:
     warnings: List[str] = []
     text_embeddings: List[Optional[List[float]]] = []
     image_embeddings: List[Optional[List[float]]] = []
     gray_embeddings: List[Optional[List[float]]] = []
+    image_dedup: Dict[str, Any] = {}
     if embedding_model_path:
         batch_size = max(1, int(embedding_batch_size))
         _load_embedding_model(embedding_model_path, resolved_device)
+        runtime_note = _EMBEDDING_RUNTIME_NOTES.get(str(Path(embedding_model_path).expanduser()))
+        if runtime_note:
+            warnings.append(runtime_note)
         text_embeddings = _encode_text_batch(
             embedding_model_path,
-            [entry.caption for entry in record.entries],
+            record.captions,
             resolved_device,
             batch_size,
         )
-        from PIL import Image
-
-        images: List[Any] = []
-        image_counts: List[int] = []
+        if thumbnail_edge:
+            images, image_refs, image_dedup = _unique_entry_images(
+                record, _thumbnail_dir(cache_path.parent, thumbnail_edge), thumbnail_edge, _thumbnail_digest_path(cache_path)
+            )
+        else:
+            images, image_refs, image_dedup = _unique_entry_images(record)
         image_embeddings = [None] * len(record.entries)
         gray_embeddings = [None] * len(record.entries)
-        for idx, entry in enumerate(record.entries):
-            entry_images = entry.grouped_image_paths()
-            if not entry_images:
-                image_counts.append(0)
-                continue
-            count = 0
-            for image_path in entry_images.values():
-                with Image.open(image_path) as image:
-                    images.append(image.convert("RGB").copy())
-                count += 1
-            image_counts.append(count)
         rgb_vectors = _encode_image_batch(embedding_model_path, images, resolved_device, batch_size, grayscale=False)
         gray_vectors = _encode_image_batch(embedding_model_path, images, resolved_device, batch_size, grayscale=True)
-        offset = 0
-        for idx, count in enumerate(image_counts):
-            if not count:
+        for idx, refs in enumerate(image_refs):
+            if not refs:
                 continue
-            image_embeddings[idx] = _mean_vector(rgb_vectors[offset : offset + count])
-            gray_embeddings[idx] = _mean_vector(gray_vectors[offset : offset + count])
-            offset += count
+            image_embeddings[idx] = _mean_vector([rgb_vectors[ref] for ref in refs])
+            gray_embeddings[idx] = _mean_vector([gray_vectors[ref] for ref in refs])
     else:
         warnings.append("Embedding model path is empty; using offline BM25 only.")
 
@@ -987,15 +2702,202 @@ def get_dataset_index(
         embedding_model_path=str(embedding_model_path or ""),
         embedding_device=resolved_device,
         warnings=warnings,
+        embedding_storage=embedding_storage,
+        image_dedup=image_dedup,
+        image_fingerprint=image_fingerprint,
+        thumbnail_edge=thumbnail_edge,
     )
+    if text_embeddings:
+        index.storage_report = _storage_reports(index, text_embeddings, image_embeddings, gray_embeddings)
     if require_embeddings and not text_embeddings:
         raise EmbeddingModelUnavailable("[IAT] Embedding model path is not configured; set datasets.embedding_model_path for hybrid retrieval.")
     try:
-        cache_path.write_text(json.dumps(_serialize_index(index), ensure_ascii=False), encoding="utf-8")
+        _write_index_cache(index, cache_path, shared_embeddings)
     except Exception as exc:
         index.warnings.append(f"Could not write index cache `{cache_path}`: {exc}")
     return index
 
 
+def _cache_manifest_path(cache_dir: Path) -> Path:
+    return Path(cache_dir) / _CACHE_MANIFEST_NAME
+
+
+def _read_cache_manifest(cache_dir: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        value = json.loads(_cache_manifest_path(cache_dir).read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    entries = value.get("entries") if isinstance(value, dict) else None
+    return {str(name): dict(entry) for name, entry in (entries or {}).items() if isinstance(entry, dict)}
+
+
+def _update_cache_manifest(cache_dir: Path, update: Any) -> None:
+    """Apply ``update(entries)`` to the manifest under its lock; best effort only."""
+    manifest_path = _cache_manifest_path(cache_dir)
+    try:
+        with _index_cache_lock(manifest_path, timeout=5.0):
+            entries = _read_cache_manifest(cache_dir)
+            update(entries)
+            _atomic_write_text(manifest_path, json.dumps({"version": 1, "entries": entries}, ensure_ascii=False))
+    except Exception:
+        pass
+
+
+def _touch_index_cache(cache_path: Path, record: DatasetRecord, fingerprint: str) -> None:
+    """Record that an index was used; writes are throttled to keep retrieval cheap."""
+    name = cache_path.name[: -len(".index.json")]
+    now = time.time()
+    entry = _read_cache_manifest(cache_path.parent).get(name) or {}
+    if entry.get("fingerprint") == fingerprint and now - float(entry.get("last_used") or 0.0) < _CACHE_TOUCH_INTERVAL_SECONDS:
+        return
+
+    def update(entries: Dict[str, Dict[str, Any]]) -> None:
+        entries[name] = {
+            "dataset_name": record.dataset_name,
+            "fingerprint": fingerprint,
+            "source_path": str(record.source_path),
+            "last_used": now,
+        }
+
+    _update_cache_manifest(cache_path.parent, update)
+
+
+def _cache_files(cache_dir: Path) -> Dict[str, List[Path]]:
+    groups: Dict[str, List[Path]] = {}
+    for path in Path(cache_dir).iterdir():
+        for suffix in (".index.json", ".embeddings.bin", ".thumbnails.json"):
+            if path.is_file() and path.name.endswith(suffix) and not path.name.startswith("."):
+                groups.setdefault(path.name[: -len(suffix)], []).append(path)
+    return groups
+
+
+def index_cache_stats(cache_dir: Path) -> Dict[str, Any]:
+    """Summarize index cache files, their fingerprints, sizes, and last use."""
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_dir():
+        return {"cache_dir": str(cache_dir), "total_bytes": 0, "entries": [], "thumbnails": {"files": 0, "bytes": 0}}
+    manifest = _read_cache_manifest(cache_dir)
+    entries = []
+    for name, paths in sorted(_cache_files(cache_dir).items()):
+        info = manifest.get(name) or {}
+        size = sum(path.stat().st_size for path in paths)
+        entries.append(
+            {
+                "name": name,
+                "dataset_name": info.get("dataset_name", ""),
+                "fingerprint": info.get("fingerprint", ""),
+                "last_used": info.get("last_used"),
+                "bytes": size,
+                "files": sorted(path.name for path in paths),
+            }
+        )
+    thumbnail_files = [path for path in (cache_dir / _THUMBNAIL_DIR_NAME).rglob("*.png") if path.is_file()]
+    thumbnails = {"files": len(thumbnail_files), "bytes": sum(path.stat().st_size for path in thumbnail_files)}
+    return {
+        "cache_dir": str(cache_dir),
+        "total_bytes": sum(entry["bytes"] for entry in entries),
+        "entries": entries,
+        "thumbnails": thumbnails,
+    }
+
+
+def collect_index_cache(
+    cache_dir: Path,
+    max_bytes: int = 0,
+    active_names: Optional[Iterable[str]] = None,
+    dry_run: bool = False,
+    keep: Iterable[str] = (),
+) -> Dict[str, Any]:
+    """Evict index caches for datasets that no longer exist, then least-recently-used
+    ones until the cache fits in ``max_bytes`` (0 disables the budget).
+
+    ``active_names`` are dataset names from discovery; caches for other names are
+    stale.  Entries named in ``keep`` (datasets in use) and entries locked by a
+    worker that is building them are skipped.  Thumbnails that no remaining
+    index references are removed once they are older than the temp-file age.
+    """
+    cache_dir = Path(cache_dir)
+    stats = index_cache_stats(cache_dir)
+    active = None if active_names is None else {_safe_name(name) for name in active_names}
+    kept = {_safe_name(name) for name in keep}
+    entries = sorted(stats["entries"], key=lambda entry: float(entry["last_used"] or 0.0))
+    total = stats["total_bytes"]
+    evicted: List[Dict[str, Any]] = []
+    for entry in entries:
+        stale = active is not None and entry["name"] not in active
+        over_budget = max_bytes > 0 and total > max_bytes
+        if (not stale and not over_budget) or entry["name"] in kept:
+            continue
+        if not dry_run:
+            try:
+                with _index_cache_lock(cache_dir / f"{entry['name']}.index.json", timeout=0.5):
+                    for file_name in entry["files"]:
+                        (cache_dir / file_name).unlink(missing_ok=True)
+            except (DatasetError, OSError):
+                continue
+        total -= entry["bytes"]
+        evicted.append({"name": entry["name"], "bytes": entry["bytes"], "reason": "stale" if stale else "over_budget"})
+    if not dry_run and cache_dir.is_dir():
+        evicted_names = {entry["name"] for entry in evicted}
+
+        def forget(manifest: Dict[str, Dict[str, Any]]) -> None:
+            for name in evicted_names:
+                manifest.pop(name, None)
+
+        if evicted_names:
+            _update_cache_manifest(cache_dir, forget)
+        # Temp files are only left behind by writers that crashed mid-write.
+        cutoff = time.time() - _CACHE_TEMP_MAX_AGE_SECONDS
+        for path in cache_dir.glob(".*.tmp"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+    thumbnails = _collect_thumbnails(cache_dir, dry_run)
+    return {
+        "cache_dir": str(cache_dir),
+        "dry_run": bool(dry_run),
+        "max_bytes": int(max_bytes),
+        "evicted": evicted,
+        "freed_bytes": sum(entry["bytes"] for entry in evicted),
+        "total_bytes": total,
+        "evicted_thumbnails": thumbnails,
+    }
+
+
+def _collect_thumbnails(cache_dir: Path, dry_run: bool) -> Dict[str, int]:
+    """Delete thumbnails that no ``*.thumbnails.json`` digest map references.
+
+    Recent files are kept because a running build writes its digest map only
+    after creating its thumbnails.
+    """
+    thumbnail_root = cache_dir / _THUMBNAIL_DIR_NAME
+    if not thumbnail_root.is_dir():
+        return {"files": 0, "bytes": 0}
+    referenced = set()
+    for digest_path in cache_dir.glob("*.thumbnails.json"):
+        try:
+            referenced.update(json.loads(digest_path.read_text(encoding="utf-8")).get("digests", {}).values())
+        except Exception:
+            # An unreadable map might still cover thumbnails in use; keep everything.
+            return {"files": 0, "bytes": 0}
+    cutoff = time.time() - _CACHE_TEMP_MAX_AGE_SECONDS
+    files = 0
+    freed = 0
+    for path in thumbnail_root.rglob("*.png"):
+        try:
+            stat = path.stat()
+            if path.stem in referenced or stat.st_mtime >= cutoff:
+                continue
+            if not dry_run:
+                path.unlink()
+        except OSError:
+            continue
+        files += 1
+        freed += stat.st_size
+    return {"files": files, "bytes": freed}
+
+
 def dataset_metadata(record: DatasetRecord) -> Dict[str, Any]:
     return dict(record.metadata)
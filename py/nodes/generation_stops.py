@@ -0,0 +1,130 @@
+"""Early-termination rules shared by local and remote generation.
+
+Local Transformers generation evaluates them after every decoded token through
+a ``StoppingCriteria``; remote backends receive the stop strings natively and
+the same rules trim the returned text, so every backend yields the same output.
+All rules look at the visible text, i.e. with thinking blocks removed.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+_THINKING_PATTERNS = (
+    re.compile(r"<think>[\s\S]*?(?:</think>|$)", re.IGNORECASE),
+    re.compile(r"<(?:analysis|reasoning)>[\s\S]*?(?:</(?:analysis|reasoning)>|$)", re.IGNORECASE),
+    re.compile(r"<\|(?:think|analysis|reasoning)\|>[\s\S]*?(?:<\|/?(?:think|analysis|reasoning)\|>|$)", re.IGNORECASE),
+)
+# Leading whitespace and an optional opening code fence before a JSON object.
+_JSON_PREFIX = re.compile(r"\s*(?:```[ \t]*[A-Za-z]*[ \t]*\n?\s*)?")
+# CJK terminators end a sentence immediately; ASCII ones only before whitespace,
+# so decimals and abbreviations still being decoded are not cut.
+_SENTENCE_END = re.compile(r"[。！？]+[”’」』）)]*|[.!?]+[\"')\]]*(?=\s)")
+
+
+def strip_thinking_content(text: str) -> str:
+    if not text:
+        return text
+    for pattern in _THINKING_PATTERNS:
+        text = pattern.sub("", text)
+    return text.strip()
+
+
+def normalize_stop_strings(stop_strings: Optional[Iterable[str]]) -> List[str]:
+    return [item for item in dict.fromkeys(stop_strings or ()) if isinstance(item, str) and item]
+
+
+def _json_object_end(text: str) -> int:
+    start = _JSON_PREFIX.match(text).end()
+    if start >= len(text) or text[start] != "{":
+        return -1
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return -1
+
+
+def _sentence_end(text: str, max_sentences: int) -> int:
+    for count, match in enumerate(_SENTENCE_END.finditer(text), start=1):
+        if count >= max_sentences:
+            return match.end()
+    return -1
+
+
+def stop_offset(
+    text: str,
+    *,
+    stop_strings: Optional[Iterable[str]] = None,
+    stop_on_json: bool = False,
+    max_sentences: int = 0,
+) -> int:
+    """Offset where visible ``text`` should end, or -1 while generation may continue.
+
+    A stop string ends the text before itself; ``stop_on_json`` ends it after
+    the closing brace of a leading JSON object; ``max_sentences`` after the
+    N-th sentence terminator. The earliest of the enabled rules wins.
+    """
+    offsets = [text.find(stop) for stop in normalize_stop_strings(stop_strings)]
+    if stop_on_json:
+        offsets.append(_json_object_end(text))
+    if max_sentences and max_sentences > 0:
+        offsets.append(_sentence_end(text, int(max_sentences)))
+    offsets = [offset for offset in offsets if offset >= 0]
+    return min(offsets) if offsets else -1
+
+
+def stop_rules(
+    stop_strings: Optional[Iterable[str]] = None,
+    stop_on_json: bool = False,
+    max_sentences: int = 0,
+) -> Dict[str, Any]:
+    """Normalize node inputs into the keyword arguments every stop helper accepts."""
+    return {
+        "stop_strings": normalize_stop_strings(stop_strings),
+        "stop_on_json": bool(stop_on_json),
+        "max_sentences": max(0, int(max_sentences or 0)),
+    }
+
+
+def has_stop_rules(
+    stop_strings: Optional[Iterable[str]] = None,
+    stop_on_json: bool = False,
+    max_sentences: int = 0,
+) -> bool:
+    return bool(normalize_stop_strings(stop_strings) or stop_on_json or (max_sentences and max_sentences > 0))
+
+
+def apply_stop_rules(
+    text: str,
+    *,
+    stop_strings: Optional[Iterable[str]] = None,
+    stop_on_json: bool = False,
+    max_sentences: int = 0,
+) -> str:
+    """Strip thinking content and trim ``text`` at the first stop rule that fires."""
+    visible = strip_thinking_content(text or "")
+    offset = stop_offset(
+        visible,
+        stop_strings=stop_strings,
+        stop_on_json=stop_on_json,
+        max_sentences=max_sentences,
+    )
+    return visible[:offset].strip() if offset >= 0 else visible
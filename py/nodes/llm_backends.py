@@ -17,6 +17,10 @@ from urllib import error, request
 
 from PIL import Image
 
+from .generation_stops import apply_stop_rules, has_stop_rules, normalize_stop_strings
+from .generation_stops import stop_rules as build_stop_rules
+from .response_cache import active_response_cache, response_cache_key
+
 class BackendError(RuntimeError):
     """A generation backend could not fulfill a request."""
 
@@ -127,6 +131,7 @@ def _generate_ollama(
     keep_alive: Any,
     think: bool,
     system_prompt: str = "",
+    stop_strings: Optional[List[str]] = None,
 ) -> str:
     if not model.strip():
         raise BackendError("[IAT] Ollama model name is empty.")
@@ -140,6 +145,9 @@ def _generate_ollama(
         "repeat_penalty": float(repetition_penalty),
         "seed": int(seed),
     }
+    stops = normalize_stop_strings(stop_strings)
+    if stops:
+        options["stop"] = stops
     messages = []
     if (system_prompt or "").strip():
         messages.append({"role": "system", "content": system_prompt.strip()})
@@ -173,6 +181,7 @@ def _generate_vllm(
     timeout: int,
     api_key: str,
     system_prompt: str = "",
+    stop_strings: Optional[List[str]] = None,
 ) -> str:
     if not model.strip():
         raise BackendError("[IAT] vLLM model name is empty.")
@@ -194,6 +203,9 @@ def _generate_vllm(
         "seed": int(seed),
         "repetition_penalty": float(repetition_penalty),
     }
+    stops = normalize_stop_strings(stop_strings)
+    if stops:
+        payload["stop"] = stops
     api_key_text = (api_key or "").strip()
     headers = {"Authorization": f"Bearer {api_key_text}"} if api_key_text else {}
     response_payload = _request_json(_normalize_vllm_url(base_url), payload, timeout, headers=headers)
@@ -203,9 +215,9 @@ def _generate_vllm(
     return text
 
 
-def generate_with_backend(
-    *,
+def _generate_remote(
     backend: str,
+    *,
     model: str,
     base_url: str,
     prompt: str,
@@ -216,18 +228,15 @@ def generate_with_backend(
     repetition_penalty: float,
     seed: int,
     timeout: int,
-    local_device: str = "cuda",
-    local_attention_backend: Optional[str] = None,
-    keep_local_model_loaded: bool = True,
-    ollama_keep_alive: Any = -1,
-    ollama_think: bool = False,
-    vllm_api_key: str = "",
-    system_prompt: str = "",
+    ollama_keep_alive: Any,
+    ollama_think: bool,
+    vllm_api_key: str,
+    system_prompt: str,
+    stop_rules: Dict[str, Any],
 ) -> str:
-    system_text = (system_prompt or "").strip()
-    normalized = (backend or "Local").strip()
-    if normalized == "Ollama":
-        return _generate_ollama(
+    # Servers honour stop strings natively; JSON/sentence rules trim the reply.
+    if backend == "Ollama":
+        text = _generate_ollama(
             model=model,
             base_url=base_url,
             prompt=prompt,
@@ -240,10 +249,11 @@ def generate_with_backend(
             timeout=timeout,
             keep_alive=ollama_keep_alive,
             think=ollama_think,
-            system_prompt=system_text,
+            system_prompt=system_prompt,
+            stop_strings=stop_rules["stop_strings"],
         )
-    if normalized == "vLLM":
-        return _generate_vllm(
+    elif backend == "vLLM":
+        text = _generate_vllm(
             model=model,
             base_url=base_url,
             prompt=prompt,
@@ -255,15 +265,92 @@ def generate_with_backend(
             seed=seed,
             timeout=timeout,
             api_key=vllm_api_key,
+            system_prompt=system_prompt,
+            stop_strings=stop_rules["stop_strings"],
+        )
+    else:
+        raise BackendError(f"[IAT] Unsupported generation backend: `{backend}`")
+    if not has_stop_rules(**stop_rules):
+        return text
+    trimmed = apply_stop_rules(text, **stop_rules)
+    if not trimmed:
+        raise BackendError(f"[IAT] {backend} returned an empty response.")
+    return trimmed
+
+
+def generate_with_backend(
+    *,
+    backend: str,
+    model: str,
+    base_url: str,
+    prompt: str,
+    images: Optional[List[Image.Image]],
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+    repetition_penalty: float,
+    seed: int,
+    timeout: int,
+    local_device: str = "cuda",
+    local_attention_backend: Optional[str] = None,
+    keep_local_model_loaded: bool = True,
+    ollama_keep_alive: Any = -1,
+    ollama_think: bool = False,
+    vllm_api_key: str = "",
+    system_prompt: str = "",
+    use_response_cache: bool = True,
+    stop_strings: Optional[List[str]] = None,
+    stop_on_json: bool = False,
+    max_sentences: int = 0,
+) -> str:
+    system_text = (system_prompt or "").strip()
+    normalized = (backend or "Local").strip()
+    stop_rules = build_stop_rules(stop_strings, stop_on_json, max_sentences)
+    if normalized in ("Ollama", "vLLM"):
+        cache = active_response_cache(temperature, use_response_cache)
+        generate = lambda: _generate_remote(
+            normalized,
+            model=model,
+            base_url=base_url,
+            prompt=prompt,
+            images=images,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            seed=seed,
+            timeout=timeout,
+            ollama_keep_alive=ollama_keep_alive,
+            ollama_think=ollama_think,
+            vllm_api_key=vllm_api_key,
+            system_prompt=system_text,
+            stop_rules=stop_rules,
+        )
+        if cache is None:
+            return generate()
+        key = response_cache_key(
+            backend=normalized,
+            model=model.strip(),
+            base_url=_normalize_ollama_url(base_url) if normalized == "Ollama" else _normalize_vllm_url(base_url),
+            think=bool(ollama_think) if normalized == "Ollama" else None,
             system_prompt=system_text,
+            prompt=prompt,
+            images=images,
+            max_tokens=int(max_tokens),
+            temperature=float(temperature),
+            top_p=float(top_p),
+            repetition_penalty=float(repetition_penalty),
+            seed=int(seed),
+            stop_rules=stop_rules,
         )
+        return cache.get_or_generate(key, generate)
 
     if normalized != "Local":
         raise BackendError(f"[IAT] Unsupported generation backend: `{backend}`")
     try:
         # Keep remote backends usable in lightweight environments where the
         # optional Local Transformers/Torch stack is not installed.
-        from .qwen35_runtime import generate_text, generate_vision_text, unload_all_models
+        from .qwen35_runtime import generate_text, generate_vision_text, unload_model
 
         if images:
             text = generate_vision_text(
@@ -278,6 +365,8 @@ def generate_with_backend(
                 top_p=top_p,
                 repetition_penalty=repetition_penalty,
                 seed=seed,
+                use_response_cache=use_response_cache,
+                **stop_rules,
             )
         else:
             text = generate_text(
@@ -293,11 +382,13 @@ def generate_with_backend(
                 top_p=top_p,
                 repetition_penalty=repetition_penalty,
                 seed=seed,
+                use_response_cache=use_response_cache,
+                **stop_rules,
             )
     except Exception as exc:
         raise BackendError(f"[IAT] Local Transformers generation failed: {exc}") from exc
     if not keep_local_model_loaded:
-        unload_all_models()
+        unload_model("vl" if images else "text")
     if not text.strip():
         raise BackendError("[IAT] Local Transformers returned an empty response.")
     return text.strip()
@@ -1,27 +1,47 @@
 from __future__ import annotations
 
+import asyncio
+import copy
 import hashlib
 import json
 import math
 import random
 import re
 import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 from PIL import Image
 
+try:
+    from aiohttp import web
+    from server import PromptServer
+except Exception:
+    web = None
+    PromptServer = None
+
 from .dataset_repository import (
     DatasetError,
     EmbeddingModelUnavailable,
     DatasetRecord,
     choose_caption,
+    collect_index_cache,
+    configure_embedding_acceleration,
     dataset_fingerprint,
+    dataset_fingerprints,
     dataset_metadata,
-    discover_datasets,
     get_dataset_index,
+    index_cache_stats,
+    list_dataset_headers,
+    load_dataset_record,
+    retrieve_federated,
 )
 from .llm_backends import BackendError, generate_with_backend
+from .response_cache import image_content_hash
 _CFG = getattr(sys.modules.get("comfyui_iat_config"), "data", {}) or {}
 _CFG_PATH = Path(getattr(sys.modules.get("comfyui_iat_config"), "path", Path(__file__).resolve().parents[2] / "config.yaml"))
 _MODEL_CFG = (_CFG.get("model") or {}) if isinstance(_CFG, dict) else {}
@@ -51,6 +71,23 @@ _EMBEDDING_MODEL_PATH = str(_DATASET_CFG.get("embedding_model_path") or "").stri
 _INDEX_CACHE_DIR = str(_DATASET_CFG.get("index_cache_dir") or "").strip()
 _EMBEDDING_DEVICE = str(_DATASET_CFG.get("embedding_device") or "cpu").strip()
 _EMBEDDING_BATCH_SIZE = int(_DATASET_CFG.get("embedding_batch_size") or 16)
+_EMBEDDING_STORAGE = str(_DATASET_CFG.get("embedding_storage") or "float32").strip().lower()
+_INDEX_LOCK_TIMEOUT_SECONDS = float(_DATASET_CFG.get("index_lock_timeout_seconds") or 3600)
+_SHARED_EMBEDDINGS = bool(_DATASET_CFG.get("shared_embeddings", False))
+_THUMBNAIL_CACHE = bool(_DATASET_CFG.get("thumbnail_cache", True))
+_EMBEDDING_PRECISION = str(_DATASET_CFG.get("embedding_precision") or "float32").strip().lower()
+_EMBEDDING_COMPILE = bool(_DATASET_CFG.get("embedding_compile", False))
+_EMBEDDING_NUM_THREADS = max(0, int(_DATASET_CFG.get("embedding_num_threads") or 0))
+_EMBEDDING_RUNTIME = str(_DATASET_CFG.get("embedding_runtime") or "torch").strip().lower()
+_INDEX_CACHE_MAX_BYTES = max(0, int(_DATASET_CFG.get("index_cache_max_bytes") or 0))
+_INDEX_CACHE_GC_INTERVAL_SECONDS = 600.0
+_INDEX_CACHE_LAST_GC = 0.0
+_DATASET_API_ROUTES_REGISTERED = False
+_EMBEDDING_ACCELERATION_APPLIED = False
+_RETRIEVAL_CACHE_SIZE = max(0, int(_DATASET_CFG.get("retrieval_cache_size", 64) or 0))
+_RETRIEVAL_CACHE: "OrderedDict[str, Tuple[List[Dict[str, Any]], Dict[str, Any]]]" = OrderedDict()
+_RETRIEVAL_CACHE_STATS = {"hits": 0, "misses": 0}
+_RETRIEVAL_CACHE_LOCK = threading.Lock()
 _DEFAULT_BACKEND = str(_LLM_CFG.get("default_backend") or "Ollama")
 if _DEFAULT_BACKEND not in _BACKEND_OPTIONS:
     _DEFAULT_BACKEND = "Ollama"
@@ -81,15 +118,22 @@ def _embedding_model_path() -> str:
     return str(_resolve_config_path(_EMBEDDING_MODEL_PATH, _CFG_PATH.parent / "models" / "embeddings"))
 
 
-def _discover() -> tuple[Dict[str, DatasetRecord], List[str]]:
-    return discover_datasets(_dataset_root())
+def _list_datasets() -> tuple[Dict[str, Dict[str, Any]], List[str]]:
+    # Only dataset.json headers are read here; entries load when a dataset executes.
+    return list_dataset_headers(_dataset_root())
 
 
 def _selected_record(dataset_name: str) -> DatasetRecord:
-    records, errors = _discover()
-    record = records.get(dataset_name)
-    if record is not None:
-        return record
+    headers, errors = _list_datasets()
+    header = headers.get(dataset_name)
+    if header is not None:
+        try:
+            record = load_dataset_record(header["path"])
+        except DatasetError as exc:
+            errors = errors + [str(exc)]
+        else:
+            if record.dataset_name == dataset_name:
+                return record
     details = f"\nDiscovery diagnostics:\n" + "\n".join(errors) if errors else ""
     raise DatasetError(
         f"[IAT] Dataset `{dataset_name}` was not found or is invalid under `{_dataset_root()}`.{details}"
@@ -103,9 +147,159 @@ def _dataset_change_token(dataset_name: str) -> str:
         return f"invalid:{dataset_name}:{exc}"
 
 
+def _retrieval_cache_key(
+    dataset_identity: Sequence[Any],
+    query: str,
+    reference_images: Sequence[Image.Image],
+    preserve_reference_color: bool,
+    top_k: int,
+    exploration_strength: str,
+    seed: int,
+) -> str:
+    """Key retrieval on dataset content fingerprints and settings, so a hit needs no index load."""
+    parts = {
+        "datasets": list(dataset_identity),
+        "embedding": [_embedding_model_path(), _EMBEDDING_STORAGE, _EMBEDDING_PRECISION, _EMBEDDING_RUNTIME],
+        "query": query,
+        "reference_images": [image_content_hash(image) for image in reference_images],
+        "preserve_reference_color": bool(preserve_reference_color),
+        "top_k": int(top_k),
+        "exploration_strength": str(exploration_strength),
+        "seed": int(seed),
+    }
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _cached_retrieval(
+    key: str,
+    retrieve: Callable[[], Tuple[List[Dict[str, Any]], Dict[str, Any]]],
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Return retrieval results for ``key``, computing and storing them on a miss.
+
+    Generation-only parameter changes re-run the node with identical retrieval
+    inputs, so results are reused.  Copies are returned because callers annotate
+    the debug payload.
+    """
+    if _RETRIEVAL_CACHE_SIZE <= 0:
+        return retrieve()
+    with _RETRIEVAL_CACHE_LOCK:
+        cached = _RETRIEVAL_CACHE.get(key)
+        if cached is not None:
+            _RETRIEVAL_CACHE.move_to_end(key)
+            _RETRIEVAL_CACHE_STATS["hits"] += 1
+        else:
+            _RETRIEVAL_CACHE_STATS["misses"] += 1
+    if cached is not None:
+        return copy.deepcopy(cached)
+    result = retrieve()
+    with _RETRIEVAL_CACHE_LOCK:
+        _RETRIEVAL_CACHE[key] = copy.deepcopy(result)
+        _RETRIEVAL_CACHE.move_to_end(key)
+        while len(_RETRIEVAL_CACHE) > _RETRIEVAL_CACHE_SIZE:
+            _RETRIEVAL_CACHE.popitem(last=False)
+    return result
+
+
+def retrieval_cache_info() -> Dict[str, int]:
+    with _RETRIEVAL_CACHE_LOCK:
+        return {"size": len(_RETRIEVAL_CACHE), "max_size": _RETRIEVAL_CACHE_SIZE, **_RETRIEVAL_CACHE_STATS}
+
+
+def _parse_additional_datasets(value: str, primary: str = "") -> List[tuple[str, float]]:
+    """Parse ``name:weight, name`` into ordered (name, weight) pairs; weight defaults to 1."""
+    parsed: Dict[str, float] = {}
+    for item in re.split(r"[,，\n]+", value or ""):
+        item = item.strip()
+        if not item:
+            continue
+        name, separator, weight_text = item.rpartition(":")
+        if not separator:
+            name, weight_text = item, "1"
+        name = name.strip()
+        try:
+            weight = float(weight_text)
+        except ValueError as exc:
+            raise DatasetError(f"[IAT] Invalid dataset weight in `{item}`; use `name:weight`.") from exc
+        if not name or not math.isfinite(weight) or weight < 0.0:
+            raise DatasetError(f"[IAT] Invalid additional dataset entry `{item}`; use `name:weight` with weight >= 0.")
+        if name != primary:
+            parsed[name] = weight
+    return list(parsed.items())
+
+
+def _enforce_index_cache_budget(keep: Sequence[str]) -> None:
+    """Trim the index cache to ``datasets.index_cache_max_bytes`` at most every few minutes."""
+    global _INDEX_CACHE_LAST_GC
+    if _INDEX_CACHE_MAX_BYTES <= 0 or time.time() - _INDEX_CACHE_LAST_GC < _INDEX_CACHE_GC_INTERVAL_SECONDS:
+        return
+    _INDEX_CACHE_LAST_GC = time.time()
+    try:
+        collect_index_cache(_index_cache_root(), max_bytes=_INDEX_CACHE_MAX_BYTES, keep=keep)
+    except Exception:
+        pass
+
+
+def _index_cache_report(collect: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+    cache_root = _index_cache_root()
+    report: Dict[str, Any] = {"max_bytes": _INDEX_CACHE_MAX_BYTES, **index_cache_stats(cache_root)}
+    if collect:
+        headers, _ = _list_datasets()
+        report["collection"] = collect_index_cache(
+            cache_root,
+            max_bytes=_INDEX_CACHE_MAX_BYTES,
+            active_names=headers.keys(),
+            dry_run=dry_run,
+        )
+        if not dry_run:
+            report.update(index_cache_stats(cache_root))
+    return report
+
+
+def _apply_embedding_acceleration() -> None:
+    """Push the configured embedding options to the repository once; a bad value raises on every run."""
+    global _EMBEDDING_ACCELERATION_APPLIED
+    if _EMBEDDING_ACCELERATION_APPLIED:
+        return
+    configure_embedding_acceleration(_EMBEDDING_PRECISION, _EMBEDDING_COMPILE, _EMBEDDING_NUM_THREADS, _EMBEDDING_RUNTIME)
+    _EMBEDDING_ACCELERATION_APPLIED = True
+
+
+def _register_dataset_api_routes():
+    global _DATASET_API_ROUTES_REGISTERED
+    if _DATASET_API_ROUTES_REGISTERED or web is None or PromptServer is None:
+        return
+
+    prompt_server = getattr(PromptServer, "instance", None)
+    if prompt_server is None:
+        return
+
+    @prompt_server.routes.get("/iat/datasets/index_cache")
+    async def iat_dataset_index_cache(request_obj):
+        try:
+            report = await asyncio.to_thread(_index_cache_report)
+        except Exception as exc:
+            return web.json_response({"ok": False, "error": str(exc)}, status=500)
+        return web.json_response({"ok": True, **report})
+
+    @prompt_server.routes.post("/iat/datasets/index_cache/gc")
+    async def iat_dataset_index_cache_gc(request_obj):
+        try:
+            body = await request_obj.json()
+        except Exception:
+            body = {}
+        try:
+            report = await asyncio.to_thread(_index_cache_report, True, bool((body or {}).get("dry_run", False)))
+        except Exception as exc:
+            return web.json_response({"ok": False, "error": str(exc)}, status=500)
+        return web.json_response({"ok": True, **report})
+
+    _DATASET_API_ROUTES_REGISTERED = True
+
+
 def _dataset_options() -> List[str]:
-    records, errors = _discover()
-    options = sorted(records.keys())
+    headers, errors = _list_datasets()
+    options = sorted(headers.keys())
     if not options:
         return ["__NO_DATASET_FOUND__"]
     return options
@@ -613,6 +807,7 @@ class DatasetCaptionPickerNode:
 class DatasetRAGPromptGeneratorNode:
     @classmethod
     def INPUT_TYPES(cls):
+        _register_dataset_api_routes()
         options = _dataset_options()
         return {
             "required": {
@@ -639,6 +834,9 @@ class DatasetRAGPromptGeneratorNode:
                 "image_2": ("IMAGE",),
                 "image_3": ("IMAGE",),
                 "image_4": ("IMAGE",),
+                # Optional so widget values of workflows saved before these inputs existed keep their slots.
+                "additional_datasets": ("STRING", {"default": ""}),
+                "bypass_response_cache": ("BOOLEAN", {"default": False}),
             },
         }
 
@@ -649,7 +847,14 @@ class DatasetRAGPromptGeneratorNode:
 
     @classmethod
     def IS_CHANGED(cls, dataset_name, **kwargs):
-        return _dataset_change_token(dataset_name)
+        token = _dataset_change_token(dataset_name)
+        try:
+            additional = _parse_additional_datasets(kwargs.get("additional_datasets") or "", dataset_name)
+        except DatasetError as exc:
+            return f"{token}|invalid:{exc}"
+        if not additional:
+            return token
+        return "|".join([token] + [f"{name}:{weight}:{_dataset_change_token(name)}" for name, weight in additional])
 
     def generate_prompt(
         self,
@@ -670,6 +875,8 @@ class DatasetRAGPromptGeneratorNode:
         timeout_seconds,
         exploration_strength="Medium",
         variation_seed=1,
+        additional_datasets="",
+        bypass_response_cache=False,
         image=None,
         image_2=None,
         image_3=None,
@@ -679,12 +886,22 @@ class DatasetRAGPromptGeneratorNode:
             raise RuntimeError("[IAT] user_prompt is required.")
 
         record = _selected_record(dataset_name)
+        additional = _parse_additional_datasets(additional_datasets, dataset_name)
+        additional_records = [(_selected_record(name), weight) for name, weight in additional]
 
         try:
             reference_images = _collect_reference_images(image, image_2, image_3, image_4)
-            record_fingerprint = dataset_fingerprint(record)
+            # Hashed once per request and handed to get_dataset_index on a retrieval miss.
+            fingerprints = {id(record): dataset_fingerprints(record)}
+            fingerprints.update((id(extra), dataset_fingerprints(extra)) for extra, _ in additional_records)
+            record_fingerprint = fingerprints[id(record)]["dataset"]
             prompt_text = (user_prompt or "").strip()
             dataset_identity = (record.dataset_name, record.version, record_fingerprint)
+            if additional_records:
+                dataset_identity += tuple(
+                    (extra.dataset_name, extra.version, weight, fingerprints[id(extra)]["dataset"])
+                    for extra, weight in additional_records
+                )
             effective_retrieval_seed = _derive_seed(
                 retrieval_seed,
                 "retrieval",
@@ -698,21 +915,65 @@ class DatasetRAGPromptGeneratorNode:
                 prompt_text,
             )
             effective_temperature = _effective_temperature(float(temperature), exploration_strength)
-            index = get_dataset_index(
-                record,
-                _index_cache_root(),
-                embedding_model_path=_embedding_model_path(),
-                require_embeddings=bool(_embedding_model_path()),
-                embedding_device=_EMBEDDING_DEVICE,
-                embedding_batch_size=_EMBEDDING_BATCH_SIZE,
-            )
-            retrieved, debug = index.retrieve(
-                (user_prompt or "").strip(),
-                reference_images=reference_images,
-                preserve_reference_color=bool(preserve_reference_color),
-                top_k=top_k,
-                seed=effective_retrieval_seed,
-                exploration_strength=exploration_strength,
+            sources = [(record, 1.0)] + additional_records
+
+            def retrieve() -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+                # Only reached on a retrieval-cache miss: loading indexes may embed the dataset.
+                _apply_embedding_acceleration()
+                indexes = [
+                    (
+                        get_dataset_index(
+                            source,
+                            _index_cache_root(),
+                            embedding_model_path=_embedding_model_path(),
+                            require_embeddings=bool(_embedding_model_path()),
+                            embedding_device=_EMBEDDING_DEVICE,
+                            embedding_batch_size=_EMBEDDING_BATCH_SIZE,
+                            embedding_storage=_EMBEDDING_STORAGE,
+                            lock_timeout=_INDEX_LOCK_TIMEOUT_SECONDS,
+                            shared_embeddings=_SHARED_EMBEDDINGS,
+                            thumbnail_cache=_THUMBNAIL_CACHE,
+                            fingerprints=fingerprints[id(source)],
+                        ),
+                        weight,
+                    )
+                    for source, weight in sources
+                ]
+                _enforce_index_cache_budget([index.record.dataset_name for index, _ in indexes])
+                retrieval_kwargs = {
+                    "reference_images": reference_images,
+                    "preserve_reference_color": bool(preserve_reference_color),
+                    "top_k": top_k,
+                    "seed": effective_retrieval_seed,
+                    "exploration_strength": exploration_strength,
+                }
+                if additional_records:
+                    return retrieve_federated(indexes, prompt_text, **retrieval_kwargs)
+                return indexes[0][0].retrieve(prompt_text, **retrieval_kwargs)
+
+            if additional_records:
+                # Generation must honour the trigger words of every dataset it drew from.
+                record = replace(
+                    record,
+                    trigger_words=list(
+                        dict.fromkeys(
+                            word
+                            for source in [record] + [extra for extra, _ in additional_records]
+                            for word in source.trigger_words
+                        )
+                    ),
+                )
+            retrieved, debug = _cached_retrieval(
+                _retrieval_cache_key(
+                    dataset_identity,
+                    prompt_text,
+                    reference_images,
+                    bool(preserve_reference_color),
+                    top_k,
+                    exploration_strength,
+                    effective_retrieval_seed,
+                ),
+                retrieve,
             )
             variation_plan = _build_variation_plan(
                 prompt_text,
@@ -773,6 +1034,9 @@ class DatasetRAGPromptGeneratorNode:
                 ollama_think=bool(_OLLAMA_CFG.get("think", False)),
                 vllm_api_key=str(_VLLM_CFG.get("api_key") or ""),
                 system_prompt=generation_system_prompt,
+                use_response_cache=not bypass_response_cache,
+                # A JSON-wrapped answer is complete once its object closes.
+                stop_on_json=True,
             )
             if not (output or "").strip():
                 raise BackendError("[IAT] Generation backend returned an empty prompt.")
@@ -780,11 +1044,17 @@ class DatasetRAGPromptGeneratorNode:
             final_prompt = _ensure_trigger_words(final_prompt, record)
             if not final_prompt:
                 raise BackendError("[IAT] Generation backend returned an empty prompt.")
+            metadata = dataset_metadata(record)
+            if additional_records:
+                metadata["additional_datasets"] = [
+                    {"dataset_name": extra.dataset_name, "weight": weight, "metadata": dataset_metadata(extra)}
+                    for extra, weight in additional_records
+                ]
             return (
                 final_prompt,
                 json.dumps(retrieved, ensure_ascii=False),
                 json.dumps(debug, ensure_ascii=False),
-                json.dumps(dataset_metadata(record), ensure_ascii=False),
+                json.dumps(metadata, ensure_ascii=False),
             )
         except (DatasetError, EmbeddingModelUnavailable, BackendError) as exc:
             raise RuntimeError(str(exc)) from exc
@@ -792,6 +1062,9 @@ class DatasetRAGPromptGeneratorNode:
             raise RuntimeError(f"[IAT] Dataset RAG failed: {exc}") from exc
 
 
+_register_dataset_api_routes()
+
+
 NODE_CLASS_MAPPINGS = {
     "DatasetCaptionPicker by IAT": DatasetCaptionPickerNode,
     "DatasetRAGPromptGenerator by IAT": DatasetRAGPromptGeneratorNode,
@@ -18,7 +18,7 @@ except Exception:
     web = None
     PromptServer = None
 
-from .qwen35_runtime import (
+from .qwen35_options import (
     ATTENTION_OPTIONS,
     DEFAULT_ATTENTION_BACKEND,
     DEVICE_OPTIONS,
@@ -28,11 +28,34 @@ from .qwen35_runtime import (
     VL_MODEL_CANDIDATES,
     VL_MODEL_LABEL_TO_VARIANT,
     VL_MODEL_OPTIONS_GROUPED,
-    generate_text,
-    generate_vision_text,
-    unload_all_models,
 )
 
+
+# qwen35_runtime pulls in torch/transformers/modelscope; import it on first
+# execution so registering these nodes at ComfyUI startup stays cheap.
+def generate_text(**kwargs):
+    from .qwen35_runtime import generate_text as _generate_text
+
+    return _generate_text(**kwargs)
+
+
+def generate_vision_text(**kwargs):
+    from .qwen35_runtime import generate_vision_text as _generate_vision_text
+
+    return _generate_vision_text(**kwargs)
+
+
+def unload_model(kind):
+    from .qwen35_runtime import unload_model as _unload_model
+
+    return _unload_model(kind)
+
+
+def preload_model(**kwargs):
+    from .qwen35_runtime import preload as _preload
+
+    return _preload(**kwargs)
+
 _CFG = getattr(sys.modules.get("comfyui_iat_config"), "data", {}) or {}
 _CFG_PATH = getattr(sys.modules.get("comfyui_iat_config"), "path", "config.yaml")
 _MODEL_CFG = (_CFG.get("model") or {}) if isinstance(_CFG, dict) else {}
@@ -866,7 +889,10 @@ class Qwen35PromptEnhancerNode:
                 "repetition_penalty": ("FLOAT", {"default": 1.1, "min": 0.5, "max": 2.0}),
                 "keep_model_loaded": ("BOOLEAN", {"default": True}),
                 "seed": ("INT", {"default": 1, "min": 1, "max": 2**32 - 1}),
-            }
+            },
+            "optional": {
+                "bypass_response_cache": ("BOOLEAN", {"default": False}),
+            },
         }
 
     RETURN_TYPES = ("STRING",)
@@ -888,6 +914,7 @@ class Qwen35PromptEnhancerNode:
         repetition_penalty,
         keep_model_loaded,
         seed,
+        bypass_response_cache=False,
     ):
         model_variant = _to_text_variant(model_variant)
         system_prompt = (custom_system_prompt or "").strip() or PROMPT_STYLES.get(enhancement_style, PROMPT_STYLES["Enhance"])
@@ -906,10 +933,11 @@ class Qwen35PromptEnhancerNode:
             top_p=top_p,
             repetition_penalty=repetition_penalty,
             seed=seed,
+            use_response_cache=not bypass_response_cache,
         )
 
         if not keep_model_loaded:
-            unload_all_models()
+            unload_model("text")
         return (text,)
 
 
@@ -940,6 +968,9 @@ class Qwen35ReversePromptNode:
                 "image_2": ("IMAGE",),
                 "image_3": ("IMAGE",),
                 "image_4": ("IMAGE",),
+                "bypass_response_cache": ("BOOLEAN", {"default": False}),
+                # 0 = 使用 runtime.vision_max_pixels；限制视觉 token 数以稳定预填充耗时
+                "max_pixels": ("INT", {"default": 0, "min": 0, "max": 16777216, "step": 3136}),
             },
         }
 
@@ -961,6 +992,8 @@ class Qwen35ReversePromptNode:
         repetition_penalty,
         keep_model_loaded,
         seed,
+        bypass_response_cache=False,
+        max_pixels=0,
         image=None,
         image_2=None,
         image_3=None,
@@ -984,10 +1017,12 @@ class Qwen35ReversePromptNode:
             top_p=top_p,
             repetition_penalty=repetition_penalty,
             seed=seed,
+            use_response_cache=not bypass_response_cache,
+            max_pixels=int(max_pixels) or None,
         )
 
         if not keep_model_loaded:
-            unload_all_models()
+            unload_model("vl")
         return (text,)
 
 
@@ -1162,7 +1197,10 @@ class QwenTranslatorNode:
                 "temperature": ("FLOAT", {"default": 0.1, "min": 0.0, "max": 1.5}),
                 "keep_model_loaded": ("BOOLEAN", {"default": True}),
                 "seed": ("INT", {"default": 1, "min": 1, "max": 2**32 - 1}),
-            }
+            },
+            "optional": {
+                "bypass_response_cache": ("BOOLEAN", {"default": False}),
+            },
         }
 
     RETURN_TYPES = ("STRING",)
@@ -1170,7 +1208,19 @@ class QwenTranslatorNode:
     FUNCTION = "translate"
     CATEGORY = "IAT/Qwen3.5"
 
-    def translate(self, text, target_language, model_variant, device, attention_backend, max_tokens, temperature, keep_model_loaded, seed):
+    def translate(
+        self,
+        text,
+        target_language,
+        model_variant,
+        device,
+        attention_backend,
+        max_tokens,
+        temperature,
+        keep_model_loaded,
+        seed,
+        bypass_response_cache=False,
+    ):
         model_variant = _to_text_variant(model_variant)
         src = (text or "").strip()
         if not src:
@@ -1198,10 +1248,11 @@ class QwenTranslatorNode:
             top_p=1.0,
             repetition_penalty=1.0,
             seed=seed,
+            use_response_cache=not bypass_response_cache,
         )
 
         if not keep_model_loaded:
-            unload_all_models()
+            unload_model("text")
         return (response.strip(),)
 
 
@@ -1223,7 +1274,10 @@ class QwenKontextTranslatorNode:
                 "temperature": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 1.5}),
                 "keep_model_loaded": ("BOOLEAN", {"default": True}),
                 "seed": ("INT", {"default": 1, "min": 1, "max": 2**32 - 1}),
-            }
+            },
+            "optional": {
+                "bypass_response_cache": ("BOOLEAN", {"default": False}),
+            },
         }
 
     RETURN_TYPES = ("STRING",)
@@ -1231,7 +1285,18 @@ class QwenKontextTranslatorNode:
     FUNCTION = "optimize_prompt"
     CATEGORY = "IAT/Qwen3.5"
 
-    def optimize_prompt(self, text, model_variant, device, attention_backend, max_tokens, temperature, keep_model_loaded, seed):
+    def optimize_prompt(
+        self,
+        text,
+        model_variant,
+        device,
+        attention_backend,
+        max_tokens,
+        temperature,
+        keep_model_loaded,
+        seed,
+        bypass_response_cache=False,
+    ):
         model_variant = _to_text_variant(model_variant)
         src = (text or "").strip()
         if not src:
@@ -1250,6 +1315,7 @@ class QwenKontextTranslatorNode:
             top_p=0.9,
             repetition_penalty=1.05,
             seed=seed,
+            use_response_cache=not bypass_response_cache,
         )
 
         if "```" in response:
@@ -1257,10 +1323,50 @@ class QwenKontextTranslatorNode:
             response = parts[1] if len(parts) > 1 else parts[0]
 
         if not keep_model_loaded:
-            unload_all_models()
+            unload_model("text")
         return (response.strip(),)
 
 
+class QwenPreloadModelNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        default_variant = _DEFAULT_VARIANT if _DEFAULT_VARIANT in TEXT_MODEL_CANDIDATES else list(TEXT_MODEL_CANDIDATES.keys())[0]
+        default_variant_label = next((k for k, v in TEXT_MODEL_LABEL_TO_VARIANT.items() if v == default_variant), TEXT_MODEL_OPTIONS_GROUPED[0])
+        default_device = _DEFAULT_DEVICE if _DEFAULT_DEVICE in DEVICE_OPTIONS else "cuda"
+        default_attention_backend = DEFAULT_ATTENTION_BACKEND if DEFAULT_ATTENTION_BACKEND in ATTENTION_OPTIONS else "SDPA"
+
+        return {
+            "required": {
+                "model_variant": (TEXT_MODEL_OPTIONS_GROUPED, {"default": default_variant_label}),
+                "mode": (["text", "vl"], {"default": "text"}),
+                "device": (DEVICE_OPTIONS, {"default": default_device}),
+                "attention_backend": (ATTENTION_OPTIONS, {"default": default_attention_backend}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("model_variant",)
+    FUNCTION = "preload"
+    OUTPUT_NODE = True
+    CATEGORY = "IAT/Qwen3.5"
+    DESCRIPTION = (
+        "Start loading a local Qwen model in the background; later Qwen nodes with the same settings reuse it. "
+        "One text and one vision model stay cached: a node using another variant, device or attention backend "
+        "of the same mode replaces the preloaded model, and keep_model_loaded off unloads that mode's model "
+        "after the node runs."
+    )
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # 模型可能已被其他节点卸载：每次排队都重新发出预加载提示，已缓存时为空操作
+        return float("nan")
+
+    def preload(self, model_variant, mode, device, attention_backend):
+        model_variant = _to_vl_variant(model_variant) if mode == "vl" else _to_text_variant(model_variant)
+        preload_model(variant=model_variant, mode=mode, device=device, attention_backend=attention_backend)
+        return (model_variant,)
+
+
 _register_gpt_api_routes()
 
 
@@ -1270,6 +1376,7 @@ NODE_CLASS_MAPPINGS = {
     "GPTReversePrompt by IAT": GPTReversePromptNode,
     "QwenTranslator by IAT": QwenTranslatorNode,
     "QwenKontextTranslator by IAT": QwenKontextTranslatorNode,
+    "QwenPreloadModel by IAT": QwenPreloadModelNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -1278,4 +1385,5 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "GPTReversePrompt by IAT": "Vision API 反推提示词（IAT）",
     "QwenTranslator by IAT": "Qwen 翻译器（IAT）",
     "QwenKontextTranslator by IAT": "Qwen 编辑提示词优化（IAT）",
+    "QwenPreloadModel by IAT": "Qwen 模型预加载（IAT）",
 }
@@ -0,0 +1,124 @@
+"""Qwen3.5 model, device, and attention option constants.
+
+Kept free of torch/transformers imports so node modules can build their
+``INPUT_TYPES`` at ComfyUI startup without loading the inference stack;
+``qwen35_runtime`` re-exports everything defined here.
+"""
+
+from __future__ import annotations
+
+import re
+import sys
+from typing import Dict, List, Optional
+
+_CFG = getattr(sys.modules.get("comfyui_iat_config"), "data", {}) or {}
+_RUNTIME_CFG = (_CFG.get("runtime") or {}) if isinstance(_CFG, dict) else {}
+
+# 模型映射说明：
+# 1) 仅保留 Qwen 官方原版仓库。
+# 2) 不提供量化/GGUF 变体选项。
+_BASE_MODEL_REPOS: Dict[str, str] = {
+    "Qwen3.5-0.8B": "Qwen/Qwen3.5-0.8B",
+    "Qwen3.5-2B": "Qwen/Qwen3.5-2B",
+    "Qwen3.5-4B": "Qwen/Qwen3.5-4B",
+    "Qwen3.5-9B": "Qwen/Qwen3.5-9B",
+    "Qwen3.5-27B": "Qwen/Qwen3.5-27B",
+    "Qwen3.6-35B-A3B": "Qwen/Qwen3.6-35B-A3B",
+}
+
+def _build_text_model_candidates() -> Dict[str, List[str]]:
+    result: Dict[str, List[str]] = {}
+    for model_name, official_repo in _BASE_MODEL_REPOS.items():
+        # 仅保留官方原版模型选项
+        result[model_name] = [official_repo]
+    return result
+
+
+def _build_vl_model_candidates() -> Dict[str, List[str]]:
+    result: Dict[str, List[str]] = {}
+    for model_name, official_repo in _BASE_MODEL_REPOS.items():
+        # 仅保留官方原版模型选项
+        result[model_name] = [official_repo]
+    return result
+
+
+TEXT_MODEL_CANDIDATES: Dict[str, List[str]] = _build_text_model_candidates()
+VL_MODEL_CANDIDATES: Dict[str, List[str]] = _build_vl_model_candidates()
+
+
+def _grouped_options(model_map: Dict[str, List[str]]):
+    grouped_labels: List[str] = []
+    label_to_variant: Dict[str, str] = {}
+
+    def _variant_size_key(variant: str):
+        m = re.search(r"(\d+(?:\.\d+)?)B", variant or "")
+        if not m:
+            return float("inf")
+        try:
+            return float(m.group(1))
+        except ValueError:
+            return float("inf")
+
+    # 仅保留原始模型名展示，并按参数规模从小到大排序。
+    variants = sorted(model_map.keys(), key=lambda x: (_variant_size_key(x), x))
+    for variant in variants:
+        grouped_labels.append(variant)
+        label_to_variant[variant] = variant
+    return grouped_labels, label_to_variant
+
+
+TEXT_MODEL_OPTIONS_GROUPED, TEXT_MODEL_LABEL_TO_VARIANT = _grouped_options(TEXT_MODEL_CANDIDATES)
+VL_MODEL_OPTIONS_GROUPED, VL_MODEL_LABEL_TO_VARIANT = _grouped_options(VL_MODEL_CANDIDATES)
+
+
+def resolve_model_variant(selection: str, mode: str = "text") -> str:
+    """将分组展示标签解析为真实模型variant。"""
+    if mode == "vl":
+        mapping = VL_MODEL_LABEL_TO_VARIANT
+        candidates = VL_MODEL_CANDIDATES
+    else:
+        mapping = TEXT_MODEL_LABEL_TO_VARIANT
+        candidates = TEXT_MODEL_CANDIDATES
+    return mapping.get(selection, selection if selection in candidates else selection)
+
+
+DEVICE_OPTIONS = ["cuda", "cpu"]
+ATTENTION_OPTIONS = [
+    "SDPA",
+    "FlashAttention-2",
+    "Eager",
+]
+_ATTENTION_BACKEND_TO_IMPL = {
+    "SDPA": "sdpa",
+    "FlashAttention-2": "flash_attention_2",
+    "Eager": "eager",
+}
+_ATTENTION_BACKEND_ALIASES = {
+    "auto": "SDPA",
+    "sdpa": "SDPA",
+    "flash": "FlashAttention-2",
+    "flash_attention_2": "FlashAttention-2",
+    "flash attention 2": "FlashAttention-2",
+    "flash_attention_3": "FlashAttention-2",
+    "flash attention 3": "FlashAttention-2",
+    "flash_attention_4": "FlashAttention-2",
+    "flash attention 4": "FlashAttention-2",
+    "flex_attention": "SDPA",
+    "flex attention": "SDPA",
+    "eager": "Eager",
+    "default": "SDPA",
+    "transformers default": "SDPA",
+}
+
+
+def _normalize_attention_backend(attention_backend: Optional[str]) -> str:
+    if attention_backend in ATTENTION_OPTIONS:
+        return attention_backend
+    alias = _ATTENTION_BACKEND_ALIASES.get(str(attention_backend or "").strip().lower())
+    if alias in ATTENTION_OPTIONS:
+        return alias
+    return DEFAULT_ATTENTION_BACKEND
+
+
+DEFAULT_ATTENTION_BACKEND = "SDPA"
+DEFAULT_ATTENTION_BACKEND = _normalize_attention_backend(_RUNTIME_CFG.get("default_attention_backend", "SDPA"))
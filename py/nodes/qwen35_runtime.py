@@ -2,20 +2,27 @@ from __future__ import annotations
 
 import gc
 import importlib.util
+import inspect
 import json
+import math
 import os
 import re
 import sys
+import threading
 import time
 import uuid
-from contextlib import contextmanager
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import torch
 import transformers
 from packaging import version
-from transformers import AutoModelForCausalLM, AutoProcessor, AutoTokenizer
+from PIL import Image
+from transformers import AutoModelForCausalLM, AutoProcessor, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+from transformers.modeling_outputs import BaseModelOutputWithPooling
 try:
     from transformers.utils import is_flash_attn_2_available
 except Exception:
@@ -45,6 +52,11 @@ try:
 except Exception:
     fcntl = None
 
+try:
+    import resource
+except Exception:
+    resource = None
+
 import folder_paths
 
 try:
@@ -52,112 +64,48 @@ try:
 except Exception:
     model_management = None
 
+# 选项常量放在轻量模块中，节点注册时无需导入 torch/transformers。
+from .qwen35_options import (
+    _ATTENTION_BACKEND_TO_IMPL,
+    ATTENTION_OPTIONS,
+    DEFAULT_ATTENTION_BACKEND,
+    DEVICE_OPTIONS,
+    TEXT_MODEL_CANDIDATES,
+    TEXT_MODEL_LABEL_TO_VARIANT,
+    TEXT_MODEL_OPTIONS_GROUPED,
+    VL_MODEL_CANDIDATES,
+    VL_MODEL_LABEL_TO_VARIANT,
+    VL_MODEL_OPTIONS_GROUPED,
+    _normalize_attention_backend,
+    resolve_model_variant,
+)
+from .generation_stops import apply_stop_rules, has_stop_rules, stop_offset
+from .generation_stops import stop_rules as build_stop_rules
+from .generation_stops import strip_thinking_content as _strip_thinking_content
+from .response_cache import active_response_cache, image_content_hash, response_cache_key
+
 _CFG = getattr(sys.modules.get("comfyui_iat_config"), "data", {}) or {}
 _RUNTIME_CFG = (_CFG.get("runtime") or {}) if isinstance(_CFG, dict) else {}
 _LOGGING_CFG = (_CFG.get("logging") or {}) if isinstance(_CFG, dict) else {}
 
 MIN_TRANSFORMERS_FOR_QWEN35 = "5.2.0"
 QWEN35_MODEL_TYPE = "qwen3_5"
-# 模型映射说明：
-# 1) 仅保留 Qwen 官方原版仓库。
-# 2) 不提供量化/GGUF 变体选项。
-_BASE_MODEL_REPOS: Dict[str, str] = {
-    "Qwen3.5-0.8B": "Qwen/Qwen3.5-0.8B",
-    "Qwen3.5-2B": "Qwen/Qwen3.5-2B",
-    "Qwen3.5-4B": "Qwen/Qwen3.5-4B",
-    "Qwen3.5-9B": "Qwen/Qwen3.5-9B",
-    "Qwen3.5-27B": "Qwen/Qwen3.5-27B",
-    "Qwen3.6-35B-A3B": "Qwen/Qwen3.6-35B-A3B",
-}
-
-def _build_text_model_candidates() -> Dict[str, List[str]]:
-    result: Dict[str, List[str]] = {}
-    for model_name, official_repo in _BASE_MODEL_REPOS.items():
-        # 仅保留官方原版模型选项
-        result[model_name] = [official_repo]
-    return result
-
-
-def _build_vl_model_candidates() -> Dict[str, List[str]]:
-    result: Dict[str, List[str]] = {}
-    for model_name, official_repo in _BASE_MODEL_REPOS.items():
-        # 仅保留官方原版模型选项
-        result[model_name] = [official_repo]
-    return result
-
-
-TEXT_MODEL_CANDIDATES: Dict[str, List[str]] = _build_text_model_candidates()
-VL_MODEL_CANDIDATES: Dict[str, List[str]] = _build_vl_model_candidates()
-
-
-def _grouped_options(model_map: Dict[str, List[str]]):
-    grouped_labels: List[str] = []
-    label_to_variant: Dict[str, str] = {}
-
-    def _variant_size_key(variant: str):
-        m = re.search(r"(\d+(?:\.\d+)?)B", variant or "")
-        if not m:
-            return float("inf")
-        try:
-            return float(m.group(1))
-        except ValueError:
-            return float("inf")
-
-    # 仅保留原始模型名展示，并按参数规模从小到大排序。
-    variants = sorted(model_map.keys(), key=lambda x: (_variant_size_key(x), x))
-    for variant in variants:
-        grouped_labels.append(variant)
-        label_to_variant[variant] = variant
-    return grouped_labels, label_to_variant
-
-
-TEXT_MODEL_OPTIONS_GROUPED, TEXT_MODEL_LABEL_TO_VARIANT = _grouped_options(TEXT_MODEL_CANDIDATES)
-VL_MODEL_OPTIONS_GROUPED, VL_MODEL_LABEL_TO_VARIANT = _grouped_options(VL_MODEL_CANDIDATES)
-
-
-def resolve_model_variant(selection: str, mode: str = "text") -> str:
-    """将分组展示标签解析为真实模型variant。"""
-    if mode == "vl":
-        mapping = VL_MODEL_LABEL_TO_VARIANT
-        candidates = VL_MODEL_CANDIDATES
-    else:
-        mapping = TEXT_MODEL_LABEL_TO_VARIANT
-        candidates = TEXT_MODEL_CANDIDATES
-    return mapping.get(selection, selection if selection in candidates else selection)
-DEVICE_OPTIONS = ["cuda", "cpu"]
-ATTENTION_OPTIONS = [
-    "SDPA",
-    "FlashAttention-2",
-    "Eager",
-]
-_ATTENTION_BACKEND_TO_IMPL = {
-    "SDPA": "sdpa",
-    "FlashAttention-2": "flash_attention_2",
-    "Eager": "eager",
-}
-_ATTENTION_BACKEND_ALIASES = {
-    "auto": "SDPA",
-    "sdpa": "SDPA",
-    "flash": "FlashAttention-2",
-    "flash_attention_2": "FlashAttention-2",
-    "flash attention 2": "FlashAttention-2",
-    "flash_attention_3": "FlashAttention-2",
-    "flash attention 3": "FlashAttention-2",
-    "flash_attention_4": "FlashAttention-2",
-    "flash attention 4": "FlashAttention-2",
-    "flex_attention": "SDPA",
-    "flex attention": "SDPA",
-    "eager": "Eager",
-    "default": "SDPA",
-    "transformers default": "SDPA",
-}
-
 # 模型缓存 - 避免重复加载
 _MODEL_CACHE = {
     "text": {"signature": None, "model": None, "tokenizer": None},
     "vl": {"signature": None, "model": None, "tokenizer": None, "processor": None},
+    "draft": {"signature": None, "model": None},
 }
 
+# 每类模型一把加载锁：后台预加载与节点内的 load_*_model 串行，后到者等待并命中缓存
+_MODEL_LOAD_LOCKS = {"text": threading.Lock(), "vl": threading.Lock()}
+_PRELOAD_THREADS: Dict[Tuple[str, str], threading.Thread] = {}
+_PRELOAD_LOCK = threading.Lock()
+_PRELOAD_THREAD_PREFIX = "iat-preload-"
+
+# (variant, mode) -> (model_dir, stat 签名)：ensure_model 的进程内解析缓存
+_RESOLVED_MODEL_DIRS: Dict[Tuple[str, str], Tuple[Path, Optional[Tuple[Any, ...]]]] = {}
+
 # 性能优化配置
 _ATTN_IMPLEMENTATION = None  # 自动检测最佳注意力实现
 _ATTN_IMPLEMENTATION_RESOLVED = False
@@ -184,11 +132,50 @@ def _cfg_logging_bool(name: str, default: bool) -> bool:
 PREFER_OPTIMIZED_ATTENTION = _cfg_bool("prefer_optimized_attention", True)
 ENABLE_TORCH_COMPILE = _cfg_bool("enable_torch_compile", False)
 OFFLINE_ONLY = _cfg_bool("offline_only", False)
-DEFAULT_ATTENTION_BACKEND = "SDPA"
 VERBOSE_LOGGING = _cfg_logging_bool("verbose", False)
 DOWNLOAD_RETRY_TIMES = 2
 DOWNLOAD_RETRY_DELAY_SECONDS = 1.0
 DOWNLOAD_LOCK_TIMEOUT_SECONDS = 300
+# 推测解码：小草稿模型（与目标模型共用 tokenizer）先提议 token，再由目标模型一次性校验。
+DRAFT_MODEL_VARIANT = str(_RUNTIME_CFG.get("draft_model_variant") or "").strip()
+DRAFT_NUM_TOKENS = max(0, int(_RUNTIME_CFG.get("draft_num_tokens") or 0))
+
+# CPU 模式：线程数/亲和性、bf16 autocast、Linear 层 int8 动态量化。
+_CPU_MODE = {
+    "threads": max(0, int(_RUNTIME_CFG.get("cpu_threads") or 0)),
+    "affinity": str(_RUNTIME_CFG.get("cpu_affinity") or "").strip(),
+    "bf16_autocast": _cfg_bool("cpu_bf16_autocast", False),
+    "quantize_int8": _cfg_bool("cpu_quantize_int8", False),
+}
+_CPU_THREADS_APPLIED: Optional[int] = None
+
+# 视觉输入像素预算：送入 processor 前按面积缩放，约束视觉 token 数（0 = 不限制，默认关闭，保持原有输出）。
+VISION_MAX_PIXELS = max(0, int(_RUNTIME_CFG.get("vision_max_pixels", 0) or 0))
+VISION_MIN_PIXELS = max(0, int(_RUNTIME_CFG.get("vision_min_pixels", 3136) or 0))
+_VISION_INPUT_STATS: Dict[str, Optional[dict]] = {"last": None}
+# 视觉编码缓存：(模型签名, 像素预算, 图像哈希) -> (缩放后尺寸, image_grid_thw, 视觉嵌入)
+VISION_CACHE_SIZE = max(0, int(_RUNTIME_CFG.get("vision_cache_size", 32) or 0))
+# 嵌入留在模型设备上（通常是显存），另按字节数设上限（0 = 只按条目数限制）
+VISION_CACHE_MAX_BYTES = max(0, int(float(_RUNTIME_CFG.get("vision_cache_max_mb", 256) or 0) * 1024 * 1024))
+_VISION_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+_VISION_CACHE_STATS = {"hits": 0, "misses": 0}
+
+# 最近一次实际加载（未命中缓存）的分阶段耗时与内存变化，按模型类别保存
+_MODEL_LOAD_STATS: Dict[str, Optional[dict]] = {"text": None, "vl": None}
+
+# 目标模型不支持辅助生成时 transformers 抛出的异常；OOM 等 RuntimeError 不在其列，不重跑
+_SPECULATIVE_FALLBACK_ERRORS = (ValueError, NotImplementedError)
+# 有状态目标模型忽略草稿模型的警告只打印一次
+_STATEFUL_DRAFT_WARNED: List[str] = []
+
+_SPECULATIVE_STATS = {
+    "generations": 0,
+    "new_tokens": 0,
+    "target_forward_passes": 0,
+    "draft_forward_passes": 0,
+    "accepted_tokens": 0,
+    "last": None,
+}
 
 
 def _get_optimal_attn_implementation(device: str) -> Optional[str]:
@@ -248,22 +235,11 @@ def _raise_runtime_error(code: str, message: str, detail: Optional[str] = None,
     raise RuntimeError(f"[IAT:{code}][{trace_id}] {message}")
 
 
-def _normalize_attention_backend(attention_backend: Optional[str]) -> str:
-    if attention_backend in ATTENTION_OPTIONS:
-        return attention_backend
-    alias = _ATTENTION_BACKEND_ALIASES.get(str(attention_backend or "").strip().lower())
-    if alias in ATTENTION_OPTIONS:
-        return alias
-    return DEFAULT_ATTENTION_BACKEND
-
-
 def _resolve_attention_backend(attention_backend: Optional[str], device: str) -> Tuple[Optional[str], str, bool]:
     backend = _normalize_attention_backend(attention_backend)
     return _ATTENTION_BACKEND_TO_IMPL.get(backend), backend, False
 
 
-DEFAULT_ATTENTION_BACKEND = _normalize_attention_backend(_RUNTIME_CFG.get("default_attention_backend", "SDPA"))
-
 
 def _supports_qwen35_architecture() -> bool:
     try:
@@ -572,7 +548,59 @@ def _download_with_retry(downloader_name: str, downloader, repo_id: str, local_d
     return False
 
 
+def _model_dir_signature(model_dir: Path) -> Optional[Tuple[Any, ...]]:
+    """目录、状态文件与顶层权重文件的 stat 签名。
+
+    分片增删、状态重写、原地覆盖分片（大小或 mtime 变化）都会改变它；
+    只看 stat，不读取文件内容。
+    """
+    try:
+        dir_stat = os.stat(model_dir)
+    except OSError:
+        return None
+    try:
+        state_stat = os.stat(_model_state_file(model_dir))
+        state_key = (state_stat.st_mtime_ns, state_stat.st_size)
+    except OSError:
+        state_key = (0, -1)
+    weights = []
+    try:
+        with os.scandir(model_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith((".safetensors", ".bin", ".pt")):
+                    continue
+                try:
+                    # HF 缓存里的分片是软链接，stat 跟随到实际文件。
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                weights.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        return None
+    return (dir_stat.st_mtime_ns, *state_key, tuple(sorted(weights)))
+
+
 def ensure_model(variant: str, mode: str) -> Path:
+    """解析 `(variant, mode)` 对应的本地模型目录，必要时下载。
+
+    校验通过的结果按进程缓存；命中时只 stat 目录、状态文件和权重文件，不再解析 JSON。
+    """
+    key = (variant, mode)
+    cached = _RESOLVED_MODEL_DIRS.get(key)
+    if cached is not None:
+        model_dir, signature = cached
+        if signature is not None and _model_dir_signature(model_dir) == signature:
+            return model_dir
+        _RESOLVED_MODEL_DIRS.pop(key, None)
+
+    model_dir, complete = _resolve_model_dir(variant, mode)
+    if complete:
+        # 签名在校验（可能补写状态文件）之后采集，避免下一次误判失效。
+        _RESOLVED_MODEL_DIRS[key] = (model_dir, _model_dir_signature(model_dir))
+    return model_dir
+
+
+def _resolve_model_dir(variant: str, mode: str) -> Tuple[Path, bool]:
     model_map = TEXT_MODEL_CANDIDATES if mode == "text" else VL_MODEL_CANDIDATES
     candidates = model_map.get(variant)
     if not candidates:
@@ -585,13 +613,13 @@ def ensure_model(variant: str, mode: str) -> Path:
             if _is_model_complete(existing_dir, repo_id, mode):
                 if repo_id != candidates[0]:
                     _log_info(f"使用候选回退仓库: {repo_id}")
-                return existing_dir
+                return existing_dir, True
 
         local_dirs = [d for d in model_dirs if _has_local_model_artifacts(d)]
         if local_dirs:
             target = next((d for d in local_dirs if _has_weights(d)), local_dirs[0])
             _warn_incomplete_local_model(target, repo_id, mode)
-            return target
+            return target, False
 
         if OFFLINE_ONLY:
             errors.append(f"{repo_id}: offline_only enabled and no local model artifacts found")
@@ -602,7 +630,7 @@ def ensure_model(variant: str, mode: str) -> Path:
             if _is_model_complete(target, repo_id, mode):
                 if repo_id != candidates[0]:
                     _log_info(f"使用候选回退仓库: {repo_id}")
-                return target
+                return target, True
 
             if target.exists() and _has_weights(target):
                 missing = _missing_weight_files(target)
@@ -621,7 +649,7 @@ def ensure_model(variant: str, mode: str) -> Path:
                         continue
                     if _is_model_complete(target, repo_id, mode):
                         _log_major(f"模型已下载: {repo_id} <- {source_name}")
-                        return target
+                        return target, True
 
                     missing_after = _missing_weight_files(target)
                     if missing_after:
@@ -635,7 +663,7 @@ def ensure_model(variant: str, mode: str) -> Path:
                     errors.append(f"{repo_id}: {source_name} download failed: {exc}")
             if _has_local_model_artifacts(target):
                 _warn_incomplete_local_model(target, repo_id, mode)
-                return target
+                return target, False
 
     _raise_runtime_error(
         "E2001",
@@ -656,6 +684,127 @@ def resolve_device(device: str) -> str:
     return device
 
 
+def configure_cpu_mode(
+    *,
+    threads: Optional[int] = None,
+    affinity: Optional[str] = None,
+    bf16_autocast: Optional[bool] = None,
+    quantize_int8: Optional[bool] = None,
+) -> dict:
+    """覆盖 `runtime.cpu_*` 配置（基准脚本等调用方使用），返回生效后的 CPU 模式。"""
+    updates = {
+        "threads": None if threads is None else max(0, int(threads)),
+        "affinity": None if affinity is None else str(affinity).strip(),
+        "bf16_autocast": None if bf16_autocast is None else bool(bf16_autocast),
+        "quantize_int8": None if quantize_int8 is None else bool(quantize_int8),
+    }
+    _CPU_MODE.update({key: value for key, value in updates.items() if value is not None})
+    return dict(_CPU_MODE)
+
+
+def _parse_cpu_affinity(spec: str) -> Set[int]:
+    cores: Set[int] = set()
+    for part in (spec or "").replace(" ", "").split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        try:
+            first, last = int(start), int(end or start)
+        except ValueError:
+            _log_warning(f"无法解析 cpu_affinity 片段 `{part}`，已忽略。")
+            continue
+        cores.update(range(min(first, last), max(first, last) + 1))
+    return cores
+
+
+def _pin_process_to_cores(cores: Set[int]) -> None:
+    """把本进程的所有现有线程绑定到 `cores`。
+
+    Linux 的 sched_setaffinity 只作用于单个线程（pid 0 即调用线程），所以逐个设置
+    /proc/self/task 下的线程；之后新建的线程继承创建者的亲和性。调用线程设置失败时抛出 OSError。
+    """
+    os.sched_setaffinity(0, cores)
+    try:
+        task_ids = [int(name) for name in os.listdir("/proc/self/task")]
+    except (OSError, ValueError):
+        return
+    for task_id in task_ids:
+        try:
+            os.sched_setaffinity(task_id, cores)
+        except OSError:
+            # 线程可能已经退出
+            pass
+
+
+def _apply_cpu_threads() -> None:
+    """按 CPU 模式绑定进程的 CPU 亲和性并设置 torch 线程数。
+
+    每次加载都重新绑定（预加载线程里调用同样作用于整个进程）；线程数不变时不重复设置。
+    """
+    global _CPU_THREADS_APPLIED
+    cores = _parse_cpu_affinity(_CPU_MODE["affinity"])
+    if cores:
+        if hasattr(os, "sched_setaffinity"):
+            try:
+                _pin_process_to_cores(cores)
+            except OSError as exc:
+                _log_warning(f"CPU 亲和性设置失败（{sorted(cores)}）: {exc}")
+                cores = set()
+        else:
+            _log_warning("当前平台不支持 cpu_affinity，已忽略。")
+            cores = set()
+    threads = _CPU_MODE["threads"] or len(cores)
+    if threads == _CPU_THREADS_APPLIED:
+        return
+    if threads:
+        torch.set_num_threads(threads)
+    _log_info(f"CPU 推理线程数: {torch.get_num_threads()}")
+    _CPU_THREADS_APPLIED = threads
+
+
+def _cpu_supports_bf16() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def _cpu_autocast_enabled() -> bool:
+    # 动态量化后的 Linear 只接受 float32 输入，两者不叠加。
+    return bool(_CPU_MODE["bf16_autocast"] and not _CPU_MODE["quantize_int8"] and _cpu_supports_bf16())
+
+
+def _cpu_mode_signature(run_device: str) -> tuple:
+    """CPU 上影响输出的设置：权重量化与 bf16 autocast。"""
+    if run_device != "cpu":
+        return ()
+    return (
+        "int8" if _CPU_MODE["quantize_int8"] else "float32",
+        "bf16_autocast" if _cpu_autocast_enabled() else "fp32_compute",
+    )
+
+
+def _quantize_for_cpu(model, label: str):
+    if not _CPU_MODE["quantize_int8"]:
+        return model
+    try:
+        from torch.ao.quantization import quantize_dynamic
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        _log_info(f"{label} 已对 Linear 层启用 int8 动态量化。")
+    except Exception as exc:
+        _log_warning(f"{label} int8 动态量化失败，继续使用浮点权重: {exc}")
+    return model
+
+
+def _generation_context(run_device: str):
+    if run_device == "cpu" and _cpu_autocast_enabled():
+        return torch.autocast(device_type="cpu", dtype=torch.bfloat16)
+    return nullcontext()
+
+
 def _dtype_for_device(device: str):
     if device == "cuda" and hasattr(torch.cuda, "is_bf16_supported") and torch.cuda.is_bf16_supported():
         return torch.bfloat16
@@ -758,10 +907,18 @@ def _auto_device_max_memory(variant: str):
     return max_memory
 
 
+def _in_preload_thread() -> bool:
+    return threading.current_thread().name.startswith(_PRELOAD_THREAD_PREFIX)
+
+
 def _prepare_cuda_for_load():
     """准备CUDA环境，清理缓存"""
     if not torch.cuda.is_available():
         return
+    if _in_preload_thread():
+        # ComfyUI 的 model_management 不是线程安全的，不能在后台线程里卸载其他节点的模型
+        _log_info("后台预加载：跳过 model_management 卸载与显存清理")
+        return
     try:
         if model_management is not None:
             model_management.unload_all_models()
@@ -793,13 +950,45 @@ def apply_vl_chat_template(processor, conversation) -> str:
         return processor.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
 
 
-def _strip_thinking_content(text: str) -> str:
-    if not text:
-        return text
-    text = re.sub(r"<think>[\s\S]*?(?:</think>|$)", "", text, flags=re.IGNORECASE)
-    text = re.sub(r"<(?:analysis|reasoning)>[\s\S]*?(?:</(?:analysis|reasoning)>|$)", "", text, flags=re.IGNORECASE)
-    text = re.sub(r"<\|(?:think|analysis|reasoning)\|>[\s\S]*?(?:<\|/?(?:think|analysis|reasoning)\|>|$)", "", text, flags=re.IGNORECASE)
-    return text.strip()
+class _VisibleTextStoppingCriteria(StoppingCriteria):
+    """按去掉思考内容后的可见文本提前结束：停止词、JSON 对象闭合、句子数上限。
+
+    每行缓存已解码的文本，每步只解码新增的 token（Qwen 的字节级 BPE 可以分段解码再拼接）；
+    结尾是不完整的多字节字符时，这几个 token 留到下一步与后续 token 一起解码。
+    """
+
+    # 连续这么多 token 仍解不出完整字符时照常提交，避免退化为每步全量解码
+    _MAX_PENDING_TOKENS = 8
+
+    def __init__(self, tokenizer, prompt_length: int, stop_rules: dict):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_rules = stop_rules
+        self._decoded: Dict[int, Tuple[int, str]] = {}
+
+    def _visible_text(self, index: int, row) -> str:
+        generated = row[self.prompt_length:]
+        length = int(generated.shape[-1])
+        committed, text = self._decoded.get(index, (0, ""))
+        if committed > length:
+            # 新一轮 generate（例如推测解码回退后重跑）
+            committed, text = 0, ""
+        tail = self.tokenizer.decode(generated[committed:], skip_special_tokens=True)
+        if not tail.endswith("\ufffd") or length - committed >= self._MAX_PENDING_TOKENS:
+            committed, text, tail = length, text + tail, ""
+        self._decoded[index] = (committed, text)
+        return _strip_thinking_content(text + tail)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = [stop_offset(self._visible_text(index, row), **self.stop_rules) >= 0 for index, row in enumerate(input_ids)]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+def _attach_stopping_criteria(gen_kwargs: dict, tokenizer, prompt_length: int, stop_rules: dict) -> None:
+    if has_stop_rules(**stop_rules):
+        gen_kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [_VisibleTextStoppingCriteria(tokenizer, prompt_length, stop_rules)]
+        )
 
 
 def _load_tokenizer(model_dir: Path):
@@ -820,15 +1009,34 @@ def _clear_cache(kind: str) -> None:
     cache = _MODEL_CACHE[kind]
     for key in list(cache.keys()):
         cache[key] = None
+    if kind == "vl":
+        _VISION_CACHE.clear()
     gc.collect()
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
 
 
+def unload_model(kind: str) -> None:
+    """卸载一类模型（text 连同草稿模型）。
+
+    持有该类的加载锁，进行中的加载（包括后台预加载）结束后才清理，
+    另一类模型（例如预加载的 VL 模型）不受影响。
+    """
+    if kind not in _MODEL_LOAD_LOCKS:
+        raise ValueError(f"[IAT] model kind must be 'text' or 'vl', got {kind!r}.")
+    with _model_load_lock(kind, f"{kind} 卸载"):
+        _clear_cache(kind)
+        if kind == "text":
+            _clear_cache("draft")
+    _log_major(f"{'文本' if kind == 'text' else '视觉'}模型已卸载")
+
+
 def unload_all_models() -> None:
-    """卸载所有模型"""
-    _clear_cache("text")
-    _clear_cache("vl")
+    """卸载所有模型；依次持有 text、vl 的加载锁，不会清掉加载到一半的模型。"""
+    with _model_load_lock("text", "text 卸载"), _model_load_lock("vl", "vl 卸载"):
+        _clear_cache("text")
+        _clear_cache("vl")
+        _clear_cache("draft")
     _log_major("所有模型已卸载")
 
 
@@ -917,15 +1125,155 @@ def _get_model_loading_kwargs(variant: str, device: str, attention_backend: Opti
     return kwargs, resolved_attention_backend, allow_attn_fallback
 
 
+@contextmanager
+def _model_load_lock(kind: str, variant: str):
+    """持有某类模型的加载锁；若后台预加载正在进行，则等待其完成而不是重复加载。"""
+    lock = _MODEL_LOAD_LOCKS[kind]
+    if not lock.acquire(blocking=False):
+        _log_info(f"等待进行中的模型加载完成: {variant}")
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _current_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KiB 为单位，macOS 以字节为单位
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+def _cuda_allocated_bytes(device: int, peak: bool = False) -> int:
+    reader = torch.cuda.max_memory_allocated if peak else torch.cuda.memory_allocated
+    return reader(device)
+
+
+def _mib_delta(before: Optional[int], after: Optional[int]) -> Optional[float]:
+    if before is None or after is None:
+        return None
+    return round((after - before) / (1024**2), 1)
+
+
+class _ModelLoadProfiler:
+    """记录一次模型加载各阶段的耗时、RSS 变化、峰值 RSS 增量与显存峰值增量（MiB）。
+
+    显存只统计加载所用的 CUDA 设备（auto device_map 分到其他卡的部分不计）。
+    RSS 是整个进程的数值：后台预加载与其他节点并行时记录 `concurrent=True`，增量可能包含其他线程的分配，且不采样显存。
+    """
+
+    def __init__(self, kind: str, variant: str, device: str, attention_backend: Optional[str], started: Optional[float] = None):
+        self.kind = kind
+        concurrent = _in_preload_thread()
+        # 后台线程不重置显存峰值统计：会干扰主线程上正在运行的节点
+        self.track_cuda = resolve_device(device) == "cuda" and torch.cuda.is_available() and not concurrent
+        self.cuda_device = torch.cuda.current_device() if self.track_cuda else None
+        self.started = time.perf_counter() if started is None else started
+        self.record = {
+            "kind": kind,
+            "variant": variant,
+            "device": resolve_device(device),
+            "cuda_device": self.cuda_device,
+            "attention_backend": _normalize_attention_backend(attention_backend),
+            "concurrent": concurrent,
+            "transformers": transformers.__version__,
+            "torch": torch.__version__,
+            "stages": [],
+            "total_seconds": None,
+        }
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """补记未单独采样内存的阶段（如缓存命中判断前的 ensure_model）。"""
+        self.record["stages"].append(
+            {
+                "stage": name,
+                "seconds": round(seconds, 3),
+                "rss_delta_mib": None,
+                "peak_rss_delta_mib": None,
+                "vram_peak_delta_mib": None,
+            }
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        rss_before = _current_rss_bytes()
+        peak_before = _peak_rss_bytes()
+        vram_before = None
+        if self.track_cuda:
+            torch.cuda.synchronize(self.cuda_device)
+            vram_before = _cuda_allocated_bytes(self.cuda_device)
+            torch.cuda.reset_peak_memory_stats(self.cuda_device)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.track_cuda:
+                torch.cuda.synchronize(self.cuda_device)
+            self.record["stages"].append(
+                {
+                    "stage": name,
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "rss_delta_mib": _mib_delta(rss_before, _current_rss_bytes()),
+                    "peak_rss_delta_mib": _mib_delta(peak_before, _peak_rss_bytes()),
+                    "vram_peak_delta_mib": (
+                        _mib_delta(vram_before, _cuda_allocated_bytes(self.cuda_device, peak=True)) if self.track_cuda else None
+                    ),
+                }
+            )
+
+    def finish(self) -> dict:
+        self.record["total_seconds"] = round(time.perf_counter() - self.started, 3)
+        _MODEL_LOAD_STATS[self.kind] = self.record
+        breakdown = ", ".join(f"{item['stage']} {item['seconds']:.2f}s" for item in self.record["stages"])
+        concurrent = " | 后台预加载（内存增量可能含其他线程）" if self.record["concurrent"] else ""
+        _log_major(f"模型加载耗时 {self.record['total_seconds']:.2f}s | {self.record['variant']} | {breakdown}{concurrent}")
+        for item in self.record["stages"]:
+            _log_info(
+                f"加载阶段 {item['stage']}: {item['seconds']:.3f}s | RSS {item['rss_delta_mib']} MiB | "
+                f"峰值 RSS +{item['peak_rss_delta_mib']} MiB | 显存峰值 +{item['vram_peak_delta_mib']} MiB"
+            )
+        return self.record
+
+
+def get_model_load_stats(kind: Optional[str] = None) -> dict:
+    """返回最近一次实际加载的分阶段统计；`kind` 为 "text"/"vl" 时只返回该类别（未加载过为空 dict）。"""
+    def _copy(record: Optional[dict]) -> dict:
+        return {**record, "stages": [dict(item) for item in record["stages"]]} if record else {}
+
+    if kind is not None:
+        return _copy(_MODEL_LOAD_STATS.get(kind))
+    return {name: _copy(record) for name, record in _MODEL_LOAD_STATS.items() if record}
+
+
 def load_text_model(variant: str, device: str, attention_backend: Optional[str] = None):
+    """加载文本模型，带缓存机制；与进行中的预加载共用同一次加载。"""
+    with _model_load_lock("text", variant):
+        return _load_text_model(variant, device, attention_backend)
+
+
+def _load_text_model(variant: str, device: str, attention_backend: Optional[str] = None):
     """加载文本模型，带缓存机制"""
     run_device = resolve_device(device)
     resolved_attention_backend = _normalize_attention_backend(attention_backend)
     _check_transformers_support()
+    started = time.perf_counter()
     model_dir = ensure_model(variant, mode="text")
+    ensure_seconds = time.perf_counter() - started
+    if run_device == "cpu":
+        _apply_cpu_threads()
     
     # 创建缓存签名
-    signature = (str(model_dir), run_device, resolved_attention_backend)
+    signature = (str(model_dir), run_device, resolved_attention_backend, _cpu_mode_signature(run_device))
     
     # 检查缓存
     cache = _MODEL_CACHE["text"]
@@ -934,14 +1282,19 @@ def load_text_model(variant: str, device: str, attention_backend: Optional[str]
         return cache["model"], cache["tokenizer"], run_device
     
     # 清理旧缓存
-    _clear_cache("text")
+    profiler = _ModelLoadProfiler("text", variant, run_device, resolved_attention_backend, started)
+    profiler.add_stage("ensure_model", ensure_seconds)
+    with profiler.stage("clear_cache"):
+        _clear_cache("text")
     
     if run_device == "cuda":
-        _prepare_cuda_for_load()
+        with profiler.stage("prepare_cuda"):
+            _prepare_cuda_for_load()
 
     # 加载tokenizer（Transformers 路径）
     try:
-        tokenizer = _load_tokenizer(model_dir)
+        with profiler.stage("tokenizer"):
+            tokenizer = _load_tokenizer(model_dir)
     except Exception as exc:
         _raise_model_load_error(
             stage="tokenizer",
@@ -952,22 +1305,24 @@ def load_text_model(variant: str, device: str, attention_backend: Optional[str]
         )
     
     # 获取加载参数
-    kwargs, resolved_attention_backend, allow_attn_fallback = _get_model_loading_kwargs(
-        variant, run_device, resolved_attention_backend
-    )
+    with profiler.stage("loading_kwargs"):
+        kwargs, resolved_attention_backend, allow_attn_fallback = _get_model_loading_kwargs(
+            variant, run_device, resolved_attention_backend
+        )
     
     _log_major(f"正在加载文本模型: {variant} | 注意力: {resolved_attention_backend}")
     
-    # 加载模型
+    # 加载模型（dtype 通过 from_pretrained 参数在读取权重时完成转换）
     try:
-        model = _load_pretrained_with_fallback(
-            AutoModelForCausalLM,
-            model_dir,
-            kwargs,
-            "文本模型",
-            resolved_attention_backend,
-            allow_attn_fallback,
-        )
+        with profiler.stage("from_pretrained"):
+            model = _load_pretrained_with_fallback(
+                AutoModelForCausalLM,
+                model_dir,
+                kwargs,
+                "文本模型",
+                resolved_attention_backend,
+                allow_attn_fallback,
+            )
     except Exception as exc:
         _raise_model_load_error(
             stage="text_model",
@@ -980,17 +1335,24 @@ def load_text_model(variant: str, device: str, attention_backend: Optional[str]
     # 设置为评估模式
     model.eval()
     if not hasattr(model, "hf_device_map"):
-        model.to(run_device)
+        with profiler.stage("to_device"):
+            model.to(run_device)
+    if run_device == "cpu" and _CPU_MODE["quantize_int8"]:
+        with profiler.stage("quantize"):
+            model = _quantize_for_cpu(model, "文本模型")
     
     # 编译模型以加速（仅CUDA）
     if ENABLE_TORCH_COMPILE and run_device == "cuda" and hasattr(torch, "compile"):
         try:
             _log_info("尝试编译模型以加速推理...")
-            model = torch.compile(model, mode="reduce-overhead")
+            # torch.compile 是惰性的：真正的编译发生在首次生成，这里只计创建包装的耗时
+            with profiler.stage("compile_wrapper"):
+                model = torch.compile(model, mode="reduce-overhead")
         except Exception as e:
             _log_info(f"模型编译失败（不影响使用）: {e}")
     
     _log_major(f"文本模型加载完成 | 规格={variant} | 设备={run_device}")
+    profiler.finish()
     
     # 更新缓存
     cache["signature"] = signature
@@ -1001,14 +1363,24 @@ def load_text_model(variant: str, device: str, attention_backend: Optional[str]
 
 
 def load_vl_model(variant: str, device: str, attention_backend: Optional[str] = None):
+    """加载视觉语言模型，带缓存机制；与进行中的预加载共用同一次加载。"""
+    with _model_load_lock("vl", variant):
+        return _load_vl_model(variant, device, attention_backend)
+
+
+def _load_vl_model(variant: str, device: str, attention_backend: Optional[str] = None):
     """加载视觉语言模型，带缓存机制"""
     _check_transformers_support()
+    started = time.perf_counter()
     model_dir = ensure_model(variant, mode="vl")
+    ensure_seconds = time.perf_counter() - started
     run_device = resolve_device(device)
     resolved_attention_backend = _normalize_attention_backend(attention_backend)
+    if run_device == "cpu":
+        _apply_cpu_threads()
     
     # 创建缓存签名
-    signature = (str(model_dir), run_device, resolved_attention_backend)
+    signature = (str(model_dir), run_device, resolved_attention_backend, _cpu_mode_signature(run_device))
     
     # 检查缓存
     cache = _MODEL_CACHE["vl"]
@@ -1017,17 +1389,22 @@ def load_vl_model(variant: str, device: str, attention_backend: Optional[str] =
         return cache["model"], cache["tokenizer"], cache["processor"], run_device
     
     # 清理旧缓存
-    _clear_cache("vl")
+    profiler = _ModelLoadProfiler("vl", variant, run_device, resolved_attention_backend, started)
+    profiler.add_stage("ensure_model", ensure_seconds)
+    with profiler.stage("clear_cache"):
+        _clear_cache("vl")
     
     if run_device == "cuda":
-        _prepare_cuda_for_load()
+        with profiler.stage("prepare_cuda"):
+            _prepare_cuda_for_load()
     
     # 加载processor和tokenizer
     processor_kwargs = {"trust_remote_code": True}
     if OFFLINE_ONLY:
         processor_kwargs["local_files_only"] = True
     try:
-        processor = AutoProcessor.from_pretrained(str(model_dir), **processor_kwargs)
+        with profiler.stage("processor"):
+            processor = AutoProcessor.from_pretrained(str(model_dir), **processor_kwargs)
     except Exception as exc:
         _raise_model_load_error(
             stage="processor",
@@ -1037,7 +1414,8 @@ def load_vl_model(variant: str, device: str, attention_backend: Optional[str] =
             exc=exc,
         )
     try:
-        tokenizer = _load_tokenizer(model_dir)
+        with profiler.stage("tokenizer"):
+            tokenizer = _load_tokenizer(model_dir)
     except Exception as exc:
         _raise_model_load_error(
             stage="tokenizer",
@@ -1048,22 +1426,24 @@ def load_vl_model(variant: str, device: str, attention_backend: Optional[str] =
         )
     
     # 获取加载参数
-    kwargs, resolved_attention_backend, allow_attn_fallback = _get_model_loading_kwargs(
-        variant, run_device, resolved_attention_backend
-    )
+    with profiler.stage("loading_kwargs"):
+        kwargs, resolved_attention_backend, allow_attn_fallback = _get_model_loading_kwargs(
+            variant, run_device, resolved_attention_backend
+        )
     
     _log_major(f"正在加载多模态模型: {variant} | 注意力: {resolved_attention_backend}")
     
-    # 加载模型
+    # 加载模型（dtype 通过 from_pretrained 参数在读取权重时完成转换）
     try:
-        model = _load_pretrained_with_fallback(
-            AutoModelForVision2Seq,
-            model_dir,
-            kwargs,
-            "多模态模型",
-            resolved_attention_backend,
-            allow_attn_fallback,
-        )
+        with profiler.stage("from_pretrained"):
+            model = _load_pretrained_with_fallback(
+                AutoModelForVision2Seq,
+                model_dir,
+                kwargs,
+                "多模态模型",
+                resolved_attention_backend,
+                allow_attn_fallback,
+            )
     except Exception as exc:
         _raise_model_load_error(
             stage="vl_model",
@@ -1076,9 +1456,14 @@ def load_vl_model(variant: str, device: str, attention_backend: Optional[str] =
     # 设置为评估模式
     model.eval()
     if not hasattr(model, "hf_device_map"):
-        model.to(run_device)
+        with profiler.stage("to_device"):
+            model.to(run_device)
+    if run_device == "cpu" and _CPU_MODE["quantize_int8"]:
+        with profiler.stage("quantize"):
+            model = _quantize_for_cpu(model, "多模态模型")
     
     _log_major(f"多模态模型加载完成 | 规格={variant} | 设备={run_device}")
+    profiler.finish()
     
     # 更新缓存
     cache["signature"] = signature
@@ -1089,6 +1474,327 @@ def load_vl_model(variant: str, device: str, attention_backend: Optional[str] =
     return model, tokenizer, processor, run_device
 
 
+def _run_preload(mode: str, variant: str, device: str, attention_backend: Optional[str]) -> None:
+    loader = load_vl_model if mode == "vl" else load_text_model
+    start = time.time()
+    try:
+        loader(variant, device, attention_backend)
+    except Exception as exc:
+        # 失败不在后台抛出：节点执行时的 load_*_model 会重新加载并报告完整错误
+        _log_warning(f"后台预加载失败 ({mode}/{variant}): {exc}")
+        return
+    _log_info(f"后台预加载完成: {mode}/{variant} | 耗时 {time.time() - start:.1f}s")
+
+
+def preload(
+    variant: str,
+    mode: str = "text",
+    device: str = "cuda",
+    attention_backend: Optional[str] = None,
+) -> bool:
+    """在后台线程提前加载模型，返回是否启动了新的加载线程。
+
+    之后同类的 `load_text_model`/`load_vl_model` 会等待这次加载并直接命中缓存；
+    同一 (mode, variant) 已在加载时不会重复启动。
+    """
+    if mode not in _MODEL_LOAD_LOCKS:
+        raise ValueError(f"[IAT] preload mode must be 'text' or 'vl', got {mode!r}.")
+    variant = resolve_model_variant(variant, mode)
+    key = (mode, variant)
+    with _PRELOAD_LOCK:
+        thread = _PRELOAD_THREADS.get(key)
+        if thread is not None and thread.is_alive():
+            return False
+        thread = threading.Thread(
+            target=_run_preload,
+            args=(mode, variant, device, attention_backend),
+            name=f"{_PRELOAD_THREAD_PREFIX}{mode}-{variant}",
+            daemon=True,
+        )
+        _PRELOAD_THREADS[key] = thread
+        thread.start()
+    _log_major(f"开始后台预加载: {variant} | 模式={mode}")
+    return True
+
+
+def wait_for_preloads(timeout: Optional[float] = None) -> None:
+    """等待所有后台预加载结束（主要用于脚本与测试）。"""
+    with _PRELOAD_LOCK:
+        threads = list(_PRELOAD_THREADS.values())
+    for thread in threads:
+        thread.join(timeout)
+
+
+def load_draft_model(variant: str, device: str):
+    """加载推测解码用的草稿模型，带缓存机制"""
+    run_device = resolve_device(device)
+    model_dir = ensure_model(variant, mode="text")
+    signature = (str(model_dir), run_device)
+
+    cache = _MODEL_CACHE["draft"]
+    if cache["model"] is not None and cache["signature"] == signature:
+        return cache["model"]
+
+    _clear_cache("draft")
+    kwargs, resolved_attention_backend, allow_attn_fallback = _get_model_loading_kwargs(variant, run_device, None)
+    _log_major(f"正在加载草稿模型: {variant}")
+    try:
+        model = _load_pretrained_with_fallback(
+            AutoModelForCausalLM,
+            model_dir,
+            kwargs,
+            "草稿模型",
+            resolved_attention_backend,
+            allow_attn_fallback,
+        )
+    except Exception as exc:
+        _raise_model_load_error(
+            stage="draft_model",
+            variant=variant,
+            mode="text",
+            model_dir=model_dir,
+            exc=exc,
+        )
+
+    model.eval()
+    if not hasattr(model, "hf_device_map"):
+        model.to(run_device)
+    if DRAFT_NUM_TOKENS:
+        model.generation_config.num_assistant_tokens = DRAFT_NUM_TOKENS
+
+    cache["signature"] = signature
+    cache["model"] = model
+    return model
+
+
+def _resolve_draft_variant(variant: str, draft_variant: Optional[str]) -> str:
+    """草稿模型必须是比目标更小的已知文本模型，否则不启用推测解码。"""
+    draft = (DRAFT_MODEL_VARIANT if draft_variant is None else draft_variant or "").strip()
+    if not draft or draft == variant:
+        return ""
+    if draft not in TEXT_MODEL_CANDIDATES:
+        _log_warning(f"草稿模型 `{draft}` 不在可选模型中，已关闭推测解码。")
+        return ""
+    draft_size = _variant_size_billions(draft)
+    target_size = _variant_size_billions(variant)
+    if draft_size is not None and target_size is not None and draft_size >= target_size:
+        return ""
+    return draft
+
+
+def _speculative_draft_model(model, variant: str, draft_variant: Optional[str], device: str):
+    draft = _resolve_draft_variant(variant, draft_variant)
+    if not draft:
+        return None
+    # 有状态模型（Qwen3.5 的线性注意力层）不支持辅助生成，不必加载草稿模型
+    if getattr(model, "_is_stateful", False):
+        if not _STATEFUL_DRAFT_WARNED:
+            _STATEFUL_DRAFT_WARNED.append(variant)
+            _log_warning(f"`{variant}` 为有状态模型，transformers 不支持对其推测解码，已忽略草稿模型 `{draft}`。")
+        return None
+    try:
+        return load_draft_model(draft, device)
+    except Exception as exc:
+        _log_warning(f"草稿模型加载失败，回退为常规解码: {exc}")
+        return None
+
+
+@contextmanager
+def _forward_counters(**modules):
+    """统计 generate 期间各模型的 forward 次数（推测解码接受率的依据）。"""
+    counts = {name: 0 for name in modules}
+    handles = []
+    for name, module in modules.items():
+        if module is None:
+            continue
+
+        def _hook(_module, _inputs, _output, _name=name):
+            counts[_name] += 1
+
+        handles.append(module.register_forward_hook(_hook))
+    try:
+        yield counts
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def _record_speculative_stats(draft_variant: str, new_tokens: int, counts: Dict[str, int]) -> dict:
+    # 每轮校验：目标模型 forward 一次，接受 n 个草稿 token 并自产 1 个 token。
+    target_passes = counts.get("target", 0)
+    draft_passes = counts.get("draft", 0)
+    accepted = max(0, new_tokens - target_passes)
+    last = {
+        "draft_variant": draft_variant,
+        "new_tokens": new_tokens,
+        "target_forward_passes": target_passes,
+        "draft_forward_passes": draft_passes,
+        "accepted_tokens": accepted,
+        "acceptance_rate": round(accepted / draft_passes, 4) if draft_passes else 0.0,
+        "tokens_per_target_pass": round(new_tokens / target_passes, 3) if target_passes else 0.0,
+    }
+    _SPECULATIVE_STATS["generations"] += 1
+    _SPECULATIVE_STATS["new_tokens"] += new_tokens
+    _SPECULATIVE_STATS["target_forward_passes"] += target_passes
+    _SPECULATIVE_STATS["draft_forward_passes"] += draft_passes
+    _SPECULATIVE_STATS["accepted_tokens"] += accepted
+    _SPECULATIVE_STATS["last"] = last
+    _log_info(
+        f"推测解码: 草稿={draft_variant} | 新 token={new_tokens} | 目标 forward={target_passes} | "
+        f"接受率={last['acceptance_rate']:.1%} | 每次校验产出={last['tokens_per_target_pass']}"
+    )
+    return last
+
+
+def get_speculative_decoding_stats() -> dict:
+    """返回推测解码的累计与最近一次接受统计。"""
+    stats = dict(_SPECULATIVE_STATS)
+    draft_passes = stats["draft_forward_passes"]
+    passes = stats["target_forward_passes"]
+    stats["acceptance_rate"] = round(stats["accepted_tokens"] / draft_passes, 4) if draft_passes else 0.0
+    stats["tokens_per_target_pass"] = round(stats["new_tokens"] / passes, 3) if passes else 0.0
+    return stats
+
+
+def _vision_patch_factor(processor) -> Tuple[int, int]:
+    """返回 (像素对齐因子, merge_size)；Qwen 视觉塔按 patch*merge 的网格切图。"""
+    image_processor = getattr(processor, "image_processor", None)
+    patch_size = int(getattr(image_processor, "patch_size", 14) or 14)
+    merge_size = int(getattr(image_processor, "merge_size", 2) or 2)
+    return patch_size * merge_size, merge_size
+
+
+def _fit_image_pixels(image, max_pixels: int, min_pixels: int, factor: int):
+    """按面积把图像缩放进 [min_pixels, max_pixels]，边长对齐到 factor。"""
+    width, height = image.size
+    area = width * height
+    if max_pixels and area > max_pixels:
+        scale = math.sqrt(max_pixels / area)
+        round_edge = math.floor
+    elif min_pixels and area < min_pixels:
+        scale = math.sqrt(min_pixels / area)
+        round_edge = math.ceil
+    else:
+        return image
+    new_width = max(factor, round_edge(width * scale / factor) * factor)
+    new_height = max(factor, round_edge(height * scale / factor) * factor)
+    if (new_width, new_height) == (width, height):
+        return image
+    return image.resize((new_width, new_height), Image.BICUBIC)
+
+
+def _vision_token_count(processed, merge_size: int) -> Optional[int]:
+    grid = processed.get("image_grid_thw") if hasattr(processed, "get") else None
+    if grid is None or not torch.is_tensor(grid):
+        return None
+    return int(grid.prod(dim=-1).sum().item()) // (merge_size * merge_size)
+
+
+def get_vision_input_stats() -> Optional[dict]:
+    """返回最近一次视觉生成的输入尺寸与视觉 token 数。"""
+    last = _VISION_INPUT_STATS["last"]
+    return dict(last) if last else None
+
+
+def _vision_cache_supported(model, processor) -> bool:
+    """嵌入缓存依赖 transformers 的 `mm_encoder_outputs` 接口：generate 直接接收预计算的视觉嵌入。"""
+    return (
+        VISION_CACHE_SIZE > 0
+        and callable(getattr(model, "get_image_features", None))
+        and "mm_encoder_outputs" in inspect.signature(model.forward).parameters
+        and isinstance(getattr(processor, "image_token", None), str)
+        and getattr(processor, "image_processor", None) is not None
+    )
+
+
+def _encode_images_cached(model, processor, images, scope: tuple, max_pixels: int, min_pixels: int, model_device, run_device):
+    """逐图返回 (缩放后尺寸, image_grid_thw, 视觉嵌入) 与命中数；未命中的图像合批预处理并只跑一次视觉塔。"""
+    factor, _ = _vision_patch_factor(processor)
+    keys = [scope + (image_content_hash(img),) for img in images]
+    entries = {}
+    pending = {}
+    for key, img in zip(keys, images):
+        if key in entries or key in pending:
+            continue
+        if key in _VISION_CACHE:
+            _VISION_CACHE.move_to_end(key)
+            entries[key] = _VISION_CACHE[key]
+        else:
+            pending[key] = _fit_image_pixels(img, max_pixels, min_pixels, factor)
+
+    if pending:
+        fitted = list(pending.values())
+        image_inputs = processor.image_processor(images=fitted, return_tensors="pt")
+        grids = image_inputs["image_grid_thw"]
+        with torch.inference_mode(), _generation_context(run_device):
+            features = model.get_image_features(
+                image_inputs["pixel_values"].to(model_device), grids.to(model_device), return_dict=True
+            )
+        for key, img, grid, embeds in zip(pending, fitted, grids, features.pooler_output):
+            entries[key] = (img.size, grid.clone(), embeds)
+            if not VISION_CACHE_MAX_BYTES or _vision_entry_bytes(entries[key]) <= VISION_CACHE_MAX_BYTES:
+                _VISION_CACHE[key] = entries[key]
+        cached_bytes = _vision_cache_bytes()
+        while len(_VISION_CACHE) > VISION_CACHE_SIZE or (VISION_CACHE_MAX_BYTES and cached_bytes > VISION_CACHE_MAX_BYTES):
+            _, evicted = _VISION_CACHE.popitem(last=False)
+            cached_bytes -= _vision_entry_bytes(evicted)
+
+    hits = len(images) - len(pending)
+    _VISION_CACHE_STATS["hits"] += hits
+    _VISION_CACHE_STATS["misses"] += len(pending)
+    return [entries[key] for key in keys], hits
+
+
+def _vision_entry_bytes(entry: tuple) -> int:
+    embeds = entry[2]
+    return int(embeds.numel() * embeds.element_size())
+
+
+def _vision_cache_bytes() -> int:
+    return sum(_vision_entry_bytes(entry) for entry in _VISION_CACHE.values())
+
+
+def _expand_image_tokens(processor, chat: str, grids, merge_size: int) -> Optional[str]:
+    """按 image_grid_thw 把每个图像占位符展开成对应数量的视觉 token（等同 processor 的展开逻辑）。"""
+    image_token = processor.image_token
+    parts = chat.split(image_token)
+    if len(parts) - 1 != len(grids):
+        return None
+    expanded = [parts[0]]
+    for grid, part in zip(grids, parts[1:]):
+        expanded.append(image_token * (int(grid.prod().item()) // (merge_size * merge_size)))
+        expanded.append(part)
+    return "".join(expanded)
+
+
+def get_vision_cache_stats() -> dict:
+    """返回视觉编码缓存的条目数、占用字节与累计命中/未命中次数。"""
+    return {
+        "entries": len(_VISION_CACHE),
+        "max_entries": VISION_CACHE_SIZE,
+        "bytes": _vision_cache_bytes(),
+        "max_bytes": VISION_CACHE_MAX_BYTES,
+        **_VISION_CACHE_STATS,
+    }
+
+
+def _local_model_signature(variant: str, mode: str, device: str, attention_backend: Optional[str]) -> dict:
+    """响应缓存键中的模型部分：目录、目录 stat 签名、设备、注意力实现与 CPU 模式。"""
+    model_dir = ensure_model(variant, mode)
+    run_device = resolve_device(device)
+    return {
+        "backend": "Local",
+        "mode": mode,
+        "model": variant,
+        "model_dir": str(model_dir),
+        "model_stat": _model_dir_signature(model_dir),
+        "device": run_device,
+        "attention_backend": _normalize_attention_backend(attention_backend),
+        "cpu_mode": list(_cpu_mode_signature(run_device)),
+        "transformers": transformers.__version__,
+    }
+
+
 def generate_text(
     *,
     variant: str,
@@ -1100,6 +1806,58 @@ def generate_text(
     top_p: float,
     repetition_penalty: float,
     seed: int,
+    use_response_cache: bool = True,
+    draft_variant: Optional[str] = None,
+    stop_strings: Optional[List[str]] = None,
+    stop_on_json: bool = False,
+    max_sentences: int = 0,
+) -> str:
+    """生成文本；贪心解码（temperature == 0）的结果可命中持久化响应缓存。
+
+    `draft_variant` 为 None 时使用 `runtime.draft_model_variant`，空字符串关闭推测解码。
+    `stop_strings`/`stop_on_json`/`max_sentences` 在生成过程中提前结束解码。
+    """
+    params = {
+        "variant": variant,
+        "device": device,
+        "attention_backend": attention_backend,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "repetition_penalty": repetition_penalty,
+        "seed": seed,
+        "draft_variant": draft_variant,
+        "stop_rules": build_stop_rules(stop_strings, stop_on_json, max_sentences),
+    }
+    cache = active_response_cache(temperature, use_response_cache)
+    if cache is None:
+        return _generate_text(**params)
+    key = response_cache_key(
+        **_local_model_signature(variant, "text", device, attention_backend),
+        messages=messages,
+        max_tokens=int(max_tokens),
+        top_p=float(top_p),
+        repetition_penalty=float(repetition_penalty),
+        seed=int(seed),
+        stop_rules=params["stop_rules"],
+    )
+    return cache.get_or_generate(key, lambda: _generate_text(**params))
+
+
+def _generate_text(
+    *,
+    variant: str,
+    device: str,
+    attention_backend: Optional[str],
+    messages,
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+    repetition_penalty: float,
+    seed: int,
+    draft_variant: Optional[str] = None,
+    stop_rules: Optional[dict] = None,
 ) -> str:
     """生成文本，优化推理速度"""
     torch.manual_seed(seed)
@@ -1140,14 +1898,34 @@ def generate_text(
     if temperature > 0:
         gen_kwargs["temperature"] = max(temperature, 1e-5)
         gen_kwargs["top_p"] = top_p
-    
+
+    stop_rules = stop_rules or build_stop_rules()
+    _attach_stopping_criteria(gen_kwargs, tokenizer, model_inputs["input_ids"].shape[-1], stop_rules)
+
+    draft_model = _speculative_draft_model(model, variant, draft_variant, run_device)
+    if draft_model is not None:
+        gen_kwargs["assistant_model"] = draft_model
+
     # 使用torch.inference_mode()加速推理
-    with torch.inference_mode():
-        output_ids = model.generate(**model_inputs, **gen_kwargs)
-    
+    with torch.inference_mode(), _generation_context(run_device), _forward_counters(target=model, draft=draft_model) as counts:
+        try:
+            output_ids = model.generate(**model_inputs, **gen_kwargs)
+        except _SPECULATIVE_FALLBACK_ERRORS as exc:
+            if draft_model is None:
+                raise
+            _log_warning(f"推测解码不受支持，回退为常规解码: {exc}")
+            gen_kwargs.pop("assistant_model", None)
+            _attach_stopping_criteria(gen_kwargs, tokenizer, model_inputs["input_ids"].shape[-1], stop_rules)
+            draft_model = None
+            output_ids = model.generate(**model_inputs, **gen_kwargs)
+
     # 解码输出
     generated = output_ids[0][model_inputs["input_ids"].shape[-1]:]
-    result = _strip_thinking_content(tokenizer.decode(generated, skip_special_tokens=True))
+    if draft_model is not None:
+        _record_speculative_stats(
+            _resolve_draft_variant(variant, draft_variant), int(generated.shape[-1]), counts
+        )
+    result = apply_stop_rules(tokenizer.decode(generated, skip_special_tokens=True), **stop_rules)
     
     return result
 
@@ -1165,6 +1943,68 @@ def generate_vision_text(
     repetition_penalty: float,
     seed: int,
     system_prompt: str = "",
+    use_response_cache: bool = True,
+    stop_strings: Optional[List[str]] = None,
+    stop_on_json: bool = False,
+    max_sentences: int = 0,
+    max_pixels: Optional[int] = None,
+    min_pixels: Optional[int] = None,
+) -> str:
+    """生成视觉文本；贪心解码的结果按图像内容哈希命中持久化响应缓存。
+
+    `max_pixels`/`min_pixels` 为 None 时使用 `runtime.vision_*_pixels`，0 表示不限制。
+    """
+    params = {
+        "variant": variant,
+        "device": device,
+        "attention_backend": attention_backend,
+        "images": images,
+        "text_prompt": text_prompt,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "repetition_penalty": repetition_penalty,
+        "seed": seed,
+        "system_prompt": system_prompt,
+        "stop_rules": build_stop_rules(stop_strings, stop_on_json, max_sentences),
+        "max_pixels": VISION_MAX_PIXELS if max_pixels is None else max(0, int(max_pixels)),
+        "min_pixels": VISION_MIN_PIXELS if min_pixels is None else max(0, int(min_pixels)),
+    }
+    cache = active_response_cache(temperature, use_response_cache)
+    if cache is None:
+        return _generate_vision_text(**params)
+    image_list = [img for img in (images if isinstance(images, list) else [images]) if img is not None]
+    key = response_cache_key(
+        **_local_model_signature(variant, "vl", device, attention_backend),
+        images=image_list,
+        text_prompt=text_prompt,
+        system_prompt=(system_prompt or "").strip(),
+        max_tokens=int(max_tokens),
+        top_p=float(top_p),
+        repetition_penalty=float(repetition_penalty),
+        seed=int(seed),
+        stop_rules=params["stop_rules"],
+        pixel_policy=(params["max_pixels"], params["min_pixels"]),
+    )
+    return cache.get_or_generate(key, lambda: _generate_vision_text(**params))
+
+
+def _generate_vision_text(
+    *,
+    variant: str,
+    device: str,
+    attention_backend: Optional[str],
+    images,
+    text_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+    repetition_penalty: float,
+    seed: int,
+    system_prompt: str = "",
+    stop_rules: Optional[dict] = None,
+    max_pixels: int = 0,
+    min_pixels: int = 0,
 ) -> str:
     """生成视觉文本，优化推理速度"""
     torch.manual_seed(seed)
@@ -1178,6 +2018,32 @@ def generate_vision_text(
     images = [img for img in images if img is not None]
     if len(images) == 0:
         raise ValueError("[IAT] generate_vision_text requires at least one image.")
+    factor, merge_size = _vision_patch_factor(processor)
+    input_sizes = [img.size for img in images]
+
+    # 获取模型所在设备
+    if hasattr(model, "device"):
+        model_device = model.device
+    elif hasattr(model, "parameters"):
+        try:
+            model_device = next(model.parameters()).device
+        except:
+            model_device = torch.device(run_device)
+    else:
+        model_device = torch.device(run_device)
+
+    # 视觉编码缓存：重复的参考图跳过预处理与视觉塔前向
+    encoded = None
+    cache_hits = 0
+    if _vision_cache_supported(model, processor):
+        scope = (_MODEL_CACHE["vl"]["signature"], max_pixels, min_pixels)
+        encoded, cache_hits = _encode_images_cached(
+            model, processor, images, scope, max_pixels, min_pixels, model_device, run_device
+        )
+        processed_sizes = [entry[0] for entry in encoded]
+    else:
+        images = [_fit_image_pixels(img, max_pixels, min_pixels, factor) for img in images]
+        processed_sizes = [img.size for img in images]
     
     # 构建对话
     content = [{"type": "image", "image": img} for img in images]
@@ -1201,21 +2067,42 @@ def generate_vision_text(
             raise exc
     
     # 处理输入
-    processed = processor(text=chat, images=images, return_tensors="pt")
-    
-    # 获取模型所在设备
-    if hasattr(model, "device"):
-        model_device = model.device
-    elif hasattr(model, "parameters"):
-        try:
-            model_device = next(model.parameters()).device
-        except:
-            model_device = torch.device(run_device)
+    expanded_chat = None
+    if encoded is not None:
+        expanded_chat = _expand_image_tokens(processor, chat, [entry[1] for entry in encoded], merge_size)
+        if expanded_chat is None:
+            _log_warning("图像占位符数量与输入图像不一致，本次跳过视觉编码缓存")
+            encoded = None
+            cache_hits = 0
+            images = [_fit_image_pixels(img, max_pixels, min_pixels, factor) for img in images]
+    if encoded is None:
+        processed = processor(text=chat, images=images, return_tensors="pt")
     else:
-        model_device = torch.device(run_device)
+        processed = processor(text=expanded_chat, return_tensors="pt")
+        processed["image_grid_thw"] = torch.stack([entry[1] for entry in encoded])
+    vision_tokens = _vision_token_count(processed, merge_size)
+    _VISION_INPUT_STATS["last"] = {
+        "images": len(images),
+        "input_sizes": input_sizes,
+        "processed_sizes": processed_sizes,
+        "max_pixels": max_pixels,
+        "min_pixels": min_pixels,
+        "vision_tokens": vision_tokens,
+        "prompt_tokens": int(processed["input_ids"].shape[-1]),
+        "vision_cache_hits": cache_hits,
+    }
+    _log_info(
+        f"视觉输入: {len(images)} 张 | 尺寸 {input_sizes} -> {processed_sizes} | "
+        f"视觉 token={vision_tokens} | 总输入 token={processed['input_ids'].shape[-1]} | "
+        f"视觉缓存命中 {cache_hits}/{len(images)}"
+    )
     
     # 移动输入到模型设备
     model_inputs = {k: v.to(model_device) if torch.is_tensor(v) else v for k, v in processed.items()}
+    if encoded is not None:
+        model_inputs["mm_encoder_outputs"] = {
+            "image": BaseModelOutputWithPooling(pooler_output=tuple(entry[2] for entry in encoded))
+        }
     
     # 生成参数优化
     gen_kwargs = {
@@ -1230,13 +2117,16 @@ def generate_vision_text(
     if temperature > 0:
         gen_kwargs["temperature"] = max(temperature, 1e-5)
         gen_kwargs["top_p"] = top_p
-    
+
+    stop_rules = stop_rules or build_stop_rules()
+    _attach_stopping_criteria(gen_kwargs, tokenizer, model_inputs["input_ids"].shape[-1], stop_rules)
+
     # 使用torch.inference_mode()加速推理
-    with torch.inference_mode():
+    with torch.inference_mode(), _generation_context(run_device):
         output_ids = model.generate(**model_inputs, **gen_kwargs)
     
     # 解码输出
     generated = output_ids[0][model_inputs["input_ids"].shape[-1]:]
-    result = _strip_thinking_content(tokenizer.decode(generated, skip_special_tokens=True))
+    result = apply_stop_rules(tokenizer.decode(generated, skip_special_tokens=True), **stop_rules)
     
     return result
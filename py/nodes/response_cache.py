@@ -0,0 +1,193 @@
+"""SQLite-backed cache for deterministic (greedy) generations.
+
+Only ``temperature <= 0`` requests are cached: their output is fully determined
+by the backend, model signature, messages, images and generation parameters,
+so re-running a workflow can return the stored text instead of decoding again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+_CFG = getattr(sys.modules.get("comfyui_iat_config"), "data", {}) or {}
+_CFG_PATH = Path(getattr(sys.modules.get("comfyui_iat_config"), "path", Path(__file__).resolve().parents[2] / "config.yaml"))
+_CACHE_CFG = (_CFG.get("response_cache") or {}) if isinstance(_CFG, dict) else {}
+
+_ENABLED = bool(_CACHE_CFG.get("enabled", False))
+_PATH = str(_CACHE_CFG.get("path") or "").strip()
+_TTL_SECONDS = max(0.0, float(_CACHE_CFG.get("ttl_seconds", 7 * 24 * 3600) or 0))
+_MAX_ENTRIES = max(0, int(_CACHE_CFG.get("max_entries", 20000) or 0))
+_MAX_BYTES = max(0, int(_CACHE_CFG.get("max_bytes", 64 * 1024 * 1024) or 0))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+)
+"""
+
+_SHARED_CACHE: Optional["ResponseCache"] = None
+_SHARED_CACHE_LOCK = threading.Lock()
+
+
+def image_content_hash(image: Any) -> str:
+    """Hash decoded pixels so the same picture hits regardless of its source file."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def response_cache_key(*, images: Optional[Iterable[Any]] = None, **parts: Any) -> str:
+    payload = dict(parts)
+    payload["images"] = [image_content_hash(image) for image in images or []]
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Process- and thread-safe response store with TTL and size limits."""
+
+    def __init__(self, path: Path, *, ttl_seconds: float = 0.0, max_entries: int = 0, max_bytes: int = 0):
+        self.path = Path(path)
+        self.ttl_seconds = max(0.0, float(ttl_seconds))
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Autocommit + WAL lets several ComfyUI workers share one file.
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as exc:
+                print(f"[IAT] WARN: Response cache read failed: {exc}")
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, response, size, now, now),
+                )
+                self._prune(conn, now)
+            except sqlite3.Error as exc:
+                print(f"[IAT] WARN: Response cache write failed: {exc}")
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        if self.max_entries:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        if self.max_bytes:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            stale = []
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used_at ASC"):
+                if total <= self.max_bytes:
+                    break
+                stale.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def get_or_generate(self, key: str, generate: Callable[[], str]) -> str:
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        text = generate()
+        if (text or "").strip():
+            self.put(key, text)
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            try:
+                entries, total = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+            except sqlite3.Error:
+                entries, total = 0, 0
+            return {
+                "path": str(self.path),
+                "entries": int(entries),
+                "bytes": int(total),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _cache_path() -> Path:
+    if not _PATH:
+        return _CFG_PATH.parent / ".iat_cache" / "responses.sqlite3"
+    path = Path(_PATH).expanduser()
+    if not path.is_absolute():
+        path = (_CFG_PATH.parent / path).resolve()
+    return path
+
+
+def active_response_cache(temperature: float, use_cache: bool = True) -> Optional[ResponseCache]:
+    """Return the shared cache when this request may be served from it."""
+    global _SHARED_CACHE
+    if not (_ENABLED and use_cache) or float(temperature) > 0:
+        return None
+    with _SHARED_CACHE_LOCK:
+        if _SHARED_CACHE is None:
+            _SHARED_CACHE = ResponseCache(
+                _cache_path(),
+                ttl_seconds=_TTL_SECONDS,
+                max_entries=_MAX_ENTRIES,
+                max_bytes=_MAX_BYTES,
+            )
+        return _SHARED_CACHE
@@ -0,0 +1,94 @@
+"""对比本地 Qwen3.5 文本模型在 CPU 上各推理配置的生成速度（tokens/s）。
+
+配置：fp32（基线）、bf16-autocast（仅支持原生 bf16 的 CPU）、int8-dynamic
+（Linear 层动态量化）。runtime 依赖 ComfyUI 的 `folder_paths`，且模型需已下载::
+
+    python scripts/benchmark_cpu_generation.py --comfyui-root ~/ComfyUI \\
+        --variants Qwen3.5-0.8B Qwen3.5-2B --threads 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGS = {
+    "fp32": {"bf16_autocast": False, "quantize_int8": False},
+    "bf16-autocast": {"bf16_autocast": True, "quantize_int8": False},
+    "int8-dynamic": {"bf16_autocast": False, "quantize_int8": True},
+}
+PROMPT = "Describe a rainy neon-lit street market at night in rich visual detail for an image generator."
+
+
+def _benchmark(runtime, variant: str, config: str, args) -> str:
+    import torch
+
+    runtime.unload_all_models()
+    runtime.configure_cpu_mode(threads=args.threads, affinity=args.affinity, **CONFIGS[config])
+    if CONFIGS[config]["bf16_autocast"] and not runtime._cpu_supports_bf16():
+        return f"{variant:<16} {config:<14} skipped: CPU has no native bf16"
+
+    start = time.perf_counter()
+    model, tokenizer, _ = runtime.load_text_model(variant, "cpu", args.attention_backend)
+    load_seconds = time.perf_counter() - start
+
+    prompt = runtime.apply_chat_template(tokenizer, [{"role": "user", "content": PROMPT}])
+    inputs = tokenizer([prompt], return_tensors="pt")
+    gen_kwargs = {
+        "do_sample": False,
+        "pad_token_id": tokenizer.eos_token_id,
+        "use_cache": True,
+    }
+    rates = []
+    with torch.inference_mode(), runtime._generation_context("cpu"):
+        model.generate(**inputs, max_new_tokens=4, **gen_kwargs)
+        for _ in range(max(1, args.repeat)):
+            start = time.perf_counter()
+            output = model.generate(
+                **inputs,
+                max_new_tokens=args.max_new_tokens,
+                min_new_tokens=args.max_new_tokens,
+                **gen_kwargs,
+            )
+            elapsed = time.perf_counter() - start
+            rates.append((output.shape[-1] - inputs["input_ids"].shape[-1]) / elapsed)
+    return (
+        f"{variant:<16} {config:<14} load {load_seconds:7.1f} s  "
+        f"median {statistics.median(rates):7.2f} tok/s  best {max(rates):7.2f} tok/s  "
+        f"threads {torch.get_num_threads()}"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comfyui-root", default=os.environ.get("COMFYUI_ROOT", ""))
+    parser.add_argument("--variants", nargs="+", default=["Qwen3.5-0.8B", "Qwen3.5-2B"])
+    parser.add_argument("--configs", nargs="+", choices=sorted(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--affinity", default="")
+    parser.add_argument("--attention-backend", default="SDPA")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.comfyui_root:
+        sys.path.insert(0, os.path.abspath(os.path.expanduser(args.comfyui_root)))
+    sys.path.insert(0, ROOT)
+    from py.nodes import qwen35_runtime as runtime
+
+    for variant in args.variants:
+        for config in args.configs:
+            try:
+                print(_benchmark(runtime, variant, config, args), flush=True)
+            except Exception as exc:
+                print(f"{variant:<16} {config:<14} failed: {exc}", flush=True)
+    runtime.unload_all_models()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
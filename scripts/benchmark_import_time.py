@@ -0,0 +1,135 @@
+"""测量节点模块的冷启动导入耗时。
+
+每个模块都在独立的子进程里导入，避免 `sys.modules` 缓存影响结果；
+同时报告导入后是否已加载 torch/transformers。
+
+“lazy” 是当前工作树的导入耗时；指定 `--baseline-rev` 时，脚本用
+`git worktree` 把该提交检出到临时目录，在那里导入同名模块作为
+“baseline”（例如延迟导入之前的提交），测完后删除临时工作树。
+在 ComfyUI 之外运行时没有 `folder_paths`，探针会放一个空模块占位
+（qwen35_runtime 只在查找模型目录时才用到它），并在输出里标注。
+
+用法（仓库根目录）::
+
+    python scripts/benchmark_import_time.py --repeat 5
+    python scripts/benchmark_import_time.py --repeat 5 --baseline-rev 26de850
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = (
+    "py.nodes.qwen35_nodes",
+    "py.nodes.qwen35_dataset_rag_nodes",
+    "py.nodes.qwen35_runtime",
+)
+_PROBE = """
+import json, sys, time, types
+try:
+    import folder_paths
+    stubbed = False
+except ImportError:
+    sys.modules["folder_paths"] = types.ModuleType("folder_paths")
+    stubbed = True
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy": sorted(m for m in ("torch", "transformers", "modelscope") if m in sys.modules),
+    "stubbed": stubbed,
+}}))
+"""
+
+
+def _measure(module: str, cwd: str = ROOT) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(modules=[module])],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        tail = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+        return {"error": tail}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _median_ms(samples) -> float:
+    return statistics.median(s["seconds"] for s in samples) * 1000
+
+
+def _run(modules, repeat: int, baseline_root: Optional[str]) -> bool:
+    stubbed = False
+    if baseline_root:
+        print(f"{'module':<40} {'lazy':>10} {'baseline':>10} {'saved':>10}  heavy (lazy / baseline)")
+    else:
+        print(f"{'module':<40} {'lazy':>10}  heavy")
+    for module in modules:
+        lazy = [_measure(module) for _ in range(repeat)]
+        errors = [s["error"] for s in lazy if "error" in s]
+        if errors:
+            print(f"{module:<40} failed: {errors[0]}")
+            continue
+        stubbed = stubbed or any(s["stubbed"] for s in lazy)
+        lazy_ms = _median_ms(lazy)
+        heavy = ",".join(lazy[-1]["heavy"]) or "-"
+        if not baseline_root:
+            print(f"{module:<40} {lazy_ms:8.1f}ms  {heavy}")
+            continue
+        baseline = [_measure(module, baseline_root) for _ in range(repeat)]
+        errors = [s["error"] for s in baseline if "error" in s]
+        if errors:
+            print(f"{module:<40} {lazy_ms:8.1f}ms  baseline failed: {errors[0]}")
+            continue
+        stubbed = stubbed or any(s["stubbed"] for s in baseline)
+        baseline_ms = _median_ms(baseline)
+        baseline_heavy = ",".join(baseline[-1]["heavy"]) or "-"
+        print(
+            f"{module:<40} {lazy_ms:8.1f}ms {baseline_ms:8.1f}ms {baseline_ms - lazy_ms:8.1f}ms  "
+            f"{heavy} / {baseline_heavy}"
+        )
+    return stubbed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-rev", default="", help="git revision to import the same modules from for comparison")
+    args = parser.parse_args()
+    repeat = max(1, args.repeat)
+
+    if not args.baseline_rev:
+        stubbed = _run(args.modules, repeat, None)
+    else:
+        with tempfile.TemporaryDirectory(prefix="iat-import-baseline-") as temp:
+            worktree = os.path.join(temp, "tree")
+            subprocess.run(
+                ["git", "worktree", "add", "--detach", worktree, args.baseline_rev],
+                cwd=ROOT,
+                check=True,
+                capture_output=True,
+            )
+            try:
+                print(f"baseline: {args.baseline_rev}")
+                stubbed = _run(args.modules, repeat, worktree)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=ROOT, capture_output=True)
+    if stubbed:
+        print("注意：未找到 ComfyUI 的 folder_paths，已用空模块占位。")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
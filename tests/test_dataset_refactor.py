@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import importlib.util
 import json
 import os
 import shutil
+import subprocess
+import sys
 import tempfile
+import time
 import unittest
 from pathlib import Path
 from unittest.mock import patch
@@ -14,12 +18,14 @@ from py.nodes.dataset_repository import (
     DatasetIndex,
     DatasetError,
     choose_caption,
+    dataset_fingerprint,
     discover_datasets,
     get_dataset_index,
     load_dataset_record,
 )
 from py.nodes.llm_backends import _generate_ollama, _generate_vllm
 
+_FINGERPRINTS = {"dataset": "fingerprint", "captions": "captions", "images": "images"}
 
 class DatasetRepositoryTests(unittest.TestCase):
     def make_dataset(self, root: Path, with_missing_pair: bool = False) -> Path:
@@ -84,6 +90,25 @@ class DatasetRepositoryTests(unittest.TestCase):
         self.assertEqual(record.entries[0].caption, "000000 caption")
         self.assertEqual(record.entries[0].relative_image_paths["result"], "dataset_A_result/000000.png")
 
+    def test_multiview_entries_are_stored_in_columns(self):
+        from py.nodes.dataset_repository import DatasetEntryTable, tokenize
+
+        with tempfile.TemporaryDirectory() as temp:
+            dataset = self.make_multiview_dataset(Path(temp))
+            record = load_dataset_record(dataset)
+            index = DatasetIndex(record, "fingerprint")
+        self.assertIsInstance(record.entries, DatasetEntryTable)
+        self.assertEqual(record.captions, ["000000 caption", "000b00 caption"])
+        self.assertEqual(record.record_id_at(1), "000b00")
+        self.assertEqual(record.relative_image_paths_at(1)["control2"], "dataset_A_control2/000b00.png")
+        entry = record.entries[1]
+        self.assertEqual(entry.image_path, dataset / "dataset_A_result" / "000b00.png")
+        self.assertEqual(entry.relative_image_path, "dataset_A_result/000b00.png")
+        self.assertEqual(entry.image_paths, record.image_paths_at(1))
+        self.assertEqual([item.record_id for item in record.entries[:2]], ["000000", "000b00"])
+        self.assertEqual(index.token_ids.dtype.name, "int32")
+        self.assertEqual(index._token_set(0), {index.vocabulary[token] for token in tokenize("000000 caption")})
+
     def test_nested_images_role_directories_are_supported(self):
         with tempfile.TemporaryDirectory() as temp:
             dataset = self.make_multiview_dataset(Path(temp))
@@ -236,6 +261,109 @@ class DatasetRepositoryTests(unittest.TestCase):
             [item["record_id"] for item in skewed_alternate],
         )
 
+    def test_mmr_similarity_matrix_matches_pairwise_definitions(self):
+        from py.nodes.dataset_repository import DatasetEntry, DatasetRecord, tokenize
+
+        captions = ["黑色 座椅 麂皮", "黑色 座椅 皮质", "棕色 中控台", "蓝色 门板 织物"]
+        record = DatasetRecord(
+            dataset_name="dataset_A",
+            version="1.0",
+            base_model="Flux.2 Klein 9B",
+            lora_name="model_A",
+            language="zh",
+            trigger_words=["trigger_a"],
+            entries=[DatasetEntry(str(index), caption) for index, caption in enumerate(captions)],
+            source_path=Path("dataset.json"),
+        )
+        bm25_index = DatasetIndex(record, "fingerprint")
+        similarity = bm25_index._candidate_similarity_matrix([0, 1, 3])
+        left, right = set(tokenize(captions[0])), set(tokenize(captions[1]))
+        self.assertAlmostEqual(similarity[0, 1], len(left & right) / len(left | right))
+        self.assertAlmostEqual(similarity[1, 0], similarity[0, 1])
+
+        vectors = [[1.0, 0.0], [0.6, 0.8], [-1.0, 0.0], None]
+        embedded_index = DatasetIndex(record, "fingerprint", text_embeddings=vectors, embedding_model_path="model")
+        similarity = embedded_index._candidate_similarity_matrix([0, 1, 2, 3])
+        self.assertAlmostEqual(similarity[0, 1], 0.6)
+        self.assertEqual(similarity[0, 2], 0.0)
+        self.assertEqual(similarity[0, 3], 0.0)
+
+    def test_federated_retrieval_merges_weighted_datasets_with_global_mmr(self):
+        from py.nodes.dataset_repository import DatasetEntry, DatasetRecord, retrieve_federated
+
+        def make_record(name, captions):
+            return DatasetRecord(
+                dataset_name=name,
+                version="1.0",
+                base_model="Flux.2 Klein 9B",
+                lora_name=name,
+                language="zh",
+                trigger_words=[f"trigger_{name}"],
+                entries=[DatasetEntry(f"{name}_{index}", caption) for index, caption in enumerate(captions)],
+                source_path=Path(f"{name}.json"),
+            )
+
+        first = DatasetIndex(make_record("a", ["黑色 座椅 麂皮", "棕色 中控台"]), "fingerprint_a")
+        second = DatasetIndex(make_record("b", ["黑色 座椅 皮质", "蓝色 门板 织物"]), "fingerprint_b")
+        results, debug = retrieve_federated([(first, 1.0), (second, 0.5)], "黑色 座椅", top_k=4, seed=3)
+        repeat, _ = retrieve_federated([(first, 1.0), (second, 0.5)], "黑色 座椅", top_k=4, seed=3)
+        single, _ = first.retrieve("黑色 座椅", top_k=2, seed=3)
+        self.assertEqual(results, repeat)
+        self.assertEqual(len(results), 4)
+        self.assertEqual({item["dataset_name"] for item in results}, {"a", "b"})
+        scores = {item["record_id"]: item["score"] for item in results}
+        self.assertAlmostEqual(scores["b_0"], 0.5 * scores["a_0"], places=5)
+        self.assertEqual(scores["a_0"], next(item["score"] for item in single if item["record_id"] == "a_0"))
+        self.assertEqual([item["dataset_weight"] for item in debug["datasets"]], [1.0, 0.5])
+        self.assertEqual(len(debug["candidate_pool"]), 4)
+        with self.assertRaises(DatasetError):
+            retrieve_federated([], "黑色")
+
+    @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_packed_dataset_matches_directory_layout(self, resolve_device, load_model, encode_text_batch):
+        from py.nodes import dataset_repository
+        from py.nodes.dataset_repository import dataset_fingerprints, pack_dataset
+
+        def entry_view(record):
+            return [
+                (entry.record_id, entry.caption, entry.relative_image_path, entry.relative_image_paths)
+                for entry in record.entries
+            ]
+
+        batches = []
+
+        def encode_image_batch(model_path, images, device, batch_size, grayscale=True):
+            batches.append([image.getpixel((0, 0)) for image in images])
+            return [[1.0, 0.0]] * len(images)
+
+        for make in (self.make_dataset, self.make_multiview_dataset):
+            with tempfile.TemporaryDirectory() as temp, patch.object(
+                dataset_repository, "_encode_image_batch", side_effect=encode_image_batch
+            ):
+                root = Path(temp)
+                source = make(root / "source")
+                original = load_dataset_record(source)
+                expected_fingerprints = dataset_fingerprints(original)
+                packed = pack_dataset(source, root / "packed", shard_bytes=1024)
+                expected_entries = entry_view(original)
+                get_dataset_index(original, root / "cache_a", embedding_model_path="model")
+                shutil.rmtree(source)
+                reloaded = load_dataset_record(root / "packed")
+                index = get_dataset_index(reloaded, root / "cache_b", embedding_model_path="model", thumbnail_cache=True)
+                shards = sorted((root / "packed" / "shards").glob("*.tar"))
+                packed_fingerprints = dataset_fingerprints(reloaded)
+                with self.assertRaisesRegex(DatasetError, "already packed"):
+                    pack_dataset(root / "packed", root / "repacked")
+            self.assertTrue(packed.packed)
+            self.assertEqual(entry_view(packed), expected_entries)
+            self.assertEqual(entry_view(reloaded), expected_entries)
+            self.assertEqual(packed_fingerprints, expected_fingerprints)
+            self.assertEqual(index.fingerprint, expected_fingerprints["dataset"])
+            self.assertGreater(len(shards), 1)
+            self.assertEqual(batches[-2:], batches[-4:-2])
+
     def test_fingerprint_tracks_unpaired_files_for_diagnostics(self):
         from py.nodes.dataset_repository import dataset_fingerprint
 
@@ -334,20 +462,174 @@ class DatasetRepositoryTests(unittest.TestCase):
             index = get_dataset_index(record, Path(temp) / "cache", embedding_model_path="model")
         self.assertEqual(len(index.image_embeddings), 2)
         self.assertEqual(index.image_embeddings[0], [1.0, 0.0])
-        self.assertEqual(encode_image_batch.call_args.args[1].__len__(), 8)
+        # All eight role images share the same pixels, so only one is embedded.
+        self.assertEqual(encode_image_batch.call_args.args[1].__len__(), 1)
+        self.assertEqual(index.image_dedup, {"image_references": 8, "unique_images": 1, "dedup_ratio": 0.875})
+
+    @patch("py.nodes.dataset_repository._encode_text", return_value=[1.0, 0.0])
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_duplicate_images_are_embedded_once_and_fanned_out(self, resolve_device, encode_text_batch, load_model, encode_text):
+        encode_image_batch_calls = []
+
+        def encode_image_batch(model_path, images, device, batch_size, grayscale=True):
+            encode_image_batch_calls.append(len(images))
+            return [[1.0, 0.0], [0.0, 1.0]][: len(images)]
+
+        with tempfile.TemporaryDirectory() as temp, patch(
+            "py.nodes.dataset_repository._encode_image_batch", side_effect=encode_image_batch
+        ):
+            dataset = self.make_multiview_dataset(Path(temp))
+            Image.new("RGB", (8, 8), (200, 10, 10)).save(dataset / "dataset_A_result" / "000b00.png")
+            record = load_dataset_record(dataset)
+            cache_dir = Path(temp) / "cache"
+            index = get_dataset_index(record, cache_dir, embedding_model_path="model")
+            cached = get_dataset_index(record, cache_dir, embedding_model_path="model")
+            _, debug = cached.retrieve("caption", top_k=1)
+        self.assertEqual(encode_image_batch_calls, [2, 2])
+        self.assertEqual(index.image_dedup["image_references"], 8)
+        self.assertEqual(index.image_dedup["unique_images"], 2)
+        self.assertEqual(index.image_embeddings[0], [1.0, 0.0])
+        mixed = index.image_embeddings[1]
+        self.assertAlmostEqual(mixed[0], 3 / 10**0.5, places=6)
+        self.assertAlmostEqual(mixed[1], 1 / 10**0.5, places=6)
+        self.assertEqual(debug["image_dedup"], index.image_dedup)
+
+    @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_thumbnail_cache_stores_exif_normalized_encoder_sized_images(self, resolve_device, load_model, encode_text_batch):
+        from py.nodes import dataset_repository
+        from py.nodes.dataset_repository import collect_index_cache, index_cache_stats
+
+        batches = []
+
+        def encode_image_batch(model_path, images, device, batch_size, grayscale=True):
+            batches.append([image.size for image in images])
+            return [[1.0, 0.0]] * len(images)
+
+        with tempfile.TemporaryDirectory() as temp, patch.object(
+            dataset_repository, "_encode_image_batch", side_effect=encode_image_batch
+        ):
+            root = Path(temp)
+            dataset = self.make_dataset(root)
+            exif = Image.Exif()
+            exif[0x0112] = 6  # Rotated 90 degrees: stored 120x80, displayed 80x120.
+            (dataset / "images" / "0001.png").unlink()
+            Image.new("RGB", (120, 80), (200, 10, 10)).save(dataset / "images" / "0001.jpg", exif=exif)
+            model_dir = root / "model"
+            model_dir.mkdir()
+            (model_dir / "preprocessor_config.json").write_text(
+                json.dumps({"size": {"shortest_edge": 32}, "crop_size": {"height": 32, "width": 32}}), encoding="utf-8"
+            )
+            record = load_dataset_record(dataset)
+            cache_dir = root / "cache"
+            get_dataset_index(record, cache_dir, embedding_model_path=str(model_dir), thumbnail_cache=True)
+            (cache_dir / "dataset_A.index.json").unlink()
+            with patch.object(dataset_repository, "_decode_entry_image") as decode, patch.object(
+                dataset_repository.DatasetRecord, "read_file"
+            ) as read_file:
+                get_dataset_index(record, cache_dir, embedding_model_path=str(model_dir), thumbnail_cache=True)
+            stats = index_cache_stats(cache_dir)
+            thumbnails = sorted((cache_dir / "thumbnails" / "32").rglob("*.png"))
+            orphan = cache_dir / "thumbnails" / "32" / "00" / "orphan.png"
+            orphan.parent.mkdir(parents=True, exist_ok=True)
+            Image.new("RGB", (8, 8)).save(orphan)
+            os.utime(orphan, (1, 1))
+            collected = collect_index_cache(cache_dir)
+            remaining = sorted((cache_dir / "thumbnails" / "32").rglob("*.png"))
+            Image.new("RGB", (8, 8), (0, 0, 255)).save(dataset / "images" / "0002.png")
+            (cache_dir / "dataset_A.index.json").unlink()
+            get_dataset_index(load_dataset_record(dataset), cache_dir, embedding_model_path=str(model_dir), thumbnail_cache=True)
+        self.assertEqual(batches[0], [(32, 48), (8, 8)])
+        self.assertEqual(batches[2], batches[0])
+        decode.assert_not_called()
+        read_file.assert_not_called()
+        self.assertEqual(len(thumbnails), 2)
+        self.assertEqual(stats["thumbnails"]["files"], 2)
+        self.assertEqual(collected["evicted_thumbnails"]["files"], 1)
+        self.assertEqual(remaining, thumbnails)
+        self.assertEqual(len(batches), 6)
+
+    @patch("py.nodes.dataset_repository._encode_image_batch", side_effect=lambda path, images, *args, **kwargs: [[1.0, 0.0]] * len(images))
+    @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_thumbnail_setting_is_part_of_the_embedding_signature(
+        self, resolve_device, load_model, encode_text_batch, encode_image_batch
+    ):
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            record = load_dataset_record(self.make_dataset(root))
+            model_dir = root / "model"
+            model_dir.mkdir()
+            config = model_dir / "preprocessor_config.json"
+            config.write_text(json.dumps({"size": {"shortest_edge": 32}}), encoding="utf-8")
+            cache_dir = root / "cache"
+            builds = []
+            for thumbnails, edge in ((False, 32), (False, 32), (True, 32), (True, 32), (True, 48), (False, 48)):
+                config.write_text(json.dumps({"size": {"shortest_edge": edge}}), encoding="utf-8")
+                before = encode_image_batch.call_count
+                index = get_dataset_index(record, cache_dir, embedding_model_path=str(model_dir), thumbnail_cache=thumbnails)
+                builds.append(encode_image_batch.call_count > before)
+                payload = json.loads((cache_dir / "dataset_A.index.json").read_text(encoding="utf-8"))
+        self.assertEqual(builds, [True, False, True, False, True, True])
+        self.assertEqual(index.thumbnail_edge, 0)
+        self.assertNotIn("thumbnail_edge", payload["embedding_signature"])
+
+    @patch("py.nodes.dataset_repository._encode_image_batch")
+    @patch("py.nodes.dataset_repository._encode_text_batch")
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_caption_only_edit_reencodes_changed_text_and_keeps_image_vectors(
+        self, resolve_device, load_model, encode_text_batch, encode_image_batch
+    ):
+        from py.nodes.dataset_repository import dataset_fingerprints
+
+        encode_text_batch.side_effect = [[[1.0, 0.0], [0.0, 1.0]], [[0.6, 0.8]]]
+        encode_image_batch.side_effect = [[[1.0, 0.0], [0.0, 1.0]], [[0.5, 0.5], [0.5, 0.5]]]
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            dataset = self.make_dataset(root)
+            before = dataset_fingerprints(load_dataset_record(dataset))
+            first = get_dataset_index(load_dataset_record(dataset), root / "cache", embedding_model_path="model")
+            (dataset / "images" / "0002.txt").write_text("蓝色产品，织物表面，侧面视图", encoding="utf-8")
+            record = load_dataset_record(dataset)
+            after = dataset_fingerprints(record)
+            with patch(
+                "py.nodes.dataset_repository.dataset_fingerprints", wraps=dataset_fingerprints
+            ) as hashed:
+                updated = get_dataset_index(record, root / "cache", embedding_model_path="model")
+            reloaded = get_dataset_index(record, root / "cache", embedding_model_path="model")
+        self.assertNotEqual(before["dataset"], after["dataset"])
+        self.assertNotEqual(before["captions"], after["captions"])
+        self.assertEqual(before["images"], after["images"])
+        self.assertEqual(encode_image_batch.call_count, 2)
+        self.assertEqual(encode_text_batch.call_args.args[1], ["蓝色产品，织物表面，侧面视图"])
+        self.assertEqual(updated.text_embeddings[0], [1.0, 0.0])
+        self.assertAlmostEqual(updated.text_embeddings[1][1], 0.8, places=6)
+        self.assertEqual(updated.image_embeddings.tolist(), first.image_embeddings.tolist())
+        self.assertEqual(updated.gray_embeddings.tolist(), first.gray_embeddings.tolist())
+        self.assertIn("侧面", updated.vocabulary)
+        self.assertTrue(any("re-encoded 1 edited caption" in warning for warning in updated.warnings))
+        self.assertEqual(reloaded.fingerprint, updated.fingerprint)
+        self.assertEqual(encode_text_batch.call_count, 2)
+        self.assertEqual(hashed.call_count, 1)
+        self.assertEqual(updated.storage_report, first.storage_report)
 
     @patch("py.nodes.dataset_repository._load_embedding_model")
     @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
     @patch("py.nodes.dataset_repository._encode_image_batch", return_value=[[1.0, 0.0]] * 8)
     @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
-    def test_multiview_cache_uses_schema_v3(self, resolve_device, encode_image_batch, encode_text_batch, load_model):
+    def test_multiview_cache_uses_schema_v4(self, resolve_device, encode_image_batch, encode_text_batch, load_model):
         with tempfile.TemporaryDirectory() as temp:
             root = Path(temp)
             record = load_dataset_record(self.make_multiview_dataset(root))
             cache_dir = root / "cache"
             get_dataset_index(record, cache_dir, embedding_model_path="model")
             payload = json.loads((cache_dir / "dataset_A.index.json").read_text(encoding="utf-8"))
-        self.assertEqual(payload["schema_version"], 3)
+        self.assertEqual(payload["schema_version"], 4)
         self.assertEqual(len(payload["entries"][0]["image_paths"]), 4)
 
     @patch("py.nodes.dataset_repository._load_embedding_model")
@@ -368,6 +650,201 @@ class DatasetRepositoryTests(unittest.TestCase):
         self.assertEqual(len(rebuilt.text_embeddings), 2)
         self.assertEqual(encode_text_batch.call_count, 2)
 
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._encode_image_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_embedding_precision_change_rebuilds_cache(self, resolve_device, encode_image_batch, encode_text_batch, load_model):
+        from py.nodes import dataset_repository
+
+        self.addCleanup(dataset_repository.configure_embedding_acceleration)
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            record = load_dataset_record(self.make_dataset(root))
+            cache_dir = root / "cache"
+            get_dataset_index(record, cache_dir, embedding_model_path="model")
+            get_dataset_index(record, cache_dir, embedding_model_path="model")
+            dataset_repository.configure_embedding_acceleration("bf16")
+            get_dataset_index(record, cache_dir, embedding_model_path="model")
+            payload = json.loads((cache_dir / "dataset_A.index.json").read_text(encoding="utf-8"))
+        self.assertEqual(encode_text_batch.call_count, 2)
+        self.assertEqual(payload["embedding_signature"], {"precision": "bf16", "runtime": "torch"})
+
+    @patch("py.nodes.dataset_repository._encode_text", return_value=[0.6, 0.8])
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[0.6, 0.8], [0.8, -0.6]])
+    @patch("py.nodes.dataset_repository._encode_image_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_quantized_embedding_storage_scores_and_reports(self, resolve_device, encode_image_batch, encode_text_batch, load_model, encode_text):
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            record = load_dataset_record(self.make_dataset(root))
+            cache_dir = root / "cache"
+            index = get_dataset_index(record, cache_dir, embedding_model_path="model", embedding_storage="int8")
+            payload = json.loads((cache_dir / "dataset_A.index.json").read_text(encoding="utf-8"))
+            cached = get_dataset_index(record, cache_dir, embedding_model_path="model", embedding_storage="int8")
+            rebuilt = get_dataset_index(record, cache_dir, embedding_model_path="model", embedding_storage="float16")
+            with self.assertRaises(DatasetError):
+                get_dataset_index(record, cache_dir, embedding_storage="int4")
+        self.assertEqual(index.text_embeddings.data.dtype.name, "int8")
+        self.assertEqual(rebuilt.text_embeddings.data.dtype.name, "float16")
+        self.assertEqual(encode_text_batch.call_count, 2)
+        self.assertEqual(payload["embedding_storage"], "int8")
+        self.assertEqual(cached.text_embeddings.tolist(), index.text_embeddings.tolist())
+        for left, right in zip(index.text_embeddings[0], [0.6, 0.8]):
+            self.assertAlmostEqual(left, right, delta=0.01)
+        scores = index.text_embeddings.scores([0.6, 0.8])
+        self.assertAlmostEqual(float(scores[0]), 1.0, delta=0.01)
+        self.assertAlmostEqual(float(scores[1]), 0.0, delta=0.01)
+        report = index.storage_report["text"]
+        self.assertEqual(report["storage"], "int8")
+        self.assertEqual(report["top1_agreement"], 1.0)
+        self.assertLess(report["bytes"], report["float32_bytes"])
+        _, debug = index.retrieve("红色", top_k=1)
+        self.assertEqual(debug["embedding_storage"], "int8")
+
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._encode_image_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_concurrent_index_builds_are_serialized_and_atomic(self, resolve_device, encode_image_batch, load_model):
+        import threading
+        import time
+
+        from py.nodes.dataset_repository import _index_cache_lock
+
+        def slow_encode(*args, **kwargs):
+            time.sleep(0.3)
+            return [[1.0, 0.0], [0.0, 1.0]]
+
+        with tempfile.TemporaryDirectory() as temp, patch(
+            "py.nodes.dataset_repository._encode_text_batch", side_effect=slow_encode
+        ) as encode_text_batch:
+            root = Path(temp)
+            record = load_dataset_record(self.make_dataset(root))
+            cache_dir = root / "cache"
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(get_dataset_index(record, cache_dir, embedding_model_path="model")))
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            leftovers = [path.name for path in cache_dir.iterdir() if path.suffix == ".tmp"]
+            with _index_cache_lock(cache_dir / "dataset_A.index.json"):
+                with self.assertRaises(DatasetError):
+                    get_dataset_index(record, cache_dir, embedding_model_path="other", lock_timeout=0.3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(encode_text_batch.call_count, 1)
+        self.assertEqual(leftovers, [])
+
+    @patch("py.nodes.dataset_repository._load_embedding_model")
+    @patch("py.nodes.dataset_repository._encode_text_batch", return_value=[[0.6, 0.8], [0.8, -0.6]])
+    @patch("py.nodes.dataset_repository._encode_image_batch", return_value=[[1.0, 0.0], [0.0, 1.0]])
+    @patch("py.nodes.dataset_repository._resolve_embedding_device", return_value="cpu")
+    def test_shared_embeddings_are_memory_mapped_from_one_file(self, resolve_device, encode_image_batch, encode_text_batch, load_model):
+        import numpy as np
+
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            record = load_dataset_record(self.make_dataset(root))
+            cache_dir = root / "cache"
+            plain = get_dataset_index(record, cache_dir, embedding_model_path="model", embedding_storage="int8")
+            shared = get_dataset_index(
+                record, cache_dir, embedding_model_path="model", embedding_storage="int8", shared_embeddings=True
+            )
+            payload = json.loads((cache_dir / "dataset_A.index.json").read_text(encoding="utf-8"))
+            attached = get_dataset_index(
+                record, cache_dir, embedding_model_path="model", embedding_storage="int8", shared_embeddings=True
+            )
+            copied = get_dataset_index(record, cache_dir, embedding_model_path="model", embedding_storage="int8")
+            blob_exists = (cache_dir / "dataset_A.embeddings.bin").is_file()
+            self.assertIsInstance(attached.text_embeddings.data, np.memmap)
+            self.assertFalse(attached.text_embeddings.data.flags.writeable)
+            self.assertEqual(attached.text_embeddings.tolist(), plain.text_embeddings.tolist())
+            self.assertEqual(attached.gray_embeddings[1], plain.gray_embeddings[1])
+            np.testing.assert_allclose(attached.text_embeddings.scores([0.6, 0.8]), plain.text_embeddings.scores([0.6, 0.8]))
+            self.assertFalse(copied.text_embeddings.shared)
+            self.assertEqual(copied.text_embeddings.tolist(), plain.text_embeddings.tolist())
+            del shared, attached
+        self.assertTrue(blob_exists)
+        self.assertEqual(encode_text_batch.call_count, 1)
+        self.assertEqual(payload["text_embeddings"], [])
+        self.assertEqual(payload["embedding_blob"]["file"], "dataset_A.embeddings.bin")
+
+    def test_index_cache_manager_tracks_and_evicts_entries(self):
+        from py.nodes.dataset_repository import collect_index_cache, index_cache_stats
+
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            record = load_dataset_record(self.make_dataset(root))
+            cache_dir = root / "cache"
+            get_dataset_index(record, cache_dir)
+            fingerprint = dataset_fingerprint(record)
+            (cache_dir / "renamed_dataset.index.json").write_text("{}", encoding="utf-8")
+            stats = index_cache_stats(cache_dir)
+            dry_run = collect_index_cache(cache_dir, active_names=["dataset_A"], dry_run=True)
+            files_after_dry_run = sorted(path.name for path in cache_dir.glob("*.index.json"))
+            stale = collect_index_cache(cache_dir, active_names=["dataset_A"])
+            kept = collect_index_cache(cache_dir, max_bytes=1, keep=["dataset_A"])
+            over_budget = collect_index_cache(cache_dir, max_bytes=1)
+            remaining = index_cache_stats(cache_dir)
+        entries = {entry["name"]: entry for entry in stats["entries"]}
+        self.assertEqual(entries["dataset_A"]["fingerprint"], fingerprint)
+        self.assertIsNotNone(entries["dataset_A"]["last_used"])
+        self.assertIsNone(entries["renamed_dataset"]["last_used"])
+        self.assertEqual(stats["total_bytes"], sum(entry["bytes"] for entry in stats["entries"]))
+        self.assertEqual([item["name"] for item in dry_run["evicted"]], ["renamed_dataset"])
+        self.assertEqual(files_after_dry_run, ["dataset_A.index.json", "renamed_dataset.index.json"])
+        self.assertEqual([item["reason"] for item in stale["evicted"]], ["stale"])
+        self.assertEqual(kept["evicted"], [])
+        self.assertEqual([item["reason"] for item in over_budget["evicted"]], ["over_budget"])
+        self.assertEqual(remaining["entries"], [])
+
+    def test_dataset_listing_reads_only_headers(self):
+        import py.nodes.qwen35_dataset_rag_nodes as module
+        from py.nodes import dataset_repository
+        from py.nodes.dataset_repository import list_dataset_headers
+
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            self.make_dataset(root)
+            broken = root / "broken"
+            broken.mkdir()
+            (broken / "dataset.json").write_text("{}", encoding="utf-8")
+            with patch.object(dataset_repository, "load_dataset_record") as load, patch.object(
+                dataset_repository, "_caption_for_image"
+            ) as read_caption:
+                headers, errors = list_dataset_headers(root)
+            load.assert_not_called()
+            read_caption.assert_not_called()
+            with patch.object(module, "_dataset_root", return_value=root):
+                options = module._dataset_options()
+                record = module._selected_record("dataset_A")
+        self.assertEqual(list(headers), ["dataset_A"])
+        self.assertEqual(headers["dataset_A"]["version"], "1.0")
+        self.assertTrue(any("dataset_name" in error for error in errors))
+        self.assertEqual(options, ["dataset_A"])
+        self.assertEqual(len(record.entries), 2)
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "symlinks are not available")
+    def test_dataset_listing_survives_symlink_cycles(self):
+        from py.nodes.dataset_repository import list_dataset_headers
+
+        with tempfile.TemporaryDirectory() as temp:
+            root = Path(temp)
+            self.make_dataset(root)
+            nested = root / "nested"
+            nested.mkdir()
+            try:
+                os.symlink(root, nested / "loop", target_is_directory=True)
+            except OSError as exc:
+                self.skipTest(f"cannot create symlinks: {exc}")
+            headers, errors = list_dataset_headers(root)
+        self.assertEqual(list(headers), ["dataset_A"])
+        self.assertEqual(errors, [])
+
     def test_discovery_skips_index_cache_json(self):
         with tempfile.TemporaryDirectory() as temp:
             root = Path(temp)
@@ -403,6 +880,141 @@ class DatasetRepositoryTests(unittest.TestCase):
             self.assertTrue(any("Duplicate dataset_name" in error for error in errors))
 
 
+@unittest.skipUnless(
+    importlib.util.find_spec("torch") and importlib.util.find_spec("transformers"),
+    "torch and transformers are required for embedding model tests",
+)
+class EmbeddingAccelerationTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import torch
+        from transformers import (
+            BertTokenizer,
+            ChineseCLIPConfig,
+            ChineseCLIPImageProcessor,
+            ChineseCLIPModel,
+            ChineseCLIPProcessor,
+        )
+
+        cls.temp = tempfile.TemporaryDirectory()
+        # Subdirectory so the ONNX export written next to the model stays inside the temp dir.
+        cls.model_path = str(Path(cls.temp.name) / "chinese-clip")
+        Path(cls.model_path).mkdir()
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "红", "蓝", "色", "产", "品"]
+        vocab_file = Path(cls.model_path) / "vocab.txt"
+        vocab_file.write_text("\n".join(vocab), encoding="utf-8")
+        image_processor = ChineseCLIPImageProcessor(
+            size={"shortest_edge": 32}, crop_size={"height": 32, "width": 32}
+        )
+        ChineseCLIPProcessor(image_processor=image_processor, tokenizer=BertTokenizer(str(vocab_file))).save_pretrained(
+            cls.model_path
+        )
+        torch.manual_seed(0)
+        layer = {"hidden_size": 32, "num_hidden_layers": 1, "num_attention_heads": 2, "intermediate_size": 37}
+        config = ChineseCLIPConfig(
+            text_config={"vocab_size": len(vocab), **layer},
+            vision_config={"image_size": 32, "patch_size": 8, **layer},
+            projection_dim=16,
+        )
+        ChineseCLIPModel(config).save_pretrained(cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp.cleanup()
+
+    def tearDown(self):
+        from py.nodes import dataset_repository
+
+        dataset_repository.configure_embedding_acceleration()
+        dataset_repository._EMBEDDING_MODELS.clear()
+
+    def encode(self):
+        from py.nodes.dataset_repository import _encode_image_batch, _encode_text_batch
+
+        images = [Image.new("RGB", (40, 40), (200, 10, 10)), Image.new("RGB", (40, 40), (10, 10, 200))]
+        return (
+            _encode_text_batch(self.model_path, ["红色产品", "蓝色"], "cpu", 2)
+            + _encode_image_batch(self.model_path, images, "cpu", 2, grayscale=False)
+            + _encode_image_batch(self.model_path, images, "cpu", 2, grayscale=True)
+        )
+
+    def assert_cosine_agreement(self, expected, actual, minimum):
+        for left, right in zip(expected, actual):
+            self.assertGreater(sum(a * b for a, b in zip(left, right)), minimum)
+
+    def test_bf16_cpu_embeddings_agree_with_float32(self):
+        import torch
+        from py.nodes import dataset_repository
+
+        reference = self.encode()
+        dataset_repository.configure_embedding_acceleration("bf16", num_threads=2)
+        previous_threads = torch.get_num_threads()
+        with patch.object(dataset_repository, "_cpu_supports_bf16", return_value=True):
+            reduced = self.encode()
+        _, model = dataset_repository._load_embedding_model(self.model_path, "cpu")
+        self.assertEqual(model.dtype, torch.bfloat16)
+        self.assertEqual(torch.get_num_threads(), previous_threads)
+        self.assert_cosine_agreement(reference, reduced, 0.99)
+
+    def test_precision_falls_back_to_float32_when_unsupported(self):
+        import torch
+        from py.nodes import dataset_repository
+
+        with patch.object(dataset_repository, "_cpu_supports_bf16", return_value=False):
+            self.assertEqual(dataset_repository._embedding_torch_dtype("auto", "cpu"), torch.float32)
+        self.assertEqual(dataset_repository._embedding_torch_dtype("fp16", "cpu"), torch.float32)
+        self.assertEqual(dataset_repository._embedding_torch_dtype("auto", "cuda"), torch.float16)
+        with self.assertRaisesRegex(DatasetError, "Unsupported embedding precision"):
+            dataset_repository.configure_embedding_acceleration("int4")
+
+    def test_compiled_feature_functions_agree_with_eager(self):
+        import torch
+        from py.nodes import dataset_repository
+
+        reference = self.encode()
+        compiled = []
+
+        def fake_compile(method, **kwargs):
+            compiled.append(method.__name__)
+            return method
+
+        dataset_repository.configure_embedding_acceleration(compile_model=True)
+        with patch.object(torch, "compile", side_effect=fake_compile):
+            accelerated = self.encode()
+        self.assertEqual(compiled, ["get_text_features", "get_image_features"])
+        self.assert_cosine_agreement(reference, accelerated, 0.9999)
+
+    def test_onnx_runtime_falls_back_to_torch_without_onnxruntime(self):
+        import sys
+        from py.nodes import dataset_repository
+
+        reference = self.encode()
+        dataset_repository.configure_embedding_acceleration(runtime="onnx")
+        with patch.dict(sys.modules, {"onnxruntime": None}):
+            fallback = self.encode()
+        _, model = dataset_repository._load_embedding_model(self.model_path, "cpu")
+        self.assertNotIsInstance(model, dataset_repository._OnnxEmbeddingModel)
+        self.assertIn("onnxruntime is not installed", dataset_repository._EMBEDDING_RUNTIME_NOTES[self.model_path])
+        self.assertEqual(reference, fallback)
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("onnx") and importlib.util.find_spec("onnxruntime"),
+        "onnx and onnxruntime are required for the ONNX export test",
+    )
+    def test_onnx_export_is_cached_and_agrees_with_torch(self):
+        from py.nodes import dataset_repository
+
+        reference = self.encode()
+        dataset_repository.configure_embedding_acceleration(runtime="onnx")
+        onnx_vectors = self.encode()
+        _, model = dataset_repository._load_embedding_model(self.model_path, "cpu")
+        self.assertIsInstance(model, dataset_repository._OnnxEmbeddingModel)
+        self.assert_cosine_agreement(reference, onnx_vectors, 0.9999)
+        with patch("torch.onnx.export") as export:
+            dataset_repository.export_embedding_onnx(self.model_path)
+        export.assert_not_called()
+
+
 class BackendRequestTests(unittest.TestCase):
     @patch("py.nodes.llm_backends._request_json")
     def test_ollama_payload_supports_image_seed_and_keep_alive(self, request_json):
@@ -493,6 +1105,105 @@ class BackendRequestTests(unittest.TestCase):
         self.assertEqual(sum(item["type"] == "image_url" for item in content), 4)
 
 
+    @patch("py.nodes.llm_backends._request_json")
+    def test_greedy_backend_responses_are_cached_on_disk(self, request_json):
+        import py.nodes.response_cache as response_cache
+        from py.nodes.llm_backends import generate_with_backend
+
+        request_json.return_value = {"message": {"content": "cached prompt"}}
+        kwargs = dict(
+            backend="Ollama",
+            model="qwen3.5:122b",
+            base_url="http://127.0.0.1:11434",
+            prompt="generate",
+            images=[Image.new("RGB", (4, 4), "red")],
+            max_tokens=64,
+            temperature=0.0,
+            top_p=1.0,
+            repetition_penalty=1.0,
+            seed=3,
+            timeout=10,
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = response_cache.ResponseCache(Path(tmp) / "responses.sqlite3")
+            with patch.object(response_cache, "_ENABLED", True), patch.object(response_cache, "_SHARED_CACHE", cache):
+                self.assertEqual(generate_with_backend(**kwargs), "cached prompt")
+                self.assertEqual(generate_with_backend(**kwargs), "cached prompt")
+                self.assertEqual(request_json.call_count, 1)
+
+                generate_with_backend(**dict(kwargs, images=[Image.new("RGB", (4, 4), "blue")]))
+                generate_with_backend(**dict(kwargs, temperature=0.4))
+                generate_with_backend(**dict(kwargs, use_response_cache=False))
+                self.assertEqual(request_json.call_count, 4)
+                self.assertEqual(cache.stats()["entries"], 2)
+            cache.close()
+
+    def test_response_cache_enforces_ttl_and_size_limits(self):
+        from py.nodes.response_cache import ResponseCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(Path(tmp) / "responses.sqlite3", max_entries=2)
+            for index in range(3):
+                cache.put(f"key{index}", f"text{index}")
+            self.assertIsNone(cache.get("key0"))
+            self.assertEqual(cache.get("key2"), "text2")
+            cache.close()
+
+            cache = ResponseCache(Path(tmp) / "bytes.sqlite3", max_bytes=10)
+            cache.put("a", "12345")
+            cache.put("b", "67890")
+            cache.get("a")
+            cache.put("c", "abcde")
+            self.assertEqual(cache.get("a"), "12345")
+            self.assertIsNone(cache.get("b"))
+            cache.close()
+
+            cache = ResponseCache(Path(tmp) / "ttl.sqlite3", ttl_seconds=60)
+            cache.put("old", "text")
+            with patch("py.nodes.response_cache.time.time", return_value=time.time() + 120):
+                self.assertIsNone(cache.get("old"))
+            self.assertEqual(cache.stats()["entries"], 0)
+            cache.close()
+
+    def test_stop_rules_trim_visible_text(self):
+        from py.nodes.generation_stops import apply_stop_rules, stop_offset
+
+        reply = '<think>draft {"x": 1}</think>```json\n{"prompt": "黑色 {座椅}", "n": "a\\"}"} trailing'
+        self.assertEqual(apply_stop_rules(reply, stop_on_json=True), '```json\n{"prompt": "黑色 {座椅}", "n": "a\\"}"}')
+        self.assertEqual(stop_offset('{"prompt": "unfinished', stop_on_json=True), -1)
+        self.assertEqual(stop_offset("plain prompt {not json}", stop_on_json=True), -1)
+        self.assertEqual(apply_stop_rules("第一句。第二句！第三句。", max_sentences=2), "第一句。第二句！")
+        self.assertEqual(stop_offset("Costs 1.5 dollars", max_sentences=1), -1)
+        self.assertEqual(apply_stop_rules("One. Two. Three.", max_sentences=2, stop_strings=["Three"]), "One. Two.")
+        self.assertEqual(apply_stop_rules("prompt text\n###\nnotes", stop_strings=["###"]), "prompt text")
+
+    @patch("py.nodes.llm_backends._request_json")
+    def test_remote_backends_forward_stop_strings_and_trim_json(self, request_json):
+        from py.nodes.llm_backends import generate_with_backend
+
+        request_json.return_value = {"message": {"content": '{"prompt": "越野内饰"} extra commentary'}}
+        kwargs = dict(
+            model="qwen3.5:122b",
+            prompt="generate",
+            images=None,
+            max_tokens=64,
+            temperature=0.2,
+            top_p=1.0,
+            repetition_penalty=1.0,
+            seed=1,
+            timeout=10,
+            stop_strings=["</answer>"],
+            stop_on_json=True,
+        )
+        output = generate_with_backend(backend="Ollama", base_url="http://127.0.0.1:11434", **kwargs)
+        self.assertEqual(output, '{"prompt": "越野内饰"}')
+        self.assertEqual(request_json.call_args.args[1]["options"]["stop"], ["</answer>"])
+
+        request_json.return_value = {"choices": [{"message": {"content": "plain prompt"}}]}
+        output = generate_with_backend(backend="vLLM", base_url="http://127.0.0.1:8000/v1", **kwargs)
+        self.assertEqual(output, "plain prompt")
+        self.assertEqual(request_json.call_args.args[1]["stop"], ["</answer>"])
+
 class NodeBehaviorTests(unittest.TestCase):
     def test_dataset_nodes_import_without_torch_and_expose_split_contract(self):
         import py.nodes.qwen35_dataset_rag_nodes as module
@@ -505,11 +1216,74 @@ class NodeBehaviorTests(unittest.TestCase):
         self.assertEqual(len(picker.RETURN_TYPES), 4)
         generator = module.DatasetRAGPromptGeneratorNode()
         self.assertEqual(generator.RETURN_NAMES, ("prompt", "retrieved_captions", "retrieval_debug", "dataset_metadata"))
-        self.assertEqual(set(generator.INPUT_TYPES()["optional"]), {"image", "image_2", "image_3", "image_4"})
+        self.assertEqual(
+            set(generator.INPUT_TYPES()["optional"]),
+            {"image", "image_2", "image_3", "image_4", "additional_datasets", "bypass_response_cache"},
+        )
         required = generator.INPUT_TYPES()["required"]
         self.assertIn("exploration_strength", required)
         self.assertIn("variation_seed", required)
 
+    def test_qwen_nodes_register_without_importing_runtime_stack(self):
+        code = (
+            "import sys\n"
+            "import py.nodes.qwen35_nodes as nodes\n"
+            "import py.nodes.qwen35_dataset_rag_nodes\n"
+            "print(len(nodes.NODE_CLASS_MAPPINGS))\n"
+            "print(sorted(m for m in ('transformers', 'modelscope', 'py.nodes.qwen35_runtime') if m in sys.modules))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=str(Path(__file__).resolve().parents[1]),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        registered, heavy = result.stdout.strip().splitlines()[-2:]
+        self.assertEqual(registered, "6")
+        self.assertEqual(heavy, "[]")
+
+    def test_dataset_api_routes_register_at_import(self):
+        # Fake aiohttp/ComfyUI server modules; the routes must exist before any INPUT_TYPES call.
+        code = (
+            "import sys, types\n"
+            "paths = []\n"
+            "class Routes:\n"
+            "    def get(self, path):\n"
+            "        paths.append(path)\n"
+            "        return lambda handler: handler\n"
+            "    post = get\n"
+            "aiohttp = types.ModuleType('aiohttp')\n"
+            "aiohttp.web = types.SimpleNamespace()\n"
+            "server = types.ModuleType('server')\n"
+            "server.PromptServer = types.SimpleNamespace(instance=types.SimpleNamespace(routes=Routes()))\n"
+            "sys.modules.update(aiohttp=aiohttp, server=server)\n"
+            "import py.nodes.qwen35_dataset_rag_nodes\n"
+            "print(sorted(paths))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=str(Path(__file__).resolve().parents[1]),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(
+            result.stdout.strip().splitlines()[-1],
+            "['/iat/datasets/index_cache', '/iat/datasets/index_cache/gc']",
+        )
+
+    def test_preload_node_forwards_resolved_variant_to_runtime(self):
+        import py.nodes.qwen35_nodes as nodes
+
+        node = nodes.QwenPreloadModelNode()
+        self.assertTrue(node.OUTPUT_NODE)
+        self.assertEqual(node.INPUT_TYPES()["required"]["mode"][0], ["text", "vl"])
+        with patch.object(nodes, "preload_model") as preload_model:
+            output = node.preload("Qwen3.5-9B", "vl", "cuda", "SDPA")
+        self.assertEqual(output, ("Qwen3.5-9B",))
+        preload_model.assert_called_once_with(variant="Qwen3.5-9B", mode="vl", device="cuda", attention_backend="SDPA")
+
     def test_prompt_sanitizer_extracts_plain_prompt_from_model_wrappers(self):
         from py.nodes.qwen35_dataset_rag_nodes import _sanitize_prompt
 
@@ -629,7 +1403,7 @@ class NodeBehaviorTests(unittest.TestCase):
             "timeout_seconds": 10,
         }
         with patch.object(module, "_selected_record", return_value=record), patch.object(
-            module, "dataset_fingerprint", return_value="fingerprint"
+            module, "dataset_fingerprints", return_value=_FINGERPRINTS
         ), patch.object(module, "get_dataset_index", return_value=index_value), patch.object(
             module, "generate_with_backend", return_value="黑色系 trigger_a 越野内饰"
         ) as generate:
@@ -649,7 +1423,7 @@ class NodeBehaviorTests(unittest.TestCase):
         variation_kwargs = dict(kwargs)
         variation_kwargs["variation_seed"] = 10
         with patch.object(module, "_selected_record", return_value=record), patch.object(
-            module, "dataset_fingerprint", return_value="fingerprint"
+            module, "dataset_fingerprints", return_value=_FINGERPRINTS
         ), patch.object(module, "get_dataset_index", return_value=index_value), patch.object(
             module, "generate_with_backend", return_value="黑色系 trigger_a 越野内饰"
         ):
@@ -658,6 +1432,75 @@ class NodeBehaviorTests(unittest.TestCase):
         self.assertNotEqual(debug["composition_seed"], variation_debug["composition_seed"])
         self.assertEqual(debug["generation_seed"], variation_debug["generation_seed"])
 
+    def test_generator_federates_additional_datasets(self):
+        import py.nodes.qwen35_dataset_rag_nodes as module
+        from py.nodes.dataset_repository import DatasetEntry, DatasetRecord
+
+        records = {
+            name: DatasetRecord(
+                dataset_name=name,
+                version="1.0",
+                base_model="Flux.2 Klein 9B",
+                lora_name=name,
+                language="zh",
+                trigger_words=[f"trigger_{name}"],
+                entries=[DatasetEntry(f"{name}_0001", f"黑色越野座椅 {name}")],
+                source_path=Path(f"{name}.json"),
+            )
+            for name in ("a", "b")
+        }
+        self.assertEqual(module._parse_additional_datasets("b:0.5, c，a:2", "a"), [("b", 0.5), ("c", 1.0)])
+        with self.assertRaises(DatasetError):
+            module._parse_additional_datasets("b:heavy")
+        with patch.object(module, "_selected_record", side_effect=lambda name: records[name]), patch.object(
+            module, "dataset_fingerprints", side_effect=lambda record: {**_FINGERPRINTS, "dataset": record.dataset_name}
+        ), patch.object(
+            module, "get_dataset_index", side_effect=lambda record, *args, **kwargs: DatasetIndex(record, record.dataset_name)
+        ), patch.object(module, "generate_with_backend", return_value="黑色系 越野内饰") as generate:
+            output = module.DatasetRAGPromptGeneratorNode().generate_prompt(
+                "黑色系越野内饰", "a", "Ollama", "", "", 1, 1, 4, False, "", 128, 0.0, 1.0, 1.05, 10,
+                additional_datasets="b:0.5",
+            )
+        retrieved = json.loads(output[1])
+        self.assertEqual({item["dataset_name"] for item in retrieved}, {"a", "b"})
+        self.assertIn("trigger_a", output[0])
+        self.assertIn("trigger_b", output[0])
+        self.assertIn("trigger_b", generate.call_args.kwargs["prompt"])
+        self.assertEqual(json.loads(output[3])["additional_datasets"][0]["dataset_name"], "b")
+
+    def test_generation_only_changes_reuse_cached_retrieval(self):
+        import py.nodes.qwen35_dataset_rag_nodes as module
+        from py.nodes.dataset_repository import DatasetEntry, DatasetRecord
+
+        record = DatasetRecord(
+            dataset_name="dataset_A",
+            version="1.0",
+            base_model="Flux.2 Klein 9B",
+            lora_name="model_A",
+            language="zh",
+            trigger_words=["trigger_a"],
+            entries=[DatasetEntry("0001", "黑色越野座椅主面麂皮"), DatasetEntry("0002", "棕色中控台")],
+            source_path=Path("dataset.json"),
+        )
+        index_value = DatasetIndex(record, "fingerprint")
+        module._RETRIEVAL_CACHE.clear()
+        with patch.object(module, "_selected_record", return_value=record), patch.object(
+            module, "dataset_fingerprints", return_value=_FINGERPRINTS
+        ), patch.object(module, "get_dataset_index", return_value=index_value) as get_index, patch.object(
+            module, "generate_with_backend", return_value="黑色系 trigger_a 越野内饰"
+        ), patch.object(index_value, "retrieve", wraps=index_value.retrieve) as retrieve:
+            node = module.DatasetRAGPromptGeneratorNode()
+            first = node.generate_prompt("黑色系越野内饰", "dataset_A", "Ollama", "", "", 1, 1, 2, False, "", 128, 0.0, 1.0, 1.05, 10)
+            swept = node.generate_prompt("黑色系越野内饰", "dataset_A", "Ollama", "", "", 1, 2, 2, False, "", 128, 0.4, 1.0, 1.05, 10)
+            self.assertEqual(retrieve.call_count, 1)
+            # A hit is resolved from fingerprints alone; the index is not loaded again.
+            self.assertEqual(get_index.call_count, 1)
+            node.generate_prompt("黑色系越野内饰", "dataset_A", "Ollama", "", "", 2, 1, 2, False, "", 128, 0.0, 1.0, 1.05, 10)
+            self.assertEqual(retrieve.call_count, 2)
+        self.assertEqual(first[1], swept[1])
+        self.assertNotEqual(json.loads(swept[2])["generation_seed"], json.loads(first[2])["generation_seed"])
+        self.assertEqual(module.retrieval_cache_info()["size"], 2)
+
     def test_generator_repairs_missing_hard_color_family(self):
         import py.nodes.qwen35_dataset_rag_nodes as module
         from py.nodes.dataset_repository import DatasetEntry, DatasetRecord
@@ -673,7 +1516,7 @@ class NodeBehaviorTests(unittest.TestCase):
             source_path=Path("dataset.json"),
         )
         with patch.object(module, "_selected_record", return_value=record), patch.object(
-            module, "dataset_fingerprint", return_value="fingerprint"
+            module, "dataset_fingerprints", return_value=_FINGERPRINTS
         ), patch.object(module, "get_dataset_index", return_value=DatasetIndex(record, "fingerprint")), patch.object(
             module, "generate_with_backend", return_value="trigger_a brown leather"
         ):
@@ -714,7 +1557,7 @@ class NodeBehaviorTests(unittest.TestCase):
             source_path=Path("dataset.json"),
         )
         with patch.object(module, "_selected_record", return_value=record), patch.object(
-            module, "dataset_fingerprint", return_value="fingerprint"
+            module, "dataset_fingerprints", return_value=_FINGERPRINTS
         ), patch.object(module, "get_dataset_index", return_value=DatasetIndex(record, "fingerprint")), patch.object(
             module, "generate_with_backend", return_value="   "
         ), self.assertRaisesRegex(RuntimeError, "empty prompt"):
@@ -778,8 +1621,10 @@ class NodeBehaviorTests(unittest.TestCase):
 
         with tempfile.TemporaryDirectory() as temp:
             helper = DatasetRepositoryTests()
-            record = load_dataset_record(helper.make_dataset(Path(temp)))
-            with patch.object(module, "_discover", return_value=({"dataset_A": record}, ["bad other dataset"])):
+            dataset = helper.make_dataset(Path(temp))
+            record = load_dataset_record(dataset)
+            headers = {"dataset_A": {"dataset_name": "dataset_A", "version": "1.0", "path": dataset}}
+            with patch.object(module, "_list_datasets", return_value=(headers, ["bad other dataset"])):
                 result = module.DatasetCaptionPickerNode().pick_caption("dataset_A", "By Index", 0, 0)
         self.assertEqual(result[1], 0)
         self.assertEqual(result[0], record.entries[0].caption)
@@ -792,10 +1637,22 @@ class NodeBehaviorTests(unittest.TestCase):
             generator.generate_prompt(
                 "", "dataset_A", "Ollama", "", "", 1, 1, 4, False, "", 128, 0.0, 1.0, 1.05, 10
             )
-        with patch.object(module, "_discover", return_value=({}, ["invalid metadata"])):
+        with patch.object(module, "_list_datasets", return_value=({}, ["invalid metadata"])):
             with self.assertRaises(DatasetError):
                 module.DatasetCaptionPickerNode().pick_caption("missing", "Random", 1, 0)
 
+    def test_embedding_acceleration_is_configured_once(self):
+        import py.nodes.qwen35_dataset_rag_nodes as module
+
+        with patch.object(module, "_EMBEDDING_ACCELERATION_APPLIED", False), patch.object(
+            module, "configure_embedding_acceleration", side_effect=[DatasetError("bad precision"), None]
+        ) as configure:
+            with self.assertRaises(DatasetError):
+                module._apply_embedding_acceleration()
+            module._apply_embedding_acceleration()
+            module._apply_embedding_acceleration()
+        self.assertEqual(configure.call_count, 2)
+
     def test_is_changed_tracks_caption_edits(self):
         import py.nodes.qwen35_dataset_rag_nodes as module
 
@@ -811,5 +1668,461 @@ class NodeBehaviorTests(unittest.TestCase):
         self.assertEqual(after, generator_after)
 
 
+
+@unittest.skipUnless(
+    importlib.util.find_spec("torch") and importlib.util.find_spec("transformers"),
+    "torch and transformers are required for Qwen runtime tests",
+)
+class QwenRuntimeTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import types
+
+        if "folder_paths" not in sys.modules and importlib.util.find_spec("folder_paths") is None:
+            # Outside ComfyUI; the runtime only reads folder_paths when resolving model directories.
+            sys.modules["folder_paths"] = types.ModuleType("folder_paths")
+        from py.nodes import qwen35_runtime
+
+        cls.runtime = qwen35_runtime
+
+    def test_resolved_model_dir_is_cached_until_a_weight_file_changes(self):
+        runtime = self.runtime
+        with tempfile.TemporaryDirectory() as temp:
+            model_dir = Path(temp)
+            shard = model_dir / "model-00001-of-00001.safetensors"
+            shard.write_bytes(b"weights")
+            with patch.dict(runtime._RESOLVED_MODEL_DIRS, clear=True), patch.object(
+                runtime, "_resolve_model_dir", return_value=(model_dir, True)
+            ) as resolve:
+                first = runtime.ensure_model("0.8B", "text")
+                hit = runtime.ensure_model("0.8B", "text")
+                # Same size, rewritten in place: the directory mtime does not move.
+                dir_mtime = os.stat(model_dir).st_mtime_ns
+                shard.write_bytes(b"WEIGHTS")
+                os.utime(shard, ns=(time.time_ns(), os.stat(shard).st_mtime_ns + 1_000_000))
+                os.utime(model_dir, ns=(dir_mtime, dir_mtime))
+                replaced = runtime.ensure_model("0.8B", "text")
+                (model_dir / "model-00002-of-00002.safetensors").write_bytes(b"more")
+                added = runtime.ensure_model("0.8B", "text")
+        self.assertEqual({first, hit, replaced, added}, {model_dir})
+        self.assertEqual(resolve.call_count, 3)
+
+    def test_incomplete_model_dir_is_not_cached(self):
+        runtime = self.runtime
+        with tempfile.TemporaryDirectory() as temp, patch.dict(runtime._RESOLVED_MODEL_DIRS, clear=True), patch.object(
+            runtime, "_resolve_model_dir", return_value=(Path(temp), False)
+        ) as resolve:
+            runtime.ensure_model("0.8B", "text")
+            runtime.ensure_model("0.8B", "text")
+        self.assertEqual(resolve.call_count, 2)
+
+    def test_draft_variant_must_be_a_smaller_known_text_model(self):
+        runtime = self.runtime
+        with patch.object(runtime, "_log_warning") as warn:
+            unknown = runtime._resolve_draft_variant("Qwen3.5-9B", "Qwen3.5-1B")
+        self.assertEqual(unknown, "")
+        warn.assert_called_once()
+        self.assertEqual(runtime._resolve_draft_variant("Qwen3.5-2B", "Qwen3.5-4B"), "")
+        self.assertEqual(runtime._resolve_draft_variant("Qwen3.5-2B", "Qwen3.5-2B"), "")
+        self.assertEqual(runtime._resolve_draft_variant("Qwen3.5-9B", ""), "")
+        self.assertEqual(runtime._resolve_draft_variant("Qwen3.5-9B", "Qwen3.5-0.8B"), "Qwen3.5-0.8B")
+
+    def test_speculative_stats_count_accepted_draft_tokens(self):
+        runtime = self.runtime
+        with patch.dict(
+            runtime._SPECULATIVE_STATS,
+            {"generations": 0, "new_tokens": 0, "target_forward_passes": 0, "draft_forward_passes": 0, "accepted_tokens": 0, "last": None},
+        ):
+            last = runtime._record_speculative_stats("Qwen3.5-0.8B", 10, {"target": 4, "draft": 8})
+            runtime._record_speculative_stats("Qwen3.5-0.8B", 5, {"target": 5, "draft": 0})
+            totals = runtime.get_speculative_decoding_stats()
+        self.assertEqual(last["accepted_tokens"], 6)
+        self.assertEqual(last["acceptance_rate"], 0.75)
+        self.assertEqual(last["tokens_per_target_pass"], 2.5)
+        self.assertEqual(totals["generations"], 2)
+        self.assertEqual(totals["accepted_tokens"], 6)
+        self.assertEqual(totals["tokens_per_target_pass"], round(15 / 9, 3))
+        self.assertEqual(totals["last"]["accepted_tokens"], 0)
+
+    def test_speculative_fallback_only_retries_unsupported_assisted_generation(self):
+        import torch
+
+        runtime = self.runtime
+
+        class Tokenizer:
+            eos_token_id = 0
+
+            def __call__(self, prompts, return_tensors=None):
+                return {"input_ids": torch.tensor([[1, 2]])}
+
+            def decode(self, ids, skip_special_tokens=True):
+                return " ".join(str(int(item)) for item in ids)
+
+        class Model(torch.nn.Module):
+            def __init__(self, error):
+                super().__init__()
+                self.error = error
+                self.calls = []
+
+            def generate(self, **kwargs):
+                self.calls.append("assistant_model" in kwargs)
+                if "assistant_model" in kwargs:
+                    raise self.error
+                return torch.tensor([[1, 2, 7]])
+
+        kwargs = dict(
+            variant="Qwen3.5-9B", device="cpu", attention_backend=None, messages=[], max_tokens=4,
+            temperature=0.0, top_p=1.0, repetition_penalty=1.0, seed=0,
+        )
+        unsupported = Model(ValueError("assisted generate is only supported for batch_size = 1"))
+        out_of_memory = Model(RuntimeError("CUDA out of memory"))
+        for model in (unsupported, out_of_memory):
+            with patch.object(runtime, "load_text_model", return_value=(model, Tokenizer(), "cpu")), patch.object(
+                runtime, "apply_chat_template", return_value="prompt"
+            ), patch.object(runtime, "_speculative_draft_model", return_value=torch.nn.Identity()), patch.object(
+                runtime, "_log_warning"
+            ):
+                if model is unsupported:
+                    self.assertEqual(runtime._generate_text(**kwargs), "7")
+                else:
+                    with self.assertRaisesRegex(RuntimeError, "out of memory"):
+                        runtime._generate_text(**kwargs)
+        self.assertEqual(unsupported.calls, [True, False])
+        self.assertEqual(out_of_memory.calls, [True])
+
+    def test_stateful_qwen35_target_skips_the_draft_model(self):
+        import torch
+        from tokenizers import Tokenizer, models, pre_tokenizers
+        from transformers import PreTrainedTokenizerFast
+        from transformers.models.qwen3_5 import Qwen3_5ForCausalLM, Qwen3_5TextConfig
+
+        runtime = self.runtime
+        words = ["<unk>", "<eos>", "user", "assistant"] + [f"w{i}" for i in range(60)]
+        backend = Tokenizer(models.WordLevel({word: idx for idx, word in enumerate(words)}, unk_token="<unk>"))
+        backend.pre_tokenizer = pre_tokenizers.Whitespace()
+        tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", eos_token="<eos>", pad_token="<eos>")
+        torch.manual_seed(0)
+        model = Qwen3_5ForCausalLM(
+            Qwen3_5TextConfig(
+                vocab_size=len(words), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                num_attention_heads=4, num_key_value_heads=2, head_dim=16, linear_key_head_dim=16,
+                linear_value_head_dim=16, linear_num_key_heads=2, linear_num_value_heads=4,
+                layer_types=["linear_attention", "full_attention"], eos_token_id=1, pad_token_id=1,
+            )
+        ).eval()
+        self.assertTrue(model._is_stateful)
+        kwargs = dict(
+            variant="Qwen3.5-9B", device="cpu", attention_backend=None, messages=[], max_tokens=4,
+            temperature=0.0, top_p=1.0, repetition_penalty=1.0, seed=0, draft_variant="Qwen3.5-0.8B",
+        )
+        with patch.object(runtime, "load_text_model", return_value=(model, tokenizer, "cpu")), patch.object(
+            runtime, "apply_chat_template", return_value="user w1 w2 assistant"
+        ), patch.object(runtime, "load_draft_model") as load_draft, patch.object(
+            runtime, "_STATEFUL_DRAFT_WARNED", []
+        ), patch.object(runtime, "_log_warning") as warn, patch.object(
+            runtime, "_record_speculative_stats"
+        ) as record:
+            first = runtime._generate_text(**kwargs)
+            second = runtime._generate_text(**kwargs)
+        self.assertEqual(first, second)
+        load_draft.assert_not_called()
+        record.assert_not_called()
+        warn.assert_called_once()
+
+    def test_stopping_criteria_decode_only_new_tokens(self):
+        import torch
+
+        from py.nodes.generation_stops import stop_rules
+
+        runtime = self.runtime
+
+        class ByteTokenizer:
+            # Byte-level like Qwen's BPE: a CJK character spans several tokens.
+            def __init__(self):
+                self.decoded_tokens = 0
+
+            def decode(self, ids, skip_special_tokens=True):
+                self.decoded_tokens += len(ids)
+                return bytes(int(item) for item in ids).decode("utf-8", errors="replace")
+
+        tokenizer = ByteTokenizer()
+        prompt = [1, 2, 3]
+        generated = list("<think>先想。</think>第一句。第二句。".encode("utf-8"))
+        criteria = runtime._VisibleTextStoppingCriteria(tokenizer, len(prompt), stop_rules(max_sentences=1))
+        stopped_at = None
+        for length in range(1, len(generated) + 1):
+            if criteria(torch.tensor([prompt + generated[:length]]), None)[0]:
+                stopped_at = length
+                break
+        expected = len("<think>先想。</think>第一句。".encode("utf-8"))
+        self.assertEqual(stopped_at, expected)
+        self.assertLess(tokenizer.decoded_tokens, 2 * expected)
+        # A restarted generation (shorter sequence) starts from scratch.
+        self.assertFalse(criteria(torch.tensor([prompt + generated[:3]]), None)[0])
+
+    def test_cpu_affinity_spec_parsing(self):
+        runtime = self.runtime
+        with patch.object(runtime, "_log_warning") as warn:
+            self.assertEqual(runtime._parse_cpu_affinity("0-2, 5"), {0, 1, 2, 5})
+            self.assertEqual(runtime._parse_cpu_affinity("3-1,1"), {1, 2, 3})
+            self.assertEqual(runtime._parse_cpu_affinity(""), set())
+            self.assertEqual(runtime._parse_cpu_affinity("x,4"), {4})
+        warn.assert_called_once()
+
+    def test_configure_cpu_mode_overrides_only_given_settings(self):
+        runtime = self.runtime
+        with patch.dict(runtime._CPU_MODE, {"threads": 0, "affinity": "", "bf16_autocast": False, "quantize_int8": False}):
+            mode = runtime.configure_cpu_mode(threads=-3, affinity=" 0-3 ", quantize_int8=True)
+            unchanged = runtime.configure_cpu_mode()
+        self.assertEqual(mode, {"threads": 0, "affinity": "0-3", "bf16_autocast": False, "quantize_int8": True})
+        self.assertEqual(unchanged, mode)
+
+    def test_local_model_signature_tracks_cpu_mode(self):
+        runtime = self.runtime
+        signatures = []
+        with tempfile.TemporaryDirectory() as temp, patch.object(
+            runtime, "ensure_model", return_value=Path(temp)
+        ), patch.object(runtime, "_cpu_supports_bf16", return_value=True), patch.dict(
+            runtime._CPU_MODE, {"bf16_autocast": False, "quantize_int8": False}
+        ):
+            for updates in ({}, {"bf16_autocast": True}, {"bf16_autocast": False, "quantize_int8": True}):
+                runtime.configure_cpu_mode(**updates)
+                signatures.append(runtime._local_model_signature("Qwen3.5-0.8B", "text", "cpu", None))
+        self.assertEqual(
+            [signature["cpu_mode"] for signature in signatures],
+            [["float32", "fp32_compute"], ["float32", "bf16_autocast"], ["int8", "fp32_compute"]],
+        )
+
+    @unittest.skipUnless(hasattr(os, "sched_setaffinity") and os.path.isdir("/proc/self/task"), "Linux only")
+    def test_cpu_affinity_pins_every_thread_when_applied_from_a_worker(self):
+        import threading
+
+        runtime = self.runtime
+        pinned = []
+        with patch.dict(runtime._CPU_MODE, {"threads": 0, "affinity": "0"}), patch.object(
+            runtime, "_CPU_THREADS_APPLIED", None
+        ), patch.object(
+            runtime.os, "sched_setaffinity", side_effect=lambda task, cores: pinned.append((task, set(cores)))
+        ), patch.object(runtime.torch, "set_num_threads"):
+            for _ in range(2):
+                worker = threading.Thread(target=runtime._apply_cpu_threads)
+                worker.start()
+                worker.join()
+        tasks = {task for task, _ in pinned}
+        self.assertIn(threading.get_native_id(), tasks)
+        self.assertTrue(all(cores == {0} for _, cores in pinned))
+        # Re-applied on every call rather than once per process.
+        self.assertEqual(sum(1 for task, _ in pinned if task == threading.get_native_id()), 2)
+
+    def _tiny_qwen35_vl(self):
+        """Random 2-layer Qwen3.5-VL with a word-level tokenizer; no weights are downloaded."""
+        import torch
+        from tokenizers import Tokenizer, models, pre_tokenizers
+        from transformers import PreTrainedTokenizerFast
+        from transformers.models.qwen3_5 import Qwen3_5Config, Qwen3_5ForConditionalGeneration
+        from transformers.models.qwen3_vl.processing_qwen3_vl import Qwen3VLProcessor
+        from transformers.processing_utils import ProcessorMixin
+
+        try:
+            from transformers.models.qwen2_vl.image_processing_pil_qwen2_vl import Qwen2VLImageProcessorPil as ImageProcessor
+        except ImportError:
+            from transformers.models.qwen2_vl.image_processing_qwen2_vl import Qwen2VLImageProcessor as ImageProcessor
+
+        special = ["<unk>", "<|image_pad|>", "<|video_pad|>", "<|vision_start|>", "<|vision_end|>", "<eos>"]
+        words = [f"w{i}" for i in range(100)] + ["user", "assistant", "describe", "system"]
+        vocab = {token: idx for idx, token in enumerate(special + words)}
+        backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+        backend.pre_tokenizer = pre_tokenizers.Whitespace()
+        tokenizer = PreTrainedTokenizerFast(
+            tokenizer_object=backend, unk_token="<unk>", eos_token="<eos>", pad_token="<eos>",
+            additional_special_tokens=special[1:5],
+        )
+        template = (
+            "{% for m in messages %}{{ m.role }} {% if m.content is string %}{{ m.content }}{% else %}"
+            "{% for c in m.content %}{% if c.type == 'image' %}<|vision_start|><|image_pad|><|vision_end|>"
+            "{% else %} {{ c.text }}{% endif %}{% endfor %}{% endif %} {% endfor %}assistant "
+        )
+        image_processor = ImageProcessor(patch_size=16, merge_size=2, temporal_patch_size=2, min_pixels=32 * 32, max_pixels=256 * 256)
+        # Without torchvision the video processor cannot be resolved, so skip the class check.
+        with patch.object(ProcessorMixin, "check_argument_for_proper_class", lambda *args, **kwargs: None):
+            processor = Qwen3VLProcessor(image_processor=image_processor, tokenizer=tokenizer, chat_template=template)
+        config = Qwen3_5Config(
+            text_config=dict(
+                vocab_size=len(vocab), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                num_attention_heads=4, num_key_value_heads=2, head_dim=16, linear_key_head_dim=16,
+                linear_value_head_dim=16, linear_num_key_heads=2, linear_num_value_heads=4,
+                layer_types=["linear_attention", "full_attention"], eos_token_id=5, pad_token_id=5,
+            ),
+            vision_config=dict(depth=1, hidden_size=32, intermediate_size=64, num_heads=2, out_hidden_size=64, num_position_embeddings=64),
+            image_token_id=1, video_token_id=2, vision_start_token_id=3, vision_end_token_id=4,
+        )
+        torch.manual_seed(0)
+        return Qwen3_5ForConditionalGeneration(config).eval(), tokenizer, processor
+
+    @unittest.skipUnless(importlib.util.find_spec("transformers.models.qwen3_5"), "transformers without Qwen3.5")
+    def test_cached_vision_embeddings_match_uncached_generation(self):
+        import torch
+
+        runtime = self.runtime
+        model, tokenizer, processor = self._tiny_qwen35_vl()
+        images = [Image.effect_noise((120, 90), 40).convert("RGB"), Image.effect_noise((64, 64), 80).convert("RGB")]
+        kwargs = dict(
+            variant="tiny", device="cpu", attention_backend=None, images=images, text_prompt="describe",
+            max_tokens=8, temperature=0.0, top_p=1.0, repetition_penalty=1.0, seed=1,
+            max_pixels=128 * 128, min_pixels=0,
+        )
+        captured = []
+        vision_calls = []
+        generate = model.generate
+
+        def record_generate(**inputs):
+            captured.append({"input_ids": inputs["input_ids"].clone(), "cached": "mm_encoder_outputs" in inputs})
+            return generate(**inputs)
+
+        def record_positions(module, args, inputs):
+            if "positions" not in captured[-1]:
+                captured[-1]["positions"] = inputs["position_ids"].clone()
+
+        model.model.language_model.register_forward_pre_hook(record_positions, with_kwargs=True)
+        model.model.visual.register_forward_hook(lambda *args: vision_calls.append(1))
+        runs = []
+        with patch.object(model, "generate", side_effect=record_generate), patch.object(
+            runtime, "load_vl_model", return_value=(model, tokenizer, processor, "cpu")
+        ), patch.dict(runtime._MODEL_CACHE["vl"], {"signature": ("tiny",)}), patch.dict(
+            runtime._VISION_CACHE, clear=True
+        ), patch.object(runtime, "VISION_CACHE_MAX_BYTES", 0):
+            for size in (0, 4, 4):
+                with patch.object(runtime, "VISION_CACHE_SIZE", size):
+                    runs.append((runtime._generate_vision_text(**kwargs), len(vision_calls)))
+            entry_bytes = runtime._vision_entry_bytes(next(iter(runtime._VISION_CACHE.values())))
+            runtime._VISION_CACHE.clear()
+            with patch.object(runtime, "VISION_CACHE_SIZE", 4), patch.object(runtime, "VISION_CACHE_MAX_BYTES", entry_bytes):
+                runtime._generate_vision_text(**kwargs)
+                capped = runtime.get_vision_cache_stats()
+        self.assertEqual([item["cached"] for item in captured[:3]], [False, True, True])
+        for item in captured[1:3]:
+            self.assertTrue(torch.equal(item["input_ids"], captured[0]["input_ids"]))
+            self.assertTrue(torch.equal(item["positions"], captured[0]["positions"]))
+        self.assertEqual(runs[0][0], runs[1][0])
+        self.assertEqual(runs[1][0], runs[2][0])
+        # The third run is served from the cache without running the vision tower.
+        self.assertEqual(runs[2][1], runs[1][1])
+        self.assertEqual(capped["entries"], 1)
+        self.assertLessEqual(capped["bytes"], entry_bytes)
+
+    def test_load_waits_for_preload_and_hits_its_cache(self):
+        import threading
+
+        runtime = self.runtime
+        release = threading.Event()
+        loading = threading.Event()
+        calls = []
+
+        def fake_load(variant, device, attention_backend=None):
+            # Mirrors _load_text_model: return the cached model when the signature matches.
+            cache = runtime._MODEL_CACHE["text"]
+            signature = (variant, device)
+            if cache["model"] is not None and cache["signature"] == signature:
+                calls.append("hit")
+                return cache["model"], cache["tokenizer"], device
+            calls.append("load")
+            loading.set()
+            release.wait(5)
+            cache.update(model=object(), tokenizer=object(), signature=signature)
+            return cache["model"], cache["tokenizer"], device
+
+        results = []
+        with patch.dict(runtime._MODEL_CACHE["text"], {"model": None, "tokenizer": None, "signature": None}), patch.object(
+            runtime, "_load_text_model", side_effect=fake_load
+        ), patch.dict(runtime._PRELOAD_THREADS, clear=True), patch.object(runtime, "_log_major"):
+            self.assertTrue(runtime.preload("Qwen3.5-0.8B", mode="text", device="cpu"))
+            self.assertTrue(loading.wait(5))
+            waiter = threading.Thread(target=lambda: results.append(runtime.load_text_model("Qwen3.5-0.8B", "cpu")))
+            waiter.start()
+            waiter.join(0.2)
+            self.assertTrue(waiter.is_alive())
+            release.set()
+            waiter.join(5)
+            runtime.wait_for_preloads(5)
+            preloaded = runtime._MODEL_CACHE["text"]["model"]
+        self.assertEqual(calls, ["load", "hit"])
+        self.assertIs(results[0][0], preloaded)
+
+    def test_preload_thread_leaves_comfy_models_and_cuda_stats_alone(self):
+        import threading
+        from unittest.mock import MagicMock
+
+        runtime = self.runtime
+        model_management = MagicMock()
+        cuda = runtime.torch.cuda
+
+        def background_load():
+            runtime._prepare_cuda_for_load()
+            profiler = runtime._ModelLoadProfiler("text", "Qwen3.5-0.8B", "cuda", None)
+            with profiler.stage("from_pretrained"):
+                pass
+
+        with patch.object(runtime, "model_management", model_management), patch.object(
+            cuda, "is_available", return_value=True
+        ), patch.object(cuda, "empty_cache"), patch.object(cuda, "device_count", return_value=0), patch.object(
+            cuda, "reset_peak_memory_stats"
+        ) as reset_peak, patch.object(cuda, "synchronize"):
+            worker = threading.Thread(target=background_load, name=f"{runtime._PRELOAD_THREAD_PREFIX}text-test")
+            worker.start()
+            worker.join(5)
+            model_management.unload_all_models.assert_not_called()
+            model_management.soft_empty_cache.assert_not_called()
+            reset_peak.assert_not_called()
+            runtime._prepare_cuda_for_load()
+        model_management.unload_all_models.assert_called_once()
+
+    def test_unload_model_keeps_the_other_kind(self):
+        runtime = self.runtime
+        text_model, vl_model = object(), object()
+        with patch.dict(runtime._MODEL_CACHE["text"], {"model": text_model, "tokenizer": object(), "signature": ("t",)}), patch.dict(
+            runtime._MODEL_CACHE["vl"], {"model": vl_model, "processor": object(), "tokenizer": object(), "signature": ("v",)}
+        ), patch.object(runtime, "_log_major"):
+            runtime.unload_model("text")
+            text_after = runtime._MODEL_CACHE["text"]["model"]
+            vl_after = runtime._MODEL_CACHE["vl"]["model"]
+            with self.assertRaises(ValueError):
+                runtime.unload_model("draft")
+        self.assertIsNone(text_after)
+        self.assertIs(vl_after, vl_model)
+
+    def test_model_load_stats_record_stages_and_background_loads(self):
+        import threading
+
+        runtime = self.runtime
+
+        def profile(kind):
+            profiler = runtime._ModelLoadProfiler(kind, "Qwen3.5-0.8B", "cpu", None)
+            profiler.add_stage("ensure_model", 0.25)
+            with profiler.stage("from_pretrained"):
+                buffer = bytearray(1024 * 1024)
+            del buffer
+            profiler.finish()
+
+        with patch.dict(runtime._MODEL_LOAD_STATS, {"text": None, "vl": None}), patch.object(runtime, "_log_major"):
+            self.assertEqual(runtime.get_model_load_stats(), {})
+            self.assertEqual(runtime.get_model_load_stats("vl"), {})
+            profile("text")
+            worker = threading.Thread(target=profile, args=("vl",), name=f"{runtime._PRELOAD_THREAD_PREFIX}vl-test")
+            worker.start()
+            worker.join()
+            text = runtime.get_model_load_stats("text")
+            text["stages"][0]["seconds"] = 99.0
+            stats = runtime.get_model_load_stats()
+        self.assertEqual(sorted(stats), ["text", "vl"])
+        self.assertEqual([item["stage"] for item in stats["text"]["stages"]], ["ensure_model", "from_pretrained"])
+        # Returned records are copies.
+        self.assertEqual(stats["text"]["stages"][0]["seconds"], 0.25)
+        self.assertIsNone(stats["text"]["stages"][0]["rss_delta_mib"])
+        self.assertIsNone(stats["text"]["stages"][1]["vram_peak_delta_mib"])
+        self.assertIsNone(stats["text"]["cuda_device"])
+        self.assertFalse(stats["text"]["concurrent"])
+        self.assertTrue(stats["vl"]["concurrent"])
+        self.assertGreaterEqual(stats["text"]["total_seconds"], 0.0)
+
 if __name__ == "__main__":
     unittest.main()